@@ -1,38 +1,66 @@
-from flask import Flask, redirect, request, make_response, abort, jsonify
-from sqlalchemy.exc import IntegrityError
-from flask_migrate import Migrate
+import os
+
+from flask import Blueprint, Flask, current_app, redirect, request, make_response, abort, jsonify, url_for
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError, OperationalError
 from flask_cors import CORS
 from flask_login import LoginManager, login_required, login_user, logout_user, current_user
 from flask_bcrypt import Bcrypt
 from config import ApplicationConfig
-import cloudinary
-import cloudinary.uploader
-from utils import cloudinary_config
-from models import db, CorruptionReport, User, PublicPetition
+from models import db, CorruptionReport, User, PublicPetition, CONTENT_HASH_FIELDS, compute_content_hash
+from pagination import PaginationError, apply_filters, paginated_response
+from export import export_response
+from serializers import init_json_provider
+from cache import response_cache
+from passwords import PasswordHasher, PasswordHasherBusy
+from auth import user_cache, issue_token, load_user_from_token
+from uploads import upload_queue
+from batch import BatchError, USER_EDITABLE_FIELDS, validate_items, batch_create, batch_update
+from geo import encode_geohash, cluster_query
+from stats import StatsChanges, stat_key, current_stats, stats_cli
+from search import search_response
+from pool import pool_stats, statement_timeout, is_statement_timeout, dispose_pool_after_fork
+from metrics import metrics
+from events import EventStreamsFull, EventStreamsUnsupported, event_broker, report_event
+from replicas import read_replica, replica_router, replicas_cli
+from sync import changes_response, sync_cli
+from moderation import ModerationError, parse_moderation, moderate
+from versioning import (PreconditionError, if_match_version, version_etag, update_row, delete_row,
+                        missing_or_conflict)
 from functools import wraps
 
 
-# initiate flask app
-app = Flask(__name__)
-app.config.from_object(ApplicationConfig)
-CORS(app)
+# the routes; create_app() puts them on an app
+api = Blueprint('api', __name__)
 
-# initiate 3rd party services
-db.init_app(app)
-migrate= Migrate(app, db)
-bcrypt = Bcrypt(app)
-  
-# initiate flask_login
+bcrypt = Bcrypt()
+passwords = PasswordHasher()
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'api.login'
+
+
+# bcrypt pool is saturated; tell the client to back off briefly
+@api.app_errorhandler(PasswordHasherBusy)
+def password_hasher_busy(e):
+    response = make_response({'error' : 'The server is busy. Please try again shortly.'}, 503)
+    response.headers['Retry-After'] = '1'
+    return response
+
+# a query ran past the route's statement timeout
+@api.app_errorhandler(OperationalError)
+def database_operational_error(e):
+    if not is_statement_timeout(e):
+        raise e
+    db.session.rollback()
+    return jsonify({'error': 'The request took too long. Please narrow it down and try again.'}), 503
 
 
 # decorator to protect admin routes
 def admin_required(func):
     @wraps(func)
     def decorated_view(*args, **kwargs):
-        if not current_user.is_admin:
+        # token users carry their role, so this needs no database lookup
+        if not current_user.is_authenticated or not current_user.is_admin:
             abort(403)  # Forbidden
         return func(*args, **kwargs)
     return decorated_view
@@ -40,18 +68,24 @@ def admin_required(func):
 # function to load logged in user
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.load(int(user_id))
+
+# bearer tokens, when enabled, authenticate without a database lookup
+@login_manager.request_loader
+def load_user_from_request(request):
+    if current_app.config['AUTH_TOKENS_ENABLED']:
+        return load_user_from_token()
+    return None
 
 
 # user registration route
-@app.route('/user/register', methods=['POST'])
+@api.route('/user/register', methods=['POST'])
 def user_register():
     data = request.json
 
     fullname= data.get('fullName')
     email = data.get('email')
     password = data.get('password')
-    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
     role = 'user'
 
     # ensure email is unique
@@ -59,6 +93,9 @@ def user_register():
     if existing_user:
         return make_response({'error' : 'The email provided is already linked to an existing account. Please try again'}, 400)
 
+    # hashed only once the email is known to be free
+    hashed_password = passwords.generate_password_hash(password) if password else None
+
     if fullname and email and hashed_password and role:
         new_user = User(fullname=fullname, email=email, password=hashed_password, role=role)
         db.session.add(new_user)
@@ -73,14 +110,13 @@ def user_register():
 
 
 # admin registration route
-@app.route('/admin/register', methods=['POST'])
+@api.route('/admin/register', methods=['POST'])
 def admin_register():
     data = request.json
 
     fullname= data.get('fullName')
     email = data.get('email')
     password = data.get('password')
-    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
     staff_no = data.get('staff_no')
     role = 'admin'
 
@@ -89,6 +125,9 @@ def admin_register():
     if existing_user:
         return make_response({'error' : 'The email provided is already linked to an existing account. Please try again'}, 400)
 
+    # hashed only once the email is known to be free
+    hashed_password = passwords.generate_password_hash(password) if password else None
+
     if fullname and email and hashed_password and staff_no and role:
         new_user = User(fullname=fullname, email=email, password=hashed_password, id_passport_no=staff_no, role=role)
         db.session.add(new_user)
@@ -103,7 +142,7 @@ def admin_register():
 
 
 # login view
-@app.route('/login', methods=['GET', 'POST'])
+@api.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'GET':
         # print(request.args.get('next'))
@@ -120,26 +159,35 @@ def login():
 
         user = User.query.filter_by(email=email).first()
 
-        if user and bcrypt.check_password_hash(user.password, password):
+        if user and passwords.check_password_hash(user.password, password):
+            # upgrade hashes made with an older BCRYPT_LOG_ROUNDS while we have the password
+            if passwords.needs_rehash(user.password):
+                user.password = passwords.generate_password_hash(password)
+                db.session.commit()
+
             login_user(user)
             if current_user.is_admin:
-                return make_response({'message' : f'Login for Admin {current_user.fullname} successful!',
-                                'user_id' : current_user.id,
-                                'username' : current_user.fullname,
-                                'email' : current_user.email,
-                                'role' : current_user.role}, 200)
-            
-            return make_response({'message' : f'Login for User {current_user.fullname} successful!',
-                                'user_id' : current_user.id,
-                                'username' : current_user.fullname,
-                                'email' : current_user.email,
-                                'role' : current_user.role}, 200)
+                response = {'message' : f'Login for Admin {current_user.fullname} successful!',
+                            'user_id' : current_user.id,
+                            'username' : current_user.fullname,
+                            'email' : current_user.email,
+                            'role' : current_user.role}
+            else:
+                response = {'message' : f'Login for User {current_user.fullname} successful!',
+                            'user_id' : current_user.id,
+                            'username' : current_user.fullname,
+                            'email' : current_user.email,
+                            'role' : current_user.role}
+
+            if current_app.config['AUTH_TOKENS_ENABLED']:
+                response['token'] = issue_token(user)
+            return make_response(response, 200)
         else:
             return make_response({'error' : 'Password or username incorrect. Please try again.'}, 400)
 
     
 # logout view
-@app.route('/logout', methods=['POST'])
+@api.route('/logout', methods=['POST'])
 # @login_required
 def logout():
     print(current_user)
@@ -147,159 +195,290 @@ def logout():
     return make_response({'message' : 'User has been logged out successfully!'}, 200)
   
 
+# column values for a new report or petition from a request body; latitude
+# and longitude fall back to their 0.0 column default like the ORM did
+def new_record_values(data):
+    values = {
+        'user_id': data.get('user_id'),
+        'govt_agency': data.get('govt_agency'),
+        'county': data.get('county'),
+        'title': data.get('title'),
+        'description': data.get('description'),
+        'status': 'Pending',
+        'latitude': data['latitude'] if data.get('latitude') is not None else 0.0,
+        'longitude': data['longitude'] if data.get('longitude') is not None else 0.0,
+        'media': data.get('media', [None]),
+    }
+    values['geohash'] = encode_geohash(values['latitude'], values['longitude'])
+    return values
+
+
 ## CorruptionReports Routes
-@app.route('/corruption_reports', methods=['GET'])
+@api.route('/corruption_reports', methods=['GET'])
 # @admin_required
 # @login_required
+@read_replica
+@response_cache.cached(CorruptionReport.__tablename__)
+@statement_timeout('STATEMENT_TIMEOUT_READ_MS')
 def get_all_corruption_reports():
-    reports = CorruptionReport.query.all()
-    return jsonify([{
-        'id': report.id,
-        'govt_agency': report.govt_agency,
-        'county': report.county,
-        'longitude': report.longitude,
-        'latitude': report.latitude,
-        'title': report.title,
-        'description': report.description,
-        'media': report.media,
-        'status': report.status,
-        'user_id': report.user_id,
-        'admin_comments' : report.admin_comments
-    } for report in reports]), 200
-
-@app.route('/corruption_reports', methods=['POST'])
+    return paginated_response(CorruptionReport.query, CorruptionReport, CorruptionReport.to_dict)
+
+# this route streams every report as NDJSON or CSV for analysts
+@api.route('/corruption_reports/export', methods=['GET'])
+# @admin_required
+# @login_required
+@read_replica
+@statement_timeout('STATEMENT_TIMEOUT_EXPORT_MS')
+def export_corruption_reports():
+    return export_response(CorruptionReport.query, CorruptionReport, 'corruption_reports')
+
+# this route returns the reports created, changed or deleted since ?since=,
+# so clients that keep a copy only fetch what changed
+@api.route('/corruption_reports/changes', methods=['GET'])
+# @login_required
+@read_replica
+@statement_timeout('STATEMENT_TIMEOUT_READ_MS')
+def corruption_report_changes():
+    return changes_response(CorruptionReport)
+
+@api.route('/corruption_reports', methods=['POST'])
 # @login_required
 def create_corruption_report():
-    data = request.json
-    # Check if a similar report already exists
-    existing_report = CorruptionReport.query.filter_by(
-        user_id=data.get("user_id"),
-        govt_agency=data.get("govt_agency"),
-        county=data.get("county"),
-        title=data.get("title"),
-        description=data.get("description"),
-        latitude=data.get("latitude"),
-        longitude=data.get("longitude"),
-    ).first()
-
-    if existing_report:
-        return jsonify({'error': 'Corruption report already exists'}), 409
-
-    # Create a new report
-    new_report = CorruptionReport(
-        user_id=data.get("user_id"),
-        govt_agency=data.get("govt_agency"),
-        county=data.get("county"),
-        title=data.get("title"),
-        description=data.get("description"),
-        status='Pending',
-        latitude=data.get("latitude"),
-        longitude=data.get("longitude"),
-        media = data.get('media', [None])
-    )
-
-    db.session.add(new_report)
+    values = new_record_values(request.json)
+
+    # a single INSERT ... ON CONFLICT DO NOTHING on the content hash both
+    # detects duplicates and stays correct under concurrent submissions
     try:
+        report_id = CorruptionReport.insert_unique(values)
+        if report_id is None:
+            db.session.rollback()
+            return jsonify({'error': 'Corruption report already exists'}), 409
+
+        StatsChanges(CorruptionReport).add(values).apply()
         db.session.commit()
-        return jsonify({'message': 'Corruption report created successfully', 'report_id': new_report.id}), 201
+        response_cache.invalidate(CorruptionReport.__tablename__, values['user_id'])
+        return jsonify({'message': 'Corruption report created successfully', 'report_id': report_id}), 201
     
     except IntegrityError:
         db.session.rollback()
         return jsonify({'error': 'Failed to create corruption report due to database integrity error'}), 500
 
 
+# batch routes: take a JSON array of items and answer with one
+# {index, status, id | error} result per item
+def batch_create_response(model, items):
+    try:
+        validate_items(items, current_app.config['BATCH_MAX_ITEMS'])
+        stats = StatsChanges(model)
+        results, created = batch_create(model, items, new_record_values, stats)
+        stats.apply()
+        db.session.commit()
+    except BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'This error occurred due to database integrity issues'}), 500
+
+    for user_id in {row['user_id'] for row in created}:
+        response_cache.invalidate(model.__tablename__, user_id)
+    return jsonify({'created': len(created), 'results': results}), 200
+
+
+def batch_update_response(model, items):
+    try:
+        validate_items(items, current_app.config['BATCH_MAX_ITEMS'])
+        stats = StatsChanges(model)
+        results, updated = batch_update(model, items, stats)
+        stats.apply()
+        db.session.commit()
+    except BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'This error occurred due to database integrity issues'}), 500
+
+    for user_id in {row['user_id'] for row in updated}:
+        response_cache.invalidate(model.__tablename__, user_id)
+    return jsonify({'updated': len(updated), 'results': results}), 200
+
+
+# single-row writes: one UPDATE/DELETE ... WHERE id [AND version] RETURNING
+# statement each; with an If-Match header, a record changed since the
+# client read it answers 409 instead of being overwritten
+def versioned_failure(model, id, not_found_message):
+    status, current = missing_or_conflict(model, id)
+    db.session.rollback()
+    if status == 404:
+        return jsonify({'error': not_found_message}), 404
+    response = jsonify({'error': 'This record was changed by someone else. Reload it and try again.',
+                        'version': current})
+    response.headers['ETag'] = version_etag(current)
+    return response, 409
+
+
+def updated_response(model, old, row, message):
+    StatsChanges(model).move(stat_key(old), row).apply()
+    db.session.commit()
+    response_cache.invalidate(model.__tablename__, row['user_id'])
+    response = jsonify({'message': message, 'version': row['version']})
+    response.headers['ETag'] = version_etag(row['version'])
+    return response, 200
+
+
+def user_update_response(model, id, data, message, not_found_message):
+    try:
+        version = if_match_version()
+    except PreconditionError as e:
+        return jsonify({'error': str(e)}), 400
+
+    values = {field: data[field] for field in USER_EDITABLE_FIELDS if data.get(field) is not None}
+    returning = [getattr(model, field) for field in CONTENT_HASH_FIELDS]
+    try:
+        result = update_row(model, id, values, version,
+                            returning + [model.status, model.content_hash, model.geohash],
+                            old_fields=CONTENT_HASH_FIELDS)
+        if result is None:
+            return versioned_failure(model, id, not_found_message)
+        old, row = result
+        # the content hash and geohash are computed in python, so an edit to
+        # the fields they cover needs a second, narrow UPDATE. The hash is
+        # only rewritten when a hashed field changed: rows the backfill left
+        # without one are copies of an older row and would collide with it
+        refreshed = {'geohash': encode_geohash(row['latitude'], row['longitude'])}
+        if any(old[field] != row[field] for field in CONTENT_HASH_FIELDS):
+            refreshed['content_hash'] = compute_content_hash(row)
+        if any(row[column] != value for column, value in refreshed.items()):
+            try:
+                db.session.execute(update(model).where(model.id == id).values(**refreshed)
+                                   .execution_options(synchronize_session=False))
+            except IntegrityError:
+                # the edit made it a copy of another record (unique content_hash)
+                db.session.rollback()
+                return jsonify({'error': 'Would duplicate an existing record'}), 409
+        return updated_response(model, old, row, message)
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": "This error occurred due to database integrity issues"}), 500
+
+
+def admin_update_response(model, id, data, message, not_found_message):
+    try:
+        version = if_match_version()
+    except PreconditionError as e:
+        return jsonify({'error': str(e)}), 400
+
+    values = {field: data[field] for field in ('status', 'admin_comments') if data.get(field) is not None}
+    try:
+        result = update_row(model, id, values, version,
+                            [model.id, model.status, model.county, model.govt_agency, model.admin_comments])
+        if result is None:
+            return versioned_failure(model, id, not_found_message)
+        # delivered to the owner's event streams once this commits
+        event_broker.publish([report_event(model, result[1])])
+        return updated_response(model, *result, message)
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": "This error occurred due to database integrity issues"}), 500
+
+
+def delete_response(model, id, message, not_found_message):
+    try:
+        version = if_match_version()
+    except PreconditionError as e:
+        return jsonify({'error': str(e)}), 400
+
+    row = delete_row(model, id, version)
+    if row is None:
+        return versioned_failure(model, id, not_found_message)
+    StatsChanges(model).remove(row).apply()
+    db.session.commit()
+    response_cache.invalidate(model.__tablename__, row['user_id'])
+    return jsonify({'message': message}), 200
+
+
+# moderation routes: move many rows to a new status in a few set-based
+# UPDATEs, skipping rows whose current status doesn't allow it
+def moderation_response(model, data):
+    try:
+        target, comments, ids, filters = parse_moderation(data, current_app.config['BATCH_MAX_ITEMS'])
+    except ModerationError as e:
+        return jsonify({'error': str(e)}), 400
+
+    stats = StatsChanges(model)
+    updated, rejected, not_found = moderate(model, target, comments, ids, filters, stats)
+    stats.apply()
+    event_broker.publish(report_event(model, row, comments) for row in updated)
+    db.session.commit()
+
+    for user_id in {row['user_id'] for row in updated}:
+        response_cache.invalidate(model.__tablename__, user_id)
+    response = {'updated': len(updated), 'ids': [row['id'] for row in updated]}
+    if ids is not None:
+        response.update({'rejected': rejected, 'not_found': not_found})
+    return jsonify(response), 200
+
+
+@api.route('/corruption_reports/batch', methods=['POST'])
+# @login_required
+@statement_timeout('STATEMENT_TIMEOUT_WRITE_MS')
+def batch_create_corruption_reports():
+    return batch_create_response(CorruptionReport, request.json)
+
+
+@api.route('/corruption_reports/batch', methods=['PATCH'])
+# @login_required
+@statement_timeout('STATEMENT_TIMEOUT_WRITE_MS')
+def batch_update_corruption_reports():
+    return batch_update_response(CorruptionReport, request.json)
+
+
 # this route returns all reports connected to a user
-@app.route('/corruption_reports/<int:user_id>/', methods=['GET'])
+@api.route('/corruption_reports/<int:user_id>/', methods=['GET'])
 # @login_required
+@read_replica
+@response_cache.cached(CorruptionReport.__tablename__, per_user=True)
+@statement_timeout('STATEMENT_TIMEOUT_READ_MS')
 def get_corruption_report_by_user(user_id):
-    reports = CorruptionReport.query.filter_by(user_id=user_id).all()
-    if reports == None:
-        return jsonify({'error': 'Corruption reports not found'}), 404
-    else:
-        return jsonify([{
-            'id': report.id,
-            'govt_agency': report.govt_agency,
-            'county': report.county,
-            'longitude': report.longitude,
-            'latitude': report.latitude,
-            'title': report.title,
-            'description': report.description,
-            'media': report.media,
-            'status': report.status,
-            'admin_comments' : report.admin_comments,
-            'user_id': report.user_id
-    } for report in reports]), 200
-
-
-@app.route('/corruption_reports/<int:report_id>', methods=['PUT', 'PATCH'])
+    reports = CorruptionReport.query.filter_by(user_id=user_id)
+    return paginated_response(reports, CorruptionReport, CorruptionReport.to_dict, exclude_filters=('user_id',))
+
+
+@api.route('/corruption_reports/<int:report_id>', methods=['PUT', 'PATCH'])
 # @login_required
 def user_update_corruption_report(report_id):
+    return user_update_response(CorruptionReport, report_id, request.json,
+                                'Corruption report updated successfully', 'Corruption report not found')
 
-    report = CorruptionReport.query.get(report_id)
 
-    if report:
-        data = request.json
-        if 'govt_agency' in data and data['govt_agency'] is not None:
-            report.govt_agency = data['govt_agency']
-        if 'county' in data and data['county'] is not None:
-            report.county = data['county']
-        if 'longitude' in data and data['longitude'] is not None:
-            report.longitude = data['longitude']
-        if 'latitude' in data and data['latitude'] is not None:
-            report.latitude = data['latitude']
-        if 'description' in data and data['description'] is not None:
-            report.description = data['description']
-        if 'media' in data and data['media'] is not None:
-            report.media = data['media']
-
-        try:
-            db.session.commit()
-            return make_response(
-                {"message": 'Corruption report updated successfully'}, 200
-            )
-        except IntegrityError:
-            db.session.rollback()
-            return jsonify({"error": "This error occurred due to database integrity issues"}), 500
-        
-    return jsonify({'error': 'Corruption report not found'}), 404
 
-
-@app.route('/admin_corruption_reports/<int:report_id>', methods=['PATCH'])
+@api.route('/admin_corruption_reports/<int:report_id>', methods=['PATCH'])
 # @admin_required
 # @login_required
 def admin_update_corruption_report(report_id):
+    return admin_update_response(CorruptionReport, report_id, request.json,
+                                 'Corruption report updated successfully', 'Corruption report not found')
 
-    report = CorruptionReport.query.get(report_id)
 
-    if report:
-        data = request.json
-        if 'status' in data and data['status'] is not None:
-            report.status = data['status']
-        if 'admin_comments' in data and data['admin_comments'] is not None:
-            report.admin_comments = data['admin_comments']
 
-        db.session.commit()
-        return jsonify({'message': 'Corruption report updated successfully'}), 200
-    
-    return jsonify({'error': 'Corruption report not found'}), 404
+# this route applies a status and comment to many reports: a list of ids,
+# or a filter such as every Pending report in one county
+@api.route('/admin_corruption_reports', methods=['PATCH'])
+# @admin_required
+# @login_required
+@statement_timeout('STATEMENT_TIMEOUT_WRITE_MS')
+def admin_moderate_corruption_reports():
+    return moderation_response(CorruptionReport, request.json)
 
 
-@app.route('/corruption_reports/<int:report_id>', methods=['DELETE'])
+@api.route('/corruption_reports/<int:report_id>', methods=['DELETE'])
 # @login_required
 def user_delete_corruption_report(report_id):
+    return delete_response(CorruptionReport, report_id,
+                           'Corruption report deleted successfully', 'Corruption report not found')
 
-    report = CorruptionReport.query.get(report_id)
-
-    if report:
-        db.session.delete(report)
-        db.session.commit()
-        return jsonify({'message': 'Corruption report deleted successfully'}), 200
-    
-    return jsonify({'error': 'Corruption report not found'}), 404
 
 
-cloudinary_config
-@app.route('/upload_report', methods=['POST'])
+@api.route('/upload_report', methods=['POST'])
 # @login_required
 def upload_file():
     if 'file' not in request.files:
@@ -309,156 +488,223 @@ def upload_file():
     if file.filename=='':
         return jsonify ({'error': 'No selected file'}), 400
     
+    # the upload itself runs in the background; poll the job for the url
+    return upload_job_response(upload_queue.submit(file))
+
+
+# 202 with the job to poll, or 200 with the url straight away when the same
+# file was uploaded before
+def upload_job_response(job):
+    body = {'job_id': job['id'], 'status': job['status'],
+            'status_url': url_for('.get_upload_job', job_id=job['id'])}
+    if job['status'] == 'done':
+        body['url'] = job['url']
+        return jsonify(body), 200
+    return jsonify(body), 202
+
+
+# this route reports the progress of an upload and its url once done
+@api.route('/uploads/<job_id>', methods=['GET'])
+# @login_required
+def get_upload_job(job_id):
+    job = upload_queue.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Upload job not found'}), 404
+    return jsonify(job), 200
+
+
+
+# this route aggregates reports or petitions into point counts per map cell;
+# takes the list route filters (including bbox) plus the map zoom level
+@api.route('/map/clusters', methods=['GET'])
+@read_replica
+@statement_timeout('STATEMENT_TIMEOUT_READ_MS')
+def get_map_clusters():
+    models = {'corruption_reports': CorruptionReport, 'public_petitions': PublicPetition}
+    model = models.get(request.args.get('type', 'corruption_reports'))
+    if model is None:
+        return jsonify({'error': "'type' must be corruption_reports or public_petitions"}), 400
+
     try:
-        #upload the file to cloudinary
-        result= cloudinary.uploader.upload(file)        
-        return jsonify ({'url': result['secure_url']})
-    except Exception as e:
-        return jsonify ({'error': str(e)})
+        zoom = int(request.args.get('zoom', 6))
+    except ValueError:
+        return jsonify({'error': "'zoom' must be an integer"}), 400
+
+    try:
+        query = apply_filters(model.query, model)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
+    precision, clusters = cluster_query(query, model, zoom)
+    return jsonify({'precision': precision, 'clusters': clusters}), 200
+
+
+# this route searches report and petition titles and descriptions, best
+# matches first; ?type= limits it to one table
+@api.route('/search', methods=['GET'])
+@read_replica
+@statement_timeout('STATEMENT_TIMEOUT_READ_MS')
+def search():
+    return search_response()
+
+
+# this route serves dashboard counts by status, county and govt_agency from
+# the incrementally maintained summary table
+@api.route('/admin/stats', methods=['GET'])
+# @admin_required
+# @login_required
+@read_replica
+@statement_timeout('STATEMENT_TIMEOUT_READ_MS')
+def admin_get_stats():
+    return jsonify(current_stats()), 200
+
+
+
+# this route reports this worker's connection pool usage: checkouts, time
+# spent waiting for a connection, timeouts and new connections
+@api.route('/admin/pool', methods=['GET'])
+# @admin_required
+# @login_required
+def admin_get_pool_stats():
+    return jsonify(pool_stats.snapshot(db.engine.pool)), 200
+
+
+
+# this route serves request, SQL and pool metrics in Prometheus text format
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+    response = make_response(metrics.render())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+
+# server-sent events with the status and admin comment changes of the
+# user's reports and petitions, so clients don't have to poll for them
+@api.route('/events/<int:user_id>', methods=['GET'])
+# @login_required
+def get_events(user_id):
+    try:
+        return event_broker.stream(user_id)
+    except EventStreamsFull:
+        response = make_response({'error' : 'The server is busy. Please try again shortly.'}, 503)
+        response.headers['Retry-After'] = '5'
+        return response
+    except EventStreamsUnsupported:
+        response = make_response({'error' : 'Event streams are not available on this server.'}, 503)
+        response.headers['Retry-After'] = '60'
+        return response
 
 
-    
 ## Public Petitions
 
 # this route gets all public petitions
-@app.route('/public_petitions', methods=['GET'])
+@api.route('/public_petitions', methods=['GET'])
 # @admin_required
+@read_replica
+@response_cache.cached(PublicPetition.__tablename__)
+@statement_timeout('STATEMENT_TIMEOUT_READ_MS')
 def admin_get_all_public_petitions():
-    
-    public_petitions = []
-    for public_petition in PublicPetition.query.all():
-        public_petitions.append(public_petition.to_dict())
-    return jsonify(public_petitions), 200
+    return paginated_response(PublicPetition.query, PublicPetition, PublicPetition.to_dict)
+
+# this route streams every public petition as NDJSON or CSV
+@api.route('/public_petitions/export', methods=['GET'])
+# @admin_required
+@read_replica
+@statement_timeout('STATEMENT_TIMEOUT_EXPORT_MS')
+def export_public_petitions():
+    return export_response(PublicPetition.query, PublicPetition, 'public_petitions')
+
+# this route returns the petitions created, changed or deleted since ?since=
+@api.route('/public_petitions/changes', methods=['GET'])
+# @login_required
+@read_replica
+@statement_timeout('STATEMENT_TIMEOUT_READ_MS')
+def public_petition_changes():
+    return changes_response(PublicPetition)
 
 # this route gets all the reports published by a user
-@app.route('/public_petitions/<int:user_id>/', methods=['GET'])
+@api.route('/public_petitions/<int:user_id>/', methods=['GET'])
 # @login_required
+@read_replica
+@response_cache.cached(PublicPetition.__tablename__, per_user=True)
+@statement_timeout('STATEMENT_TIMEOUT_READ_MS')
 def get_public_petitions_by_user_id(user_id):
 
-    public_petitions = PublicPetition.query.filter_by(user_id=user_id).all()
+    public_petitions = PublicPetition.query.filter_by(user_id=user_id)
+    return paginated_response(public_petitions, PublicPetition, PublicPetition.to_dict,
+                              exclude_filters=('user_id',))
 
-    if public_petitions == None:
-        return {"error": "Public Petitions report not found"}, 404
-    else:
-        response = jsonify([petition.to_dict() for petition in public_petitions]), 200
-        return response
-
-@app.route('/public_petitions', methods=['POST'])
+@api.route('/public_petitions', methods=['POST'])
 # @login_required
 def user_post_public_petitions():
-    
-    print(request.json.get("media"))
-
-    existing_petition = PublicPetition.query.filter_by(
-        user_id=request.json.get("user_id"),
-        govt_agency=request.json.get("govt_agency"),
-        county=request.json.get("county"),
-        title=request.json.get("title"),
-        description=request.json.get("description"),
-        latitude=request.json.get("latitude"),
-        longitude=request.json.get("longitude"),
-    ).first()
-
-    if existing_petition:
-        return make_response(
-            {"error": "This Intervention Record already exists."}, 409
-        )
-    new_public_petition = PublicPetition(
-        
-        user_id=request.json.get("user_id"),
-        govt_agency=request.json.get("govt_agency"),
-        county=request.json.get("county"),
-        title=request.json.get("title"),
-        description=request.json.get("description"),
-        status='Pending',
-        latitude=request.json.get("latitude"),
-        longitude=request.json.get("longitude"),
-        media = request.json.get('media', [None])
-    )
-    db.session.add(new_public_petition) 
+    values = new_record_values(request.json)
 
     try:
+        petition_id = PublicPetition.insert_unique(values)
+        if petition_id is None:
+            db.session.rollback()
+            return make_response(
+                {"error": "This Intervention Record already exists."}, 409
+            )
+
+        StatsChanges(PublicPetition).add(values).apply()
         db.session.commit()
+        response_cache.invalidate(PublicPetition.__tablename__, values['user_id'])
         response = {"message": "Successfully created"}
         return make_response(response, 201)
     except IntegrityError:
+        db.session.rollback()
         return {"error": "This error occured due to database integrity issues."}, 500
     
     
         
 
 
-@app.route('/public_petitions/<int:id>', methods=['PATCH', 'DELETE'])
+@api.route('/public_petitions/batch', methods=['POST'])
 # @login_required
-def user_patch_delete_public_petition(id):
+@statement_timeout('STATEMENT_TIMEOUT_WRITE_MS')
+def batch_create_public_petitions():
+    return batch_create_response(PublicPetition, request.json)
 
-    public_petition = PublicPetition.query.filter(PublicPetition.id==id).first()
 
-    if public_petition == None:
-        return {"error": "Intervention report not found"}, 404
-    
-    else:
-        
-        if request.method == 'PATCH':
-            data = request.json
-            if 'govt_agency' in data and data['govt_agency'] is not None:
-                public_petition.govt_agency = data['govt_agency']
-            if 'county' in data and data['county'] is not None:
-                public_petition.county = data['county']
-            if 'longitude' in data and data['longitude'] is not None:
-                public_petition.longitude = data['longitude']
-            if 'latitude' in data and data['latitude'] is not None:
-                public_petition.latitude = data['latitude']
-            if 'description' in data and data['description'] is not None:
-                public_petition.description = data['description']
-            if 'media' in data and data['media'] is not None:
-                public_petition.media = data['media']
+@api.route('/public_petitions/batch', methods=['PATCH'])
+# @login_required
+@statement_timeout('STATEMENT_TIMEOUT_WRITE_MS')
+def batch_update_public_petitions():
+    return batch_update_response(PublicPetition, request.json)
 
-            try:
-                db.session.commit()
-                return jsonify({"message": "Intervention successfully updated"}), 200
-            
-            except IntegrityError:
-                db.session.rollback()
-                return {"error": "This error occurred due to database integrity issues"}, 500
-                    
-        elif request.method == "DELETE":
-            if public_petition:
-                db.session.delete(public_petition)
-                db.session.commit()
-                return jsonify({'message': 'Corruption report deleted successfully'}), 200
-            
-            return jsonify({'error': 'Public petition not found'}), 404
 
-    
+@api.route('/public_petitions/<int:id>', methods=['PATCH', 'DELETE'])
+# @login_required
+def user_patch_delete_public_petition(id):
+    if request.method == 'PATCH':
+        return user_update_response(PublicPetition, id, request.json,
+                                    'Intervention successfully updated', 'Intervention report not found')
+    return delete_response(PublicPetition, id, 'Corruption report deleted successfully', 'Intervention report not found')
 
-@app.route('/admin_public_petitions/<int:id>', methods=['PATCH'])
+
+
+@api.route('/admin_public_petitions/<int:id>', methods=['PATCH'])
 # @admin_required
 # @login_required
 def admin_patch_delete_public_petition(id):
+    return admin_update_response(PublicPetition, id, request.json,
+                                 'Intervention successfully updated', 'Intervention report not found')
 
-    public_petition = PublicPetition.query.filter(PublicPetition.id==id).first()
 
-    if public_petition is None:
-        return {"error": "Intervention report not found"}, 404
-    
-    if request.method == 'PATCH':
-        data = request.json
-        if 'status' in data and data['status'] is not None:
-            public_petition.status = data['status']
-        if 'admin_comments' in data and data['admin_comments'] is not None:
-            public_petition.admin_comments = data['admin_comments']
-        
-        try:
-            db.session.commit()
-            return jsonify({"message": "Intervention successfully updated"}), 200
-        
-        except IntegrityError:
-            db.session.rollback()
-            return jsonify({"error": "This error occurred due to database integrity issues"}), 500        
 
-cloudinary_config       
-@app.route('/upload_petition', methods=['POST'])
+# this route applies a status and comment to many petitions at once
+@api.route('/admin_public_petitions', methods=['PATCH'])
+# @admin_required
+# @login_required
+@statement_timeout('STATEMENT_TIMEOUT_WRITE_MS')
+def admin_moderate_public_petitions():
+    return moderation_response(PublicPetition, request.json)
+
+
+@api.route('/upload_petition', methods=['POST'])
 def upload_resolution_file():    
     if 'file' not in request.files:
         return jsonify({"error": "Oops!! There is no file."}), 400
@@ -468,17 +714,50 @@ def upload_resolution_file():
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
     
-    try:
-        #Upload file to cloudinary
-        result = cloudinary.uploader.upload(file)
-        return jsonify({'url': result['secure_url']})
-    except Exception as e:
-        return jsonify({'error':str(e)})
+    return upload_job_response(upload_queue.submit(file))
 
         
 
 
+# builds the app; run it with gunicorn 'app:create_app()', and the flask
+# command finds it on its own. `overrides` replaces settings read from the
+# environment
+def create_app(overrides=None):
+    app = Flask(__name__)
+    app.config.from_object(ApplicationConfig())
+    app.config.update(overrides or {})
+    init_json_provider(app)
+    CORS(app)
+
+    # initiate 3rd party services
+    db.init_app(app)
+    response_cache.init_app(app)
+    # flask db needs Migrate, which pulls in alembic; only the flask command
+    # pays for it, not every web worker
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    bcrypt.init_app(app)
+    passwords.init_app(app, bcrypt)
+
+    # initiate flask_login
+    login_manager.init_app(app)
+    user_cache.init_app(app)
+    upload_queue.init_app(app)
+    event_broker.init_app(app)
+    replica_router.init_app(app)
+    app.cli.add_command(stats_cli)
+    app.cli.add_command(replicas_cli)
+    app.cli.add_command(sync_cli)
+    metrics.init_app(app)
+
+    app.register_blueprint(api)
+    dispose_pool_after_fork(app)
+    return app
+
+
 if __name__ == '__main__':
+    app = create_app()
     with app.app_context():
         db.create_all()
-    app.run(port=5000, debug=True)
\ No newline at end of file
+    app.run(port=5000, debug=True)
@@ -0,0 +1,87 @@
+from flask import current_app, request
+from flask_login import UserMixin
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import event
+
+from cache import MemoryBackend
+from models import db, User
+
+
+# plain snapshot of a users row; unlike the ORM object it is safe to keep
+# between requests and sessions
+class SessionUser(UserMixin):
+    def __init__(self, id, role, fullname=None, email=None):
+        self.id = id
+        self.role = role
+        self.fullname = fullname
+        self.email = email
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.role, user.fullname, user.email)
+
+    @property
+    def is_admin(self):
+        return self.role == 'admin'
+
+
+# TTL'd, size-bounded cache behind flask_login's user_loader, so an
+# authenticated request doesn't cost a users lookup. Changes to a users row
+# made through the ORM drop that user from this worker's cache at once;
+# other workers see them once USER_CACHE_TTL runs out
+class UserCache:
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = MemoryBackend(app.config['USER_CACHE_MAX_ENTRIES'], ttl=app.config['USER_CACHE_TTL'])
+        app.extensions['user_cache'] = self
+
+    def load(self, user_id):
+        user = self.backend.get(user_id)
+        if user is None:
+            row = db.session.get(User, user_id)
+            if row is None:
+                return None
+            user = SessionUser.from_user(row)
+            self.backend.set(user_id, user)
+        return user
+
+    def invalidate(self, user_id):
+        if self.backend is not None:
+            self.backend.delete(user_id)
+
+
+user_cache = UserCache()
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_cached_user(mapper, connection, target):
+    user_cache.invalidate(target.id)
+
+
+# stateless signed tokens carrying id and role, sent as
+# "Authorization: Bearer <token>"; admin_required can authorise them without
+# touching the database. A role change only applies to tokens issued after
+# it, so keep AUTH_TOKEN_MAX_AGE short
+def token_serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='auth-token')
+
+
+def issue_token(user):
+    return token_serializer().dumps({'id': user.id, 'role': user.role})
+
+
+def load_user_from_token():
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None
+    try:
+        claims = token_serializer().loads(header[len('Bearer '):],
+                                          max_age=current_app.config['AUTH_TOKEN_MAX_AGE'])
+    except BadSignature:
+        return None
+    return SessionUser(claims['id'], claims['role'])
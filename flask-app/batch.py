@@ -0,0 +1,182 @@
+from sqlalchemy import select, update
+
+from geo import encode_geohash
+from models import db, User, CONTENT_HASH_FIELDS, compute_content_hash, insert_statement
+from stats import stat_key
+
+
+REQUIRED_FIELDS = ('user_id', 'govt_agency', 'county', 'title', 'description')
+# the fields a user may change on their own report or petition
+USER_EDITABLE_FIELDS = ('govt_agency', 'county', 'longitude', 'latitude', 'description', 'media')
+
+# rows per INSERT statement, well under postgres' 65535 bind parameter limit
+INSERT_CHUNK = 1000
+
+
+class BatchError(ValueError):
+    pass
+
+
+def validate_items(items, max_items):
+    if not isinstance(items, list) or not items:
+        raise BatchError('Expected a non-empty JSON array of items')
+    if len(items) > max_items:
+        raise BatchError(f'A batch can hold at most {max_items} items')
+
+
+def item_error(index, status, error):
+    return {'index': index, 'status': status, 'error': error}
+
+
+# checks an item's values against the column types and lengths, so a bad
+# item gets its own 400 instead of failing the whole multi-row statement
+def invalid_field(model, item, fields):
+    for field in fields:
+        value = item.get(field)
+        if value is None:
+            continue
+        if field in ('latitude', 'longitude'):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return f"'{field}' must be a number"
+        elif field == 'media':
+            if not isinstance(value, list) or not all(url is None or isinstance(url, str) for url in value):
+                return "'media' must be a list of URLs"
+        else:
+            length = getattr(model, field).type.length
+            if not isinstance(value, str):
+                return f"'{field}' must be a string"
+            if length is not None and len(value) > length:
+                return f"'{field}' is longer than {length} characters"
+    return None
+
+
+# inserts every valid, non-duplicate item with multi-row
+# INSERT ... ON CONFLICT DO NOTHING RETURNING statements in one transaction;
+# returns one result per item, in order, and the rows that were created
+def batch_create(model, items, build_values, stats):
+    results = [None] * len(items)
+    pending = {}
+
+    user_ids = {item.get('user_id') for item in items if isinstance(item, dict)}
+    known_users = set(db.session.execute(select(User.id).where(User.id.in_(
+        [user_id for user_id in user_ids if isinstance(user_id, int)]))).scalars())
+
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = item_error(index, 400, 'Item must be a JSON object')
+            continue
+        missing = [field for field in REQUIRED_FIELDS if not item.get(field)]
+        if missing:
+            results[index] = item_error(index, 400, f"Missing {', '.join(missing)}")
+            continue
+        if item['user_id'] not in known_users:
+            results[index] = item_error(index, 400, 'Unknown user_id')
+            continue
+        error = invalid_field(model, item, ('title',) + USER_EDITABLE_FIELDS)
+        if error is not None:
+            results[index] = item_error(index, 400, error)
+            continue
+
+        values = dict(build_values(item))
+        values['content_hash'] = compute_content_hash(values)
+        if values['content_hash'] in pending:
+            results[index] = item_error(index, 409, 'Duplicate of an earlier item in this batch')
+            continue
+        pending[values['content_hash']] = (index, values)
+
+    created = []
+    rows = [values for index, values in pending.values()]
+    for start in range(0, len(rows), INSERT_CHUNK):
+        statement = (insert_statement(model).values(rows[start:start + INSERT_CHUNK])
+                     .on_conflict_do_nothing(index_elements=['content_hash'])
+                     .returning(model.id, model.content_hash))
+        for row_id, content_hash in db.session.execute(statement):
+            index, values = pending.pop(content_hash)
+            results[index] = {'index': index, 'status': 201, 'id': row_id}
+            created.append(dict(values, id=row_id))
+            stats.add(values)
+
+    # whatever is left conflicted with a row already in the table
+    for index, values in pending.values():
+        results[index] = item_error(index, 409, 'Already exists')
+
+    return results, created
+
+
+# applies user edits ({"id": ..., <field>: ...}) with one SELECT of the
+# rows' hash columns and one UPDATE per row, conditional on the version that
+# SELECT saw; returns one result per item and the updated rows
+def batch_update(model, items, stats):
+    results = [None] * len(items)
+
+    ids = [item.get('id') for item in items if isinstance(item, dict) and isinstance(item.get('id'), int)]
+    columns = [model.id, model.status, model.version] + [getattr(model, field) for field in CONTENT_HASH_FIELDS]
+    existing = {row.id: row._asdict() for row in db.session.execute(select(*columns).where(model.id.in_(ids)))}
+
+    changes = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('id'), int):
+            results[index] = item_error(index, 400, "Item must be a JSON object with an integer 'id'")
+            continue
+        row = existing.get(item['id'])
+        if row is None:
+            results[index] = item_error(index, 404, 'Not found')
+            continue
+        error = invalid_field(model, item, USER_EDITABLE_FIELDS)
+        if error is not None:
+            results[index] = item_error(index, 400, error)
+            continue
+        if item['id'] in changes:
+            results[index] = item_error(index, 400, 'Duplicate id in this batch')
+            continue
+        # an item may carry the version it was read at, like If-Match
+        if item.get('version') is not None and item['version'] != row['version']:
+            results[index] = item_error(index, 409, 'Changed since it was read')
+            continue
+
+        values = {field: item[field] for field in USER_EDITABLE_FIELDS if item.get(field) is not None}
+        old_stat_key = stat_key(row)
+        # like a single edit, the hash is only rewritten when a hashed field
+        # changes, so rows the backfill left without one stay editable
+        hashed = any(row[field] != values[field] for field in CONTENT_HASH_FIELDS if field in values)
+        row.update(values)
+        if hashed:
+            values['content_hash'] = compute_content_hash(row)
+        if 'latitude' in values or 'longitude' in values:
+            values['geohash'] = encode_geohash(row['latitude'], row['longitude'])
+        changes[item['id']] = (index, values, row, old_stat_key)
+
+    # an edit may not turn a row into a copy of another one
+    new_hashes = [params['content_hash'] for index, params, row, old_stat_key in changes.values()
+                  if 'content_hash' in params]
+    owners = dict(db.session.execute(select(model.content_hash, model.id)
+                                     .where(model.content_hash.in_(new_hashes))).all())
+    seen = set()
+    for row_id, (index, params, row, old_stat_key) in list(changes.items()):
+        content_hash = params.get('content_hash')
+        if content_hash is None:
+            continue
+        if owners.get(content_hash, row_id) != row_id or content_hash in seen:
+            results[index] = item_error(index, 409, 'Would duplicate an existing record')
+            del changes[row_id]
+        seen.add(content_hash)
+
+    # each UPDATE only applies at the version the row was read at and bumps
+    # it, so an edit that landed in between is reported, not overwritten.
+    # psycopg2 runs an executemany as one statement per row anyway
+    for row_id, (index, params, row, old_stat_key) in list(changes.items()):
+        statement = (update(model)
+                     .where(model.id == row_id, model.version == row['version'])
+                     .values(**params, version=model.version + 1)
+                     .returning(model.version)
+                     .execution_options(synchronize_session=False))
+        version = db.session.execute(statement).scalar()
+        if version is None:
+            results[index] = item_error(index, 409, 'Changed since it was read')
+            del changes[row_id]
+            continue
+        row['version'] = version
+        results[index] = {'index': index, 'status': 200, 'id': row_id, 'version': version}
+        stats.move(old_stat_key, row)
+
+    return results, [row for index, params, row, old_stat_key in changes.values()]
@@ -0,0 +1,71 @@
+# Reports/sec through POST /corruption_reports one item at a time against
+# POST /corruption_reports/batch, using the flask test client so only the
+# app and the database are measured.
+#
+# Runs against the postgres database in DATABASE_URI, inside a throwaway
+# schema so the real tables are never touched:
+#
+#   python benchmarks/batch_create.py --items 2000
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+from app import create_app
+from models import db, User
+
+SCHEMA = 'bench_batch'
+app = create_app({'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'options': f'-csearch_path={SCHEMA}'}},
+                  'RESPONSE_CACHE_ENABLED': False})
+
+
+def make_items(prefix, count, user_id):
+    return [{'user_id': user_id, 'govt_agency': f'Agency {i % 40}', 'county': f'County {i % 47}',
+             'title': f'{prefix} report {i}', 'description': 'Lorem ipsum dolor sit amet ' * 8,
+             'latitude': -1.28, 'longitude': 36.82, 'media': ['https://example.com/a.jpg']}
+            for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=2000)
+    args = parser.parse_args()
+
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+            conn.execute(text(f'CREATE SCHEMA {SCHEMA}'))
+        db.create_all()
+        user = User(fullname='Bench', email='bench@example.com', password='x', role='user')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    client = app.test_client()
+    try:
+        start = time.perf_counter()
+        for item in make_items('single', args.items, user_id):
+            assert client.post('/corruption_reports', json=item).status_code == 201
+        single = args.items / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        response = client.post('/corruption_reports/batch', json=make_items('batch', args.items, user_id))
+        assert response.json['created'] == args.items
+        batched = args.items / (time.perf_counter() - start)
+    finally:
+        with app.app_context():
+            db.session.remove()
+            with db.engine.begin() as conn:
+                conn.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+
+    print(f'{args.items} reports')
+    print(f'per-item POST   {single:10,.0f} reports/sec')
+    print(f'batch POST      {batched:10,.0f} reports/sec  ({batched / single:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# Compares two benchmarks/loadtest.py result files route by route:
+#
+#   python benchmarks/compare.py before.json after.json --fail-over 10
+#
+# exits 1 when any route's p95 latency got worse by more than --fail-over
+# percent, so it can gate a CI job.
+import argparse
+import json
+import sys
+
+COLUMNS = ('rps', 'p50_ms', 'p95_ms', 'p99_ms')
+
+
+def change(before, after):
+    if not before:
+        return None
+    return (after - before) / before * 100
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--fail-over', type=float, default=None, help='p95 regression in percent')
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"before: {before['meta']['commit']} {before['meta']['date']}  "
+          f"after: {after['meta']['commit']} {after['meta']['date']}")
+    print(f"{'route':16}" + ''.join(f'{column:>26}' for column in COLUMNS))
+
+    regressions = []
+    for route in sorted(set(before['routes']) & set(after['routes'])):
+        old, new = before['routes'][route], after['routes'][route]
+        cells = []
+        for column in COLUMNS:
+            delta = change(old[column], new[column])
+            cells.append(f"{old[column]:>9} -> {new[column]:>9} {'' if delta is None else f'{delta:+.0f}%':>5}")
+        print(f'{route:16}' + ''.join(f'{cell:>26}' for cell in cells))
+
+        delta = change(old['p95_ms'], new['p95_ms'])
+        if args.fail_over is not None and delta is not None and delta > args.fail_over:
+            regressions.append(f'{route}: p95 {delta:+.0f}%')
+
+    if regressions:
+        print('regressions: ' + ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+# Requests in flight per CPU core under the default sync workers and under
+# the gevent workers, for routes that spend their time waiting on I/O.
+#
+# Starts the app under gunicorn with gunicorn.conf.py, once per worker class,
+# with two extra routes: /bench/upstream calls a local HTTP server that
+# answers after --io-ms (standing in for Cloudinary), and /bench/db runs
+# pg_sleep for --io-ms (a slow query; postgres only). Closed-loop clients at
+# each --levels concurrency hit them for --duration seconds. Since each
+# request waits --io-ms, requests/sec * io seconds / cores (Little's law) is
+# the number of requests a core kept in flight:
+#
+#   python benchmarks/concurrency.py
+#   python benchmarks/concurrency.py --database-uri postgresql://localhost/ireporter_bench --levels 1,16,64,256
+#
+# Without --database-uri only the upstream route is measured, on a throwaway
+# sqlite file. The postgres database isn't written to.
+import argparse
+import http.client
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from green import cpu_count
+
+
+# gunicorn 'benchmarks.concurrency:bench_app()'; the app plus the two I/O routes
+def bench_app():
+    from urllib.request import urlopen
+    from flask import request
+    from sqlalchemy import text
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    upstream = os.environ['BENCH_UPSTREAM_URL']
+
+    def upstream_route():
+        with urlopen(f"{upstream}/?ms={request.args.get('ms', 0, type=int)}", timeout=30) as response:
+            return {'upstream': response.read().decode('utf-8')}
+
+    def db_route():
+        seconds = request.args.get('ms', 0, type=int) / 1000
+        db.session.execute(text('SELECT pg_sleep(:seconds)'), {'seconds': seconds})
+        db.session.rollback()
+        return {'slept': seconds}
+
+    app.add_url_rule('/bench/upstream', 'bench_upstream', upstream_route)
+    app.add_url_rule('/bench/db', 'bench_db', db_route)
+    return app
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        ms = int(parse_qs(urlparse(self.path).query).get('ms', ['0'])[0])
+        time.sleep(ms / 1000)
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SlowServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-uri', help='postgres database to also measure /bench/db against')
+    parser.add_argument('--worker-classes', default='sync,gevent')
+    parser.add_argument('--levels', default='1,8,32,128', help='client concurrency levels')
+    parser.add_argument('--io-ms', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--db-pool-size', type=int, default=50, help='DB_POOL_SIZE for the gevent workers')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--upstream-port', type=int, default=8767)
+    parser.add_argument('--output', default='concurrency.json')
+    return parser.parse_args()
+
+
+def start_server(worker_class, args, env):
+    env = dict(env, WORKER_CLASS=worker_class, BIND=f'127.0.0.1:{args.port}')
+    if worker_class == 'gevent':
+        env.update(DB_POOL_SIZE=str(args.db_pool_size), DB_MAX_OVERFLOW='0')
+    # workers and threads come from gunicorn.conf.py, i.e. its defaults for
+    # the worker class
+    command = [sys.executable, '-m', 'gunicorn', '--log-level', 'warning', 'benchmarks.concurrency:bench_app()']
+    server = subprocess.Popen(command, cwd=APP_DIR, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'gunicorn ({worker_class}) exited during startup')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', args.port, timeout=1)
+            connection.request('GET', '/bench/upstream?ms=0')
+            connection.getresponse().read()
+            connection.close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f'gunicorn ({worker_class}) did not start within 30 seconds')
+
+
+def run_level(port, path, concurrency, warmup, duration):
+    start = time.monotonic() + warmup
+    stop = start + duration
+    samples = [[] for _ in range(concurrency)]
+
+    def client(index):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        while True:
+            began = time.monotonic()
+            if began >= stop:
+                break
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                status = 0
+            if began >= start:
+                samples[index].append((time.monotonic() - began, status))
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [sample for rows in samples for sample in rows]
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+
+def summarize(samples, duration, io_seconds, cores):
+    ok = sorted(elapsed * 1000 for elapsed, status in samples if status == 200)
+    rps = len(ok) / duration
+    return {
+        'requests': len(samples),
+        'errors': len(samples) - len(ok),
+        'rps': round(rps, 1),
+        'p50_ms': round(percentile(ok, 0.50), 1) if ok else None,
+        'p99_ms': round(percentile(ok, 0.99), 1) if ok else None,
+        'in_flight_per_core': round(rps * io_seconds / cores, 1),
+    }
+
+
+def main():
+    args = parse_args()
+    cores = cpu_count()
+    levels = [int(level) for level in args.levels.split(',')]
+    routes = ['upstream'] + (['db'] if args.database_uri else [])
+
+    upstream = SlowServer(('127.0.0.1', args.upstream_port), SlowHandler)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+
+    scratch = tempfile.mkdtemp(prefix='ireporter-concurrency-')
+    database_uri = args.database_uri or f'sqlite:///{os.path.join(scratch, "concurrency.sqlite")}'
+    env = dict(os.environ, DATABASE_URI=database_uri, SECRET_KEY=os.environ.get('SECRET_KEY', 'concurrency'),
+               BENCH_UPSTREAM_URL=f'http://127.0.0.1:{args.upstream_port}', METRICS_ENABLED='false',
+               RESPONSE_CACHE_ENABLED='false', PYTHONPATH=APP_DIR)
+    env.pop('WEB_CONCURRENCY', None)
+    env.pop('WORKER_THREADS', None)
+
+    results = {}
+    try:
+        for worker_class in args.worker_classes.split(','):
+            server = start_server(worker_class, args, env)
+            try:
+                for route in routes:
+                    for level in levels:
+                        samples = run_level(args.port, f'/bench/{route}?ms={args.io_ms}', level,
+                                            args.warmup, args.duration)
+                        row = summarize(samples, args.duration, args.io_ms / 1000, cores)
+                        results.setdefault(worker_class, {}).setdefault(route, {})[str(level)] = row
+                        print(f"{worker_class:8} {route:9} clients={level:<5} rps={row['rps']:<8} "
+                              f"p50={row['p50_ms']}ms p99={row['p99_ms']}ms errors={row['errors']} "
+                              f"in flight/core={row['in_flight_per_core']}")
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        upstream.shutdown()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    output = {
+        'meta': {'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'python': platform.python_version(),
+                 'cores': cores, 'database': database_uri.split(':', 1)[0],
+                 'args': {key: value for key, value in vars(args).items() if key != 'database_uri'}},
+        'results': results,
+        # the most requests a core kept in flight at any level
+        'peak_in_flight_per_core': {
+            worker_class: {route: max(row['in_flight_per_core'] for row in rows.values())
+                           for route, rows in by_route.items()}
+            for worker_class, by_route in results.items()},
+    }
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(json.dumps(output['peak_in_flight_per_core']))
+    print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+# Idle /events streams per worker: opens --streams server-sent event
+# connections against gevent workers, then measures what they cost (worker
+# memory per stream, latency of an ordinary request while they're open) and
+# how fast admin PATCHes reach the streams of the report owners.
+#
+# Seeds a fresh database like loadtest.py, so point --database-uri at a
+# scratch database, never a real one:
+#
+#   python benchmarks/events.py --streams 2000
+#   python benchmarks/events.py --database-uri postgresql://localhost/ireporter_bench --workers 4 --streams 5000
+#
+# Without --database-uri it runs on a throwaway sqlite file with the memory
+# backend, which only reaches streams on the worker that made the change,
+# so it uses a single worker there.
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import selectors
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from loadtest import git_commit, percentile, seed_database
+
+STATUSES = ['Pending', 'Under Investigation', 'Rejected', 'Resolved']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-uri')
+    parser.add_argument('--streams', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--reports', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=None, help='gevent workers (default 2, 1 on sqlite)')
+    parser.add_argument('--updates', type=int, default=200, help='admin PATCHes to deliver')
+    parser.add_argument('--port', type=int, default=8769)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='events.json')
+    return parser.parse_args()
+
+
+def start_server(args, env):
+    env = dict(env, WORKER_CLASS='gevent', WEB_CONCURRENCY=str(args.workers), BIND=f'127.0.0.1:{args.port}',
+               WORKER_CONNECTIONS=str(args.streams + 100), EVENTS_MAX_STREAMS=str(args.streams + 100))
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--log-level', 'warning'], cwd=APP_DIR, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('gunicorn exited during startup')
+        try:
+            request(args.port, 'GET', '/corruption_reports?limit=1')
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError('gunicorn did not start within 30 seconds')
+
+
+def request(port, method, path, body=None):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        connection.request(method, path, json.dumps(body) if body is not None else None,
+                           {'Content-Type': 'application/json'} if body is not None else {})
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def worker_rss(server):
+    # the workers are the gunicorn master's children
+    total = 0
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                status = dict(line.split(':', 1) for line in f if ':' in line)
+        except OSError:
+            continue
+        if int(status.get('PPid', '0').strip()) == server.pid:
+            total += int(status['VmRSS'].split()[0]) * 1024
+    return total
+
+
+# reads every stream from one thread; records when each (id, version)
+# change arrived on each stream
+class Streams:
+    def __init__(self, port, user_ids):
+        self.selector = selectors.DefaultSelector()
+        self.buffers = {}
+        self.ready = set()
+        self.arrivals = {}
+        self.lock = threading.Lock()
+        self.stopped = False
+        for index, user_id in enumerate(user_ids):
+            sock = socket.create_connection(('127.0.0.1', port))
+            sock.sendall(f'GET /events/{user_id} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+            sock.setblocking(False)
+            self.buffers[index] = b''
+            self.selector.register(sock, selectors.EVENT_READ, index)
+
+    def run(self):
+        while not self.stopped:
+            for key, mask in self.selector.select(timeout=0.5):
+                try:
+                    data = key.fileobj.recv(65536)
+                except BlockingIOError:
+                    continue
+                if not data:
+                    self.selector.unregister(key.fileobj)
+                    continue
+                received = time.perf_counter()
+                self.read(key.data, data, received)
+
+    def read(self, index, data, received):
+        buffer = self.buffers[index] + data
+        *lines, self.buffers[index] = buffer.split(b'\n')
+        for line in lines:
+            if line.startswith(b'retry:'):
+                self.ready.add(index)
+            elif line.startswith(b'data: '):
+                change = json.loads(line[6:])
+                if 'id' in change:
+                    with self.lock:
+                        self.arrivals.setdefault((change['id'], change['version']), []).append(received)
+
+    def close(self):
+        self.stopped = True
+        for key in list(self.selector.get_map().values()):
+            key.fileobj.close()
+
+
+def main():
+    args = parse_args()
+    scratch = tempfile.mkdtemp(prefix='ireporter-events-')
+    database_uri = args.database_uri or f'sqlite:///{os.path.join(scratch, "events.sqlite")}'
+    if args.workers is None:
+        args.workers = 1 if database_uri.startswith('sqlite') else 2
+    env = dict(os.environ, DATABASE_URI=database_uri, SECRET_KEY=os.environ.get('SECRET_KEY', 'events'),
+               METRICS_ENABLED='false', RESPONSE_CACHE_ENABLED='false', EVENTS_KEEPALIVE='15')
+    os.environ.update(env)
+
+    server = streams = None
+    try:
+        seed_database(args.users, args.reports, args.seed)
+        from sqlalchemy import create_engine, text
+        engine = create_engine(database_uri)
+        with engine.connect() as connection:
+            owners = dict(connection.execute(text('SELECT id, user_id FROM corruption_reports')).all())
+        engine.dispose()
+
+        server = start_server(args, env)
+        time.sleep(1)
+        rss_before = worker_rss(server)
+        idle_latency_before = [timed_request(args.port) for _ in range(50)]
+
+        # streams for users 1..users, round robin
+        user_ids = [index % args.users + 1 for index in range(args.streams)]
+        started = time.perf_counter()
+        streams = Streams(args.port, user_ids)
+        reader = threading.Thread(target=streams.run, daemon=True)
+        reader.start()
+        while len(streams.ready) < args.streams and time.perf_counter() - started < 60:
+            time.sleep(0.05)
+        open_seconds = time.perf_counter() - started
+        time.sleep(1)
+        rss_after = worker_rss(server)
+        idle_latency_after = [timed_request(args.port) for _ in range(50)]
+
+        # PATCH reports and time how long until each of the owner's streams has it
+        rng = random.Random(args.seed)
+        subscribers = {}
+        for user_id in user_ids:
+            subscribers[user_id] = subscribers.get(user_id, 0) + 1
+        reports = [report for report, owner in owners.items() if owner in subscribers]
+        sent = {}
+        for report in rng.sample(reports, min(args.updates, len(reports))):
+            sent[(report, 2)] = (time.perf_counter(), subscribers[owners[report]])
+            request(args.port, 'PATCH', f'/admin_corruption_reports/{report}',
+                    {'status': rng.choice(STATUSES), 'admin_comments': 'Reviewed by the events benchmark.'})
+        time.sleep(2)
+
+        latencies, expected, delivered = [], 0, 0
+        for key, (sent_at, count) in sent.items():
+            arrivals = streams.arrivals.get(key, [])
+            expected += count
+            delivered += len(arrivals)
+            latencies.extend((arrived - sent_at) * 1000 for arrived in arrivals)
+        latencies.sort()
+    finally:
+        if streams is not None:
+            streams.close()
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    results = {
+        'meta': {'commit': git_commit(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                 'python': platform.python_version(), 'database': database_uri.split(':', 1)[0],
+                 'args': {key: value for key, value in vars(args).items() if key != 'database_uri'}},
+        'streams_open': len(streams.ready),
+        'open_seconds': round(open_seconds, 2),
+        'worker_rss_mb': {'before': round(rss_before / 2 ** 20, 1), 'after': round(rss_after / 2 ** 20, 1)},
+        'rss_kb_per_stream': round((rss_after - rss_before) / 1024 / max(len(streams.ready), 1), 1),
+        'list_request_p50_ms': {'before': round(percentile(sorted(idle_latency_before), 0.5), 2),
+                                'after': round(percentile(sorted(idle_latency_after), 0.5), 2)},
+        'deliveries': {'expected': expected, 'delivered': delivered},
+        'delivery_ms': {'p50': round(percentile(latencies, 0.50), 2) if latencies else None,
+                        'p99': round(percentile(latencies, 0.99), 2) if latencies else None},
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps({key: value for key, value in results.items() if key != 'meta'}, indent=2))
+    print(f'results written to {args.output}')
+
+
+def timed_request(port):
+    started = time.perf_counter()
+    request(port, 'GET', '/corruption_reports?limit=1')
+    return (time.perf_counter() - started) * 1000
+
+
+if __name__ == '__main__':
+    main()
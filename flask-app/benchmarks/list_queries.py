@@ -0,0 +1,119 @@
+# Query plans and latency for the list route queries, with and without the
+# (column, id) indexes added in 3b7c1d9e4a21.
+#
+# Runs against the postgres database in DATABASE_URI, inside a throwaway
+# schema so the real tables are never touched:
+#
+#   python benchmarks/list_queries.py --rows 1000000 --output list_queries.json
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+from models import db
+
+SCHEMA = 'bench_listing'
+
+# the same statements the list routes issue (page size 50 + 1 look-ahead row)
+SCENARIOS = {
+    'first page': "SELECT * FROM corruption_reports ORDER BY id LIMIT 51",
+    'deep page (keyset)': "SELECT * FROM corruption_reports WHERE id > :deep_id ORDER BY id LIMIT 51",
+    'deep page (offset, for comparison)': "SELECT * FROM corruption_reports ORDER BY id LIMIT 51 OFFSET :deep_id",
+    'user_id filter': "SELECT * FROM corruption_reports WHERE user_id = :user_id ORDER BY id LIMIT 51",
+    'status filter': "SELECT * FROM corruption_reports WHERE status = 'Pending' ORDER BY id LIMIT 51",
+    'county + status filter': "SELECT * FROM corruption_reports WHERE county = 'County 7' AND status = 'Resolved' "
+                              "ORDER BY id LIMIT 51",
+    'sort by county (keyset)': "SELECT * FROM corruption_reports WHERE (county, id) > ('County 7', :deep_id) "
+                               "ORDER BY county, id LIMIT 51",
+}
+
+INDEXES = [
+    'ix_corruption_reports_user_id_id',
+    'ix_corruption_reports_status_id',
+    'ix_corruption_reports_county_id',
+    'ix_corruption_reports_govt_agency_id',
+]
+
+
+def seed(conn, rows, users):
+    conn.execute(text(
+        "INSERT INTO users (id, fullname, email, password, role) "
+        "SELECT g, 'User ' || g, 'user' || g || '@example.com', 'x', 'user' "
+        "FROM generate_series(1, :users) g"), {'users': users})
+    conn.execute(text(
+        "INSERT INTO corruption_reports "
+        "(govt_agency, county, title, description, status, latitude, longitude, user_id) "
+        "SELECT 'Agency ' || (g % 40), 'County ' || (g % 47), 'Report ' || g, 'Description ' || g, "
+        "(ARRAY['Pending', 'Under Investigation', 'Rejected', 'Resolved'])[1 + g % 4], "
+        "-4.7 + random() * 9.3, 33.9 + random() * 8.0, 1 + g % :users "
+        "FROM generate_series(1, :rows) g"), {'rows': rows, 'users': users})
+
+
+def measure(conn, sql, params, repeat):
+    plan = conn.execute(text('EXPLAIN (ANALYZE, BUFFERS) ' + sql), params).scalars().all()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(text(sql), params).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'median_ms': round(statistics.median(timings), 3),
+            'max_ms': round(max(timings), 3),
+            'plan': plan}
+
+
+def run_scenarios(conn, params, repeat):
+    conn.execute(text('ANALYZE corruption_reports'))
+    return {name: measure(conn, sql, params, repeat) for name, sql in SCENARIOS.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=50_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    load_dotenv()
+    engine = create_engine(os.environ['DATABASE_URI'])
+    params = {'deep_id': int(args.rows * 0.9), 'user_id': args.users // 2}
+    results = {'rows': args.rows, 'users': args.users}
+
+    with engine.connect() as conn:
+        conn.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+        conn.execute(text(f'CREATE SCHEMA {SCHEMA}'))
+        conn.execute(text(f'SET search_path TO {SCHEMA}'))
+        try:
+            db.metadata.create_all(conn)
+            for index in INDEXES:
+                conn.execute(text(f'DROP INDEX {index}'))
+            seed(conn, args.rows, args.users)
+
+            results['without_indexes'] = run_scenarios(conn, params, args.repeat)
+            for index in db.metadata.tables['corruption_reports'].indexes:
+                index.create(conn)
+            results['with_indexes'] = run_scenarios(conn, params, args.repeat)
+        finally:
+            conn.rollback()
+            conn.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+            conn.commit()
+
+    print(f"{'scenario':40} {'no index (ms)':>15} {'indexed (ms)':>15}")
+    for name in SCENARIOS:
+        print(f"{name:40} {results['without_indexes'][name]['median_ms']:>15} "
+              f"{results['with_indexes'][name]['median_ms']:>15}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+# Mixed-workload load test of the hot routes (login, list reports, create
+# report, admin PATCH) against the app running under gunicorn.
+#
+# Seeds a fresh database, starts gunicorn on it, drives the workload from
+# --concurrency client threads for --duration seconds (after --warmup) and
+# writes p50/p95/p99 latency and requests/sec per route to a JSON file that
+# benchmarks/compare.py can diff against another run:
+#
+#   python benchmarks/loadtest.py --output before.json
+#   python benchmarks/loadtest.py --database-uri postgresql://localhost/ireporter_bench --workers 4
+#
+# Without --database-uri it runs on a throwaway sqlite file. The tables of
+# the given database are dropped and recreated, so point it at a scratch
+# database, never a real one.
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+STATUSES = ['Pending', 'Under Investigation', 'Rejected', 'Resolved']
+PASSWORD = 'loadtest-password'
+# share of requests per route
+WORKLOAD = {'login': 5, 'list_reports': 60, 'create_report': 15, 'admin_patch': 20}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-uri')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--reports', type=int, default=50000)
+    parser.add_argument('--workers', type=int, default=None, help='gunicorn workers (default 4, 1 on sqlite)')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=5)
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='loadtest.json')
+    return parser.parse_args()
+
+
+def seed_database(users, reports, seed_value):
+    # imported here: the app reads its configuration from the environment
+    # set up by main()
+    from sqlalchemy import insert, text
+    from flask_bcrypt import Bcrypt
+    from app import create_app
+    from models import db, User, CorruptionReport, compute_content_hash
+    from geo import encode_geohash
+    from stats import rebuild_summary
+
+    app = create_app()
+    rng = random.Random(seed_value)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        if db.engine.dialect.name == 'sqlite':
+            # lets the list routes read while a write is in progress
+            db.session.execute(text('PRAGMA journal_mode=WAL'))
+
+        # fresh tables, so the users get ids 1..users in insert order
+        password = Bcrypt(app).generate_password_hash(PASSWORD).decode('utf-8')
+        db.session.execute(insert(User), [
+            {'fullname': f'User {n}', 'email': f'user{n}@example.com', 'password': password,
+             'role': 'admin' if n % 10 == 0 else 'user'}
+            for n in range(1, users + 1)])
+
+        rows = []
+        for n in range(1, reports + 1):
+            row = {'user_id': rng.randint(1, users), 'govt_agency': f'Agency {rng.randrange(40)}',
+                   'county': f'County {rng.randrange(47)}', 'title': f'Report {n}',
+                   'description': 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 3,
+                   'status': rng.choice(STATUSES), 'latitude': rng.uniform(-4.7, 4.6),
+                   'longitude': rng.uniform(33.9, 41.9), 'media': ['https://example.com/media.jpg']}
+            row['content_hash'] = compute_content_hash(row)
+            row['geohash'] = encode_geohash(row['latitude'], row['longitude'])
+            rows.append(row)
+            if len(rows) == 5000:
+                db.session.execute(insert(CorruptionReport), rows)
+                rows = []
+        if rows:
+            db.session.execute(insert(CorruptionReport), rows)
+        rebuild_summary()
+        db.session.commit()
+        db.engine.dispose()
+
+
+def start_server(args, env):
+    command = [sys.executable, '-m', 'gunicorn', '--workers', str(args.workers), '--threads', str(args.threads),
+               '--bind', f'127.0.0.1:{args.port}', '--log-level', 'warning', 'app:create_app()']
+    server = subprocess.Popen(command, cwd=APP_DIR, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('gunicorn exited during startup')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', args.port, timeout=1)
+            connection.request('GET', '/corruption_reports?limit=1')
+            connection.getresponse().read()
+            connection.close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError('gunicorn did not start within 30 seconds')
+
+
+class Client:
+    def __init__(self, port, index, args):
+        self.port = port
+        self.index = index
+        self.args = args
+        self.rng = random.Random(args.seed * 1000 + index)
+        self.connection = None
+        self.samples = []
+
+    def request(self, method, path, body=None):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        payload = json.dumps(body) if body is not None else None
+        try:
+            self.connection.request(method, path, payload, headers)
+            response = self.connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            return 0
+
+    def login(self):
+        user = self.rng.randint(1, self.args.users)
+        return self.request('POST', '/login', {'email': f'user{user}@example.com', 'password': PASSWORD})
+
+    def list_reports(self):
+        roll = self.rng.random()
+        if roll < 0.5:
+            path = '/corruption_reports?limit=50'
+        elif roll < 0.75:
+            path = f'/corruption_reports?limit=50&status={self.rng.choice(STATUSES).replace(" ", "+")}'
+        else:
+            path = f'/corruption_reports?limit=50&after={self.rng.randint(1, self.args.reports)}'
+        return self.request('GET', path)
+
+    def create_report(self):
+        return self.request('POST', '/corruption_reports', {
+            'user_id': self.rng.randint(1, self.args.users), 'govt_agency': f'Agency {self.rng.randrange(40)}',
+            'county': f'County {self.rng.randrange(47)}',
+            'title': f'Load test report {self.index}-{self.rng.getrandbits(64):x}',
+            'description': 'Created by the load test.', 'latitude': self.rng.uniform(-4.7, 4.6),
+            'longitude': self.rng.uniform(33.9, 41.9), 'media': ['https://example.com/media.jpg']})
+
+    def admin_patch(self):
+        report = self.rng.randint(1, self.args.reports)
+        return self.request('PATCH', f'/admin_corruption_reports/{report}',
+                            {'status': self.rng.choice(STATUSES), 'admin_comments': 'Reviewed by the load test.'})
+
+    def run(self, start, stop):
+        routes, weights = list(WORKLOAD), list(WORKLOAD.values())
+        while True:
+            route = self.rng.choices(routes, weights)[0]
+            began = time.monotonic()
+            if began >= stop:
+                break
+            status = getattr(self, route)()
+            if began >= start:
+                self.samples.append((route, time.monotonic() - began, status))
+
+
+def percentile(values, fraction):
+    # nearest rank on sorted values
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+
+def summarize(samples, seconds):
+    by_route = defaultdict(list)
+    for route, elapsed, status in samples:
+        by_route[route].append((elapsed, status))
+    by_route['all'] = [(elapsed, status) for route, elapsed, status in samples]
+
+    results = {}
+    for route, rows in by_route.items():
+        latencies = sorted(elapsed * 1000 for elapsed, status in rows)
+        statuses = defaultdict(int)
+        for elapsed, status in rows:
+            statuses[str(status)] += 1
+        results[route] = {
+            'requests': len(rows),
+            'errors': sum(1 for elapsed, status in rows if status == 0 or status >= 500),
+            'rps': round(len(rows) / seconds, 1),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'statuses': dict(statuses),
+        }
+    return results
+
+
+# SQL statements per request, per endpoint, from the server's /metrics
+def statements_per_request(port):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    connection.request('GET', '/metrics')
+    text = connection.getresponse().read().decode('utf-8')
+    totals, counts = {}, {}
+    for name, endpoint, value in re.findall(r'^(db_statements_per_request_(?:sum|count))\{endpoint="([^"]+)"\} (\S+)$',
+                                            text, re.MULTILINE):
+        (totals if name.endswith('sum') else counts)[endpoint] = float(value)
+    return {endpoint: round(totals[endpoint] / counts[endpoint], 2) for endpoint in sorted(counts) if counts[endpoint]}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = parse_args()
+    scratch = tempfile.mkdtemp(prefix='ireporter-loadtest-')
+    database_uri = args.database_uri or f'sqlite:///{os.path.join(scratch, "loadtest.sqlite")}'
+    if args.workers is None:
+        # sqlite serializes writers, so more processes only add lock waits
+        args.workers = 1 if database_uri.startswith('sqlite') else 4
+
+    env = dict(os.environ, DATABASE_URI=database_uri, SECRET_KEY=os.environ.get('SECRET_KEY', 'loadtest'),
+               BCRYPT_LOG_ROUNDS=str(args.bcrypt_rounds), METRICS_ENABLED='true',
+               METRICS_DIR=os.path.join(scratch, 'metrics'), MEDIA_STORAGE='local')
+    os.environ.update(env)
+
+    server = None
+    try:
+        started = time.perf_counter()
+        seed_database(args.users, args.reports, args.seed)
+        seed_seconds = time.perf_counter() - started
+
+        server = start_server(args, env)
+        clients = [Client(args.port, index, args) for index in range(args.concurrency)]
+        start = time.monotonic() + args.warmup
+        stop = start + args.duration
+        threads = [threading.Thread(target=client.run, args=(start, stop)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        samples = [sample for client in clients for sample in client.samples]
+        results = {
+            'meta': {'commit': git_commit(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                     'python': platform.python_version(), 'database': database_uri.split(':', 1)[0],
+                     'seed_seconds': round(seed_seconds, 1),
+                     'args': {key: value for key, value in vars(args).items() if key != 'database_uri'}},
+            'routes': summarize(samples, args.duration),
+            'statements_per_request': statements_per_request(args.port),
+        }
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"{'route':16} {'requests':>9} {'errors':>7} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for route, row in results['routes'].items():
+        print(f"{route:16} {row['requests']:>9} {row['errors']:>7} {row['rps']:>8} "
+              f"{row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9}")
+    print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# Login throughput for one worker, with bcrypt inline on the request threads
+# (PASSWORD_HASH_WORKERS=0, the old behaviour) and on the bounded pool.
+# Request threads are simulated in-process, like a gthread worker; alongside
+# the logins one thread keeps hitting a cheap route to show whether other
+# requests starve. Uses a throwaway SQLite database.
+#
+#   python benchmarks/login_throughput.py --threads 8 --seconds 10 --pool-workers 2
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+database = tempfile.NamedTemporaryFile(suffix='.sqlite', delete=False)
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ['DATABASE_URI'] = f'sqlite:///{database.name}'
+
+from app import create_app, bcrypt, passwords
+from models import db, User
+
+app = create_app()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else float('nan')
+
+
+def run(threads, seconds):
+    stop = time.monotonic() + seconds
+    counts = {'ok': 0, 'busy': 0}
+    cheap_latencies = []
+    lock = threading.Lock()
+
+    def login_loop():
+        client = app.test_client()
+        while time.monotonic() < stop:
+            status = client.post('/login', json={'email': 'bench@example.com', 'password': 'Bench.123'}).status_code
+            with lock:
+                counts['ok' if status == 200 else 'busy'] += 1
+
+    def cheap_loop():
+        client = app.test_client()
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            client.get('/login')
+            cheap_latencies.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.01)
+
+    workers = [threading.Thread(target=login_loop) for _ in range(threads)]
+    workers.append(threading.Thread(target=cheap_loop))
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return {'logins_per_sec': counts['ok'] / seconds,
+            'rejected_503': counts['busy'],
+            'cheap_route_p50_ms': statistics.median(cheap_latencies) if cheap_latencies else float('nan'),
+            'cheap_route_p99_ms': percentile(cheap_latencies, 0.99)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--pool-workers', type=int, default=2)
+    parser.add_argument('--rounds', type=int, default=app.config['BCRYPT_LOG_ROUNDS'])
+    args = parser.parse_args()
+
+    app.config['BCRYPT_LOG_ROUNDS'] = args.rounds
+    with app.app_context():
+        User.__table__.create(db.engine, checkfirst=True)
+        passwords.init_app(app, bcrypt)
+        db.session.add(User(fullname='Bench', email='bench@example.com', role='user',
+                            password=passwords.generate_password_hash('Bench.123')))
+        db.session.commit()
+
+    print(f'bcrypt cost {args.rounds}, {args.threads} request threads, {args.seconds}s per mode')
+    for label, pool_workers in (('inline', 0), (f'pool of {args.pool_workers}', args.pool_workers)):
+        app.config['PASSWORD_HASH_WORKERS'] = pool_workers
+        passwords.init_app(app, bcrypt)
+        result = run(args.threads, args.seconds)
+        print(f"{label:12} {result['logins_per_sec']:8.1f} logins/s  {result['rejected_503']:5d} rejected  "
+              f"cheap route p50 {result['cheap_route_p50_ms']:.1f}ms p99 {result['cheap_route_p99_ms']:.1f}ms")
+
+    os.unlink(database.name)
+
+
+if __name__ == '__main__':
+    main()
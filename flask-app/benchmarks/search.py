@@ -0,0 +1,128 @@
+# Latency of the /search queries (tsvector + GIN on postgres, FTS5 on
+# sqlite) for rare, common and multi-word queries, next to an unindexed
+# ILIKE scan for comparison.
+#
+# Runs against the postgres database in DATABASE_URI, inside a throwaway
+# schema so the real tables are never touched:
+#
+#   python benchmarks/search.py --documents 1000000 --output search.json
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, insert, text
+
+from models import db
+from search import SEARCH_MODELS, ranked_query
+
+SCHEMA = 'bench_search'
+
+COMMON_WORDS = (
+    'bribe bribery officer police county hospital school road tender contract money payment clinic water '
+    'permit license land title court judge clerk fund funds missing stolen fake audit project supplier '
+    'ministry office chief licence market fees fuel vehicle drugs medicine teacher bursary ward councillor '
+    'kickback procurement inflated invoice ghost worker salary cash demanded refused delayed').split()
+# long tail of rare tokens, so some queries match only a handful of rows
+RARE_WORDS = [f'case{n}' for n in range(20000)]
+
+QUERIES = {
+    'common word': ['bribery'],
+    'two common words': ['hospital', 'tender'],
+    'rare word': ['case19999'],
+    'common + rare': ['police', 'case12345'],
+}
+
+
+def documents(count, seed):
+    rng = random.Random(seed)
+    vocabulary = COMMON_WORDS + RARE_WORDS
+    cum_weights, total = [], 0.0
+    for rank in range(len(vocabulary)):
+        total += 1.0 / (rank + 1)
+        cum_weights.append(total)
+    for i in range(count):
+        words = rng.choices(vocabulary, cum_weights=cum_weights, k=26)
+        yield {'govt_agency': f'Agency {i % 40}', 'county': f'County {i % 47}', 'title': ' '.join(words[:6]),
+               'description': ' '.join(words[6:]), 'status': 'Pending', 'latitude': 0.0, 'longitude': 0.0,
+               'user_id': 1}
+
+
+def seed(conn, count, seed_value):
+    conn.execute(text("INSERT INTO users (id, fullname, email, password, role) "
+                      "VALUES (1, 'Bench', 'bench@example.com', 'x', 'user')"))
+    for offset, table in enumerate(SEARCH_MODELS):
+        chunk = []
+        for row in documents(count // len(SEARCH_MODELS), seed_value + offset):
+            chunk.append(row)
+            if len(chunk) == 10000:
+                conn.execute(insert(db.metadata.tables[table]), chunk)
+                chunk = []
+        if chunk:
+            conn.execute(insert(db.metadata.tables[table]), chunk)
+        conn.execute(text(f'ANALYZE {table}'))
+
+
+def measure(conn, statement, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(statement).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'median_ms': round(statistics.median(timings), 3), 'max_ms': round(max(timings), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--documents', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    load_dotenv()
+    engine = create_engine(os.environ['DATABASE_URI'])
+    dialect = engine.dialect.name
+    results = {'documents': args.documents, 'dialect': dialect, 'queries': {}}
+
+    with engine.connect() as conn:
+        conn.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+        conn.execute(text(f'CREATE SCHEMA {SCHEMA}'))
+        conn.execute(text(f'SET search_path TO {SCHEMA}'))
+        try:
+            # the search DDL is attached to the tables' after_create event
+            db.metadata.create_all(conn, tables=[db.metadata.tables['users']] +
+                                   [model.__table__ for model in SEARCH_MODELS.values()])
+            start = time.perf_counter()
+            seed(conn, args.documents, args.seed)
+            results['seed_seconds'] = round(time.perf_counter() - start, 1)
+
+            for name, terms in QUERIES.items():
+                ranked = ranked_query(dialect, list(SEARCH_MODELS), terms, 0, 50)
+                scan = text("SELECT id FROM corruption_reports WHERE title ILIKE :p OR description ILIKE :p "
+                            "ORDER BY id LIMIT 51").bindparams(p=f'%{terms[-1]}%')
+                results['queries'][name] = {'ranked_search': measure(conn, ranked, args.repeat),
+                                            'ilike_scan': measure(conn, scan, args.repeat)}
+        finally:
+            conn.rollback()
+            conn.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+            conn.commit()
+
+    print(f"{args.documents} documents, seeded in {results['seed_seconds']}s")
+    print(f"{'query':20} {'search (ms)':>12} {'ILIKE (ms)':>12}")
+    for name, timing in results['queries'].items():
+        print(f"{name:20} {timing['ranked_search']['median_ms']:>12} {timing['ilike_scan']['median_ms']:>12}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
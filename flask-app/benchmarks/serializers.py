@@ -0,0 +1,120 @@
+# Rows/sec for turning report rows into a JSON response body: the old
+# sqlalchemy_serializer to_dict and hand-written dict literal paths against
+# the precompiled ModelSerializer, each encoded with the stdlib json provider
+# and with orjson. No database needed.
+#
+#   python benchmarks/serializers.py --rows 100000
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import Column, DateTime, Float, Integer, JSON, String
+from sqlalchemy.orm import declarative_base
+from sqlalchemy_serializer import SerializerMixin as LegacySerializerMixin
+
+from models import PublicPetition
+from serializers import JSONProvider, orjson
+
+Base = declarative_base()
+
+
+# the model as it was declared before the switch to ModelSerializer
+class LegacyPetition(Base, LegacySerializerMixin):
+    __tablename__ = 'legacy_petitions'
+
+    serialize_only = PublicPetition.serialize_only
+
+    id = Column(Integer, primary_key=True)
+    govt_agency = Column(String)
+    county = Column(String)
+    title = Column(String)
+    description = Column(String)
+    media = Column(JSON)
+    status = Column(String)
+    latitude = Column(Float)
+    longitude = Column(Float)
+    admin_comments = Column(String)
+    user_id = Column(Integer)
+    version = Column(Integer)
+    created_at = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True))
+
+
+def make_rows(model, count):
+    now = datetime.now(timezone.utc)
+    return [model(id=i, govt_agency=f'Agency {i % 40}', county=f'County {i % 47}', title=f'Report {i}',
+                  description='Lorem ipsum dolor sit amet ' * 8, media=['https://example.com/a.jpg'],
+                  status='Pending', latitude=-1.28, longitude=36.82, admin_comments=None, user_id=i % 500,
+                  version=1, created_at=now, updated_at=now)
+            for i in range(count)]
+
+
+def dict_literal(report):
+    return {
+        'id': report.id,
+        'govt_agency': report.govt_agency,
+        'county': report.county,
+        'longitude': report.longitude,
+        'latitude': report.latitude,
+        'title': report.title,
+        'description': report.description,
+        'media': report.media,
+        'status': report.status,
+        'user_id': report.user_id,
+        'admin_comments' : report.admin_comments,
+        'version': report.version,
+        'created_at': report.created_at,
+        'updated_at': report.updated_at,
+    }
+
+
+def stdlib_dumps(obj):
+    # what flask's DefaultJSONProvider does for a response body
+    return json.dumps(obj, default=JSONProvider.default, sort_keys=True, ensure_ascii=True,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def orjson_dumps(obj):
+    return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+
+
+def rows_per_sec(rows, serialize, dumps, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        dumps([serialize(row) for row in rows])
+        best = min(best, time.perf_counter() - start)
+    return len(rows) / best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=50_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    legacy_rows = make_rows(LegacyPetition, args.rows)
+    rows = make_rows(PublicPetition, args.rows)
+
+    paths = [
+        ('sqlalchemy_serializer to_dict + json', legacy_rows, LegacyPetition.to_dict, stdlib_dumps),
+        ('dict literal + json', rows, dict_literal, stdlib_dumps),
+        ('ModelSerializer + json', rows, PublicPetition.to_dict, stdlib_dumps),
+    ]
+    if orjson is not None:
+        paths.append(('ModelSerializer + orjson', rows, PublicPetition.to_dict, orjson_dumps))
+
+    baseline = None
+    for name, data, serialize, dumps in paths:
+        rate = rows_per_sec(data, serialize, dumps, args.repeat)
+        baseline = baseline or rate
+        print(f'{name:40} {rate:>12,.0f} rows/sec {rate / baseline:>6.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+# Cold start of a worker: how long a fresh process takes to import the app,
+# build it with create_app() and answer its first request, and how long
+# gunicorn takes until every worker answers, with and without PRELOAD_APP.
+# Each phase is the median of --runs fresh interpreters. Exits non-zero when
+# a worker's boot (import + create_app + first request) is over --target-ms:
+#
+#   python benchmarks/startup.py
+#   python benchmarks/startup.py --workers 4 --target-ms 600 --output startup.json
+#
+# Runs on a throwaway sqlite file; pass --database-uri to boot against
+# postgres instead (nothing is written to it).
+import argparse
+import http.client
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# prints the time each phase took in a fresh interpreter, in milliseconds
+PHASES = '''
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+status = flask_app.test_client().get('/corruption_reports?limit=1').status_code
+answered = time.perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1000, 'create_app_ms': (created - imported) * 1000,
+                  'first_request_ms': (answered - created) * 1000, 'status': status}))
+'''
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-uri')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--target-ms', type=float, default=750, help='budget for one worker to boot')
+    parser.add_argument('--port', type=int, default=8768)
+    parser.add_argument('--output', default='startup.json')
+    return parser.parse_args()
+
+
+def python_startup(env):
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], cwd=APP_DIR, env=env, check=True)
+    return (time.perf_counter() - started) * 1000
+
+
+def worker_phases(env):
+    output = subprocess.run([sys.executable, '-c', PHASES], cwd=APP_DIR, env=env, check=True,
+                            stdout=subprocess.PIPE).stdout
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def worker_pid(port):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+    try:
+        connection.request('GET', '/admin/pool', headers={'Connection': 'close'})
+        return json.loads(connection.getresponse().read())['pid']
+    finally:
+        connection.close()
+
+
+# from starting gunicorn until it answers at all, and until each of its
+# workers has answered
+def gunicorn_ready(args, env, preload):
+    env = dict(env, PRELOAD_APP='true' if preload else 'false', WORKER_CLASS='sync',
+               WEB_CONCURRENCY=str(args.workers), BIND=f'127.0.0.1:{args.port}')
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--log-level', 'warning'], cwd=APP_DIR, env=env)
+    first, pids = None, set()
+    try:
+        while len(pids) < args.workers:
+            if server.poll() is not None:
+                raise RuntimeError('gunicorn exited during startup')
+            if time.perf_counter() - started > 60:
+                raise RuntimeError('gunicorn workers did not all answer within 60 seconds')
+            try:
+                pids.add(worker_pid(args.port))
+                first = first or time.perf_counter()
+            except OSError:
+                time.sleep(0.01)
+        return {'first_response_ms': (first - started) * 1000, 'all_workers_ms': (time.perf_counter() - started) * 1000}
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def median_of(rows, key):
+    return round(statistics.median(row[key] for row in rows), 1)
+
+
+def main():
+    args = parse_args()
+    scratch = tempfile.mkdtemp(prefix='ireporter-startup-')
+    database_uri = args.database_uri or f'sqlite:///{os.path.join(scratch, "startup.sqlite")}'
+    env = dict(os.environ, DATABASE_URI=database_uri, SECRET_KEY=os.environ.get('SECRET_KEY', 'startup'),
+               METRICS_ENABLED='false')
+    env.pop('FLASK_RUN_FROM_CLI', None)
+
+    try:
+        if not args.database_uri:
+            subprocess.run([sys.executable, '-c', 'import app\nflask_app = app.create_app()\n'
+                            'with flask_app.app_context(): app.db.create_all()'], cwd=APP_DIR, env=env, check=True)
+        # the first run also writes the bytecode caches
+        worker_phases(env)
+
+        interpreter = [python_startup(env) for _ in range(args.runs)]
+        phases = [worker_phases(env) for _ in range(args.runs)]
+        runs = {preload: [gunicorn_ready(args, env, preload) for _ in range(args.runs)] for preload in (False, True)}
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    worker = {key: median_of(phases, key) for key in ('import_ms', 'create_app_ms', 'first_request_ms')}
+    worker['boot_ms'] = round(worker['import_ms'] + worker['create_app_ms'] + worker['first_request_ms'], 1)
+    results = {
+        'meta': {'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'python': platform.python_version(),
+                 'database': database_uri.split(':', 1)[0],
+                 'args': {key: value for key, value in vars(args).items() if key != 'database_uri'}},
+        'python_startup_ms': round(statistics.median(interpreter), 1),
+        'worker': worker,
+        'gunicorn': {('preload' if preload else 'no_preload'): {key: median_of(rows, key) for key in rows[0]}
+                     for preload, rows in runs.items()},
+        'target_ms': args.target_ms,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"python startup      {results['python_startup_ms']:>8} ms")
+    for key in ('import_ms', 'create_app_ms', 'first_request_ms', 'boot_ms'):
+        print(f"worker {key[:-3]:13} {worker[key]:>8} ms")
+    for name, row in results['gunicorn'].items():
+        print(f"gunicorn {name:11} first response {row['first_response_ms']:>8} ms, "
+              f"all {args.workers} workers {row['all_workers_ms']:>8} ms")
+    print(f'results written to {args.output}')
+    if worker['boot_ms'] > args.target_ms:
+        print(f"worker boot {worker['boot_ms']} ms is over the {args.target_ms} ms target")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# Bytes sent to media storage and time until an upload's url is ready,
+# for a stream of evidence photos where some are uploaded more than once.
+# Uses the flask test client and local media storage in a scratch directory,
+# so only hashing, compression and the media_assets lookup are measured,
+# not the network. Needs Pillow, to make the photos:
+#
+#   python benchmarks/uploads.py --photos 40 --repeats 0.5
+#   python benchmarks/uploads.py --max-dimension 0     # no compression
+import argparse
+import io
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--photos', type=int, default=40, help='distinct photos')
+    parser.add_argument('--repeats', type=float, default=0.5, help='extra uploads of known photos, per photo')
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--max-dimension', type=int, default=2048)
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+# camera-sized JPEGs with enough noise that they don't compress to nothing
+def make_photo(rng, width, height):
+    image = Image.effect_noise((width // 8, height // 8), rng.randint(20, 80)).convert('RGB')
+    image = image.resize((width, height), Image.BICUBIC)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=92)
+    return buffer.getvalue()
+
+
+def main():
+    args = parse_args()
+    scratch = tempfile.mkdtemp(prefix='ireporter-uploads-')
+    os.environ.update(DATABASE_URI=f'sqlite:///{os.path.join(scratch, "uploads.sqlite")}',
+                      SECRET_KEY=os.environ.get('SECRET_KEY', 'uploads'), METRICS_ENABLED='false')
+    from app import create_app
+    from models import db
+
+    app = create_app({'MEDIA_STORAGE': 'local', 'MEDIA_LOCAL_ROOT': os.path.join(scratch, 'media'),
+                      'UPLOAD_SPOOL_DIR': os.path.join(scratch, 'spool'), 'MEDIA_MAX_DIMENSION': args.max_dimension})
+    rng = random.Random(args.seed)
+    try:
+        with app.app_context():
+            db.create_all()
+        photos = [make_photo(rng, args.width, args.height) for _ in range(args.photos)]
+        uploads = photos + [rng.choice(photos) for _ in range(int(args.photos * args.repeats))]
+        rng.shuffle(uploads)
+
+        client = app.test_client()
+        received, ready_ms, deduplicated = 0, [], 0
+        for index, data in enumerate(uploads):
+            started = time.perf_counter()
+            response = client.post('/upload_report', data={'file': (io.BytesIO(data), f'photo{index}.jpg')},
+                                   content_type='multipart/form-data')
+            job = response.get_json()
+            status_url = job['status_url']
+            while job['status'] not in ('done', 'failed'):
+                time.sleep(0.005)
+                job = client.get(status_url).get_json()
+            ready_ms.append((time.perf_counter() - started) * 1000)
+            received += len(data)
+            deduplicated += response.status_code == 200
+        media = os.path.join(scratch, 'media')
+        stored = sum(os.path.getsize(os.path.join(media, name)) for name in os.listdir(media))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    print(f'uploads             {len(uploads):>10} ({deduplicated} answered from media_assets)')
+    print(f'received            {received / 2 ** 20:>10.1f} MB')
+    print(f'sent to storage     {stored / 2 ** 20:>10.1f} MB ({100 * stored / received:.1f}% of received)')
+    print(f'url ready p50       {statistics.median(ready_ms):>10.1f} ms')
+    print(f'url ready max       {max(ready_ms):>10.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
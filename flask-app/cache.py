@@ -0,0 +1,175 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import current_app, request, make_response
+
+from replicas import replica_router
+
+
+# in-process LRU store with a TTL; fine for a single worker, but every
+# gunicorn worker keeps its own copy, so multi-worker deployments should use
+# RedisBackend so invalidations reach every worker
+class MemoryBackend:
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        # kept apart from the LRU entries: evicting a counter would reset it
+        # and could make an old entry look current again
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def get_generations(self, tags):
+        with self.lock:
+            return [self.generations.get(tag, 0) for tag in tags]
+
+    def bump_generations(self, tags):
+        with self.lock:
+            for tag in tags:
+                self.generations[tag] = self.generations.get(tag, 0) + 1
+
+
+# shared store for multi-worker setups; works with redis or any server that
+# speaks its protocol (valkey, keydb, ...). Entries get a TTL and the server
+# should run with maxmemory-policy volatile-lru, so only entries are evicted
+# and the generation counters (which have no TTL) are never lost
+class RedisBackend:
+    def __init__(self, url, ttl=300, prefix='ireporter:cache:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RESPONSE_CACHE_URL is set but the redis package is not installed')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        entry = self.client.hgetall(self.prefix + key)
+        if not entry:
+            return None
+        return {'etag': entry[b'etag'].decode('ascii'),
+                'body': entry[b'body'],
+                'mimetype': entry[b'mimetype'].decode('ascii')}
+
+    def set(self, key, entry):
+        with self.client.pipeline() as pipe:
+            pipe.hset(self.prefix + key, mapping=entry)
+            pipe.expire(self.prefix + key, self.ttl)
+            pipe.execute()
+
+    def get_generations(self, tags):
+        values = self.client.mget([self.prefix + 'gen:' + tag for tag in tags])
+        return [int(value) if value else 0 for value in values]
+
+    def bump_generations(self, tags):
+        with self.client.pipeline() as pipe:
+            for tag in tags:
+                pipe.incr(self.prefix + 'gen:' + tag)
+            pipe.execute()
+
+
+def table_tag(table):
+    return f'table:{table}'
+
+
+def user_tag(table, user_id):
+    return f'user:{table}:{user_id}'
+
+
+# caches GET responses keyed on route and query arguments. Each entry is
+# also keyed on the generation counters of the table (or the one user) it
+# covers, so invalidating is just bumping a counter; stale entries are never
+# read again and age out of the LRU
+class ResponseCache:
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        url = app.config['RESPONSE_CACHE_URL']
+        ttl = app.config['RESPONSE_CACHE_TTL']
+        if url:
+            self.backend = RedisBackend(url, ttl=ttl)
+        else:
+            self.backend = MemoryBackend(app.config['RESPONSE_CACHE_MAX_ENTRIES'], ttl=ttl)
+        app.extensions['response_cache'] = self
+
+    def cache_key(self, tags):
+        generations = self.backend.get_generations(tags)
+        args = urlencode(sorted(request.args.items(multi=True)))
+        versions = ','.join(f'{tag}={generation}' for tag, generation in zip(tags, generations))
+        return f'{request.endpoint}:{request.path}?{args}|{versions}'
+
+    # call after any write to `table`; pass the user_id of the affected rows
+    # so that user's per-user lists are dropped as well
+    def invalidate(self, table, user_id=None):
+        if self.backend is None:
+            return
+        tags = [table_tag(table)]
+        if user_id is not None:
+            tags.append(user_tag(table, user_id))
+        self.backend.bump_generations(tags)
+
+    # route decorator; per-user routes take the user_id from the view arguments
+    def cached(self, table, per_user=False):
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not current_app.config['RESPONSE_CACHE_ENABLED']:
+                    return func(*args, **kwargs)
+
+                tag = user_tag(table, kwargs['user_id']) if per_user else table_tag(table)
+                key = self.cache_key([tag])
+                entry = self.backend.get(key)
+
+                if entry is None:
+                    # filled from the primary: a lagging replica could store
+                    # rows older than the generation it's cached under
+                    replica_router.use_primary()
+                    response = make_response(func(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    body = response.get_data()
+                    entry = {'etag': hashlib.sha256(body).hexdigest(),
+                             'body': body,
+                             'mimetype': response.mimetype}
+                    self.backend.set(key, entry)
+
+                response = current_app.response_class(entry['body'], mimetype=entry['mimetype'])
+                response.set_etag(entry['etag'])
+                # clients may keep the body but must revalidate with If-None-Match
+                response.headers['Cache-Control'] = 'no-cache'
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
+
+
+response_cache = ResponseCache()
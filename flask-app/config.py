@@ -1,14 +1,130 @@
 from dotenv import load_dotenv
 import os
-import psycopg2
 
-load_dotenv()
+from pool import TimedNullPool, TimedQueuePool
+from replicas import replica_binds
 
+
+def env_flag(name, default='false'):
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes')
+
+
+# engine options for postgres from DB_* variables. DB_POOL_PROFILE=pgbouncer
+# is for pgbouncer in transaction mode: it does the pooling, so each checkout
+# opens a fresh connection, and it rejects the statement_timeout startup
+# option (set that on the database role instead)
+def engine_options(uri):
+    if not uri.startswith('postgres'):
+        return {}
+    if os.environ.get('DB_POOL_PROFILE', 'default') == 'pgbouncer':
+        return {'poolclass': TimedNullPool}
+
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': env_flag('DB_POOL_PRE_PING', 'true'),
+    }
+    timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))
+    if timeout:
+        options['connect_args'] = {'options': f'-c statement_timeout={timeout}'}
+    return options
+
+
+# settings read from the environment (and .env) when an app is created,
+# not when this module is imported
 class ApplicationConfig:
-    SECRET_KEY =  os.environ['SECRET_KEY']
+    def __init__(self):
+        load_dotenv()
+
+        self.SECRET_KEY = os.environ['SECRET_KEY']
+
+        self.SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+        self.SQLALCHEMY_ECHO = False
+        self.SQLALCHEMY_DATABASE_URI = os.environ['DATABASE_URI']
+        self.SQLALCHEMY_ENGINE_OPTIONS = engine_options(self.SQLALCHEMY_DATABASE_URI)
+
+        # read replicas, comma separated; routes marked @read_replica read from
+        # them, round robin, except for REPLICA_READ_YOUR_WRITES_SECONDS after
+        # the client's last write. Each one becomes a bind with the primary's
+        # engine options
+        self.DATABASE_REPLICA_URIS = [uri.strip() for uri in os.environ.get('DATABASE_REPLICA_URIS', '').split(',')
+                                      if uri.strip()]
+        self.SQLALCHEMY_BINDS = replica_binds(self.DATABASE_REPLICA_URIS)
+        self.REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', 5))
+        self.REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 10))
+        self.REPLICA_READ_YOUR_WRITES_SECONDS = float(os.environ.get('REPLICA_READ_YOUR_WRITES_SECONDS', 5))
+
+        # per-route statement timeouts in milliseconds (0 lifts the limit)
+        self.STATEMENT_TIMEOUT_READ_MS = int(os.environ.get('STATEMENT_TIMEOUT_READ_MS', 5000))
+        self.STATEMENT_TIMEOUT_WRITE_MS = int(os.environ.get('STATEMENT_TIMEOUT_WRITE_MS', 60000))
+        self.STATEMENT_TIMEOUT_EXPORT_MS = int(os.environ.get('STATEMENT_TIMEOUT_EXPORT_MS', 0))
+
+        # password hashing; raising BCRYPT_LOG_ROUNDS re-hashes users on their next login
+        self.BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+        self.PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+        self.PASSWORD_HASH_QUEUE_DEPTH = int(os.environ.get('PASSWORD_HASH_QUEUE_DEPTH', 16))
+
+        # logged in users are cached for USER_CACHE_TTL seconds; AUTH_TOKENS_ENABLED
+        # also hands out signed bearer tokens on login
+        self.USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+        self.USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', 10000))
+        self.AUTH_TOKENS_ENABLED = env_flag('AUTH_TOKENS_ENABLED')
+        self.AUTH_TOKEN_MAX_AGE = int(os.environ.get('AUTH_TOKEN_MAX_AGE', 3600))
+
+        # uploads are spooled locally and pushed to MEDIA_STORAGE (cloudinary, or
+        # local, for development, to copy them under MEDIA_LOCAL_ROOT and serve
+        # them from MEDIA_LOCAL_URL) by a background pool. Job files are kept
+        # for UPLOAD_JOB_TTL seconds
+        self.UPLOAD_SPOOL_DIR = os.environ.get('UPLOAD_SPOOL_DIR', '')
+        self.UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 4))
+        self.UPLOAD_MAX_RETRIES = int(os.environ.get('UPLOAD_MAX_RETRIES', 3))
+        self.UPLOAD_JOB_TTL = int(os.environ.get('UPLOAD_JOB_TTL', 86400))
+        self.MEDIA_STORAGE = os.environ.get('MEDIA_STORAGE', 'cloudinary')
+        self.MEDIA_LOCAL_ROOT = os.environ.get('MEDIA_LOCAL_ROOT', 'media')
+        self.MEDIA_LOCAL_URL = os.environ.get('MEDIA_LOCAL_URL', '/media')
+        # new JPEG, PNG and WebP uploads are scaled down to fit
+        # MEDIA_MAX_DIMENSION pixels (0 keeps the original) and re-encoded at
+        # MEDIA_IMAGE_QUALITY; needs Pillow, without it images go up as they came
+        self.MEDIA_MAX_DIMENSION = int(os.environ.get('MEDIA_MAX_DIMENSION', 2048))
+        self.MEDIA_IMAGE_QUALITY = int(os.environ.get('MEDIA_IMAGE_QUALITY', 85))
+
+        # list endpoints
+        self.DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', 50))
+        self.MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 500))
+        self.LEGACY_LIST_RESPONSES = env_flag('LEGACY_LIST_RESPONSES')
+
+        # /changes delta sync. The `since` it hands back reaches
+        # SYNC_OVERLAP_SECONDS into the past, to catch transactions that
+        # committed after a sync read past them (and replica lag); deletions
+        # are kept SYNC_TOMBSTONE_DAYS, an older `since` gets a 410
+        self.SYNC_OVERLAP_SECONDS = int(os.environ.get('SYNC_OVERLAP_SECONDS', 60))
+        self.SYNC_TOMBSTONE_DAYS = int(os.environ.get('SYNC_TOMBSTONE_DAYS', 30))
+        self.BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 5000))
 
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
+        # response cache for the list endpoints; leave RESPONSE_CACHE_URL empty
+        # for the in-process LRU, or point it at redis when running several workers
+        self.RESPONSE_CACHE_ENABLED = env_flag('RESPONSE_CACHE_ENABLED', 'true')
+        self.RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL', '')
+        self.RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1024))
+        self.RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 300))
 
-    SQLALCHEMY_ECHO = False
-    SQLALCHEMY_DATABASE_URI = os.environ['DATABASE_URI']
+        # request, SQL and pool metrics served at /metrics; set METRICS_DIR to a
+        # directory shared by the gunicorn workers to report all of them at once
+        self.METRICS_ENABLED = env_flag('METRICS_ENABLED', 'true')
+        self.METRICS_DIR = os.environ.get('METRICS_DIR', '')
+        self.METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))
 
+        # server-sent events at /events/<user_id>. EVENTS_BACKEND=postgres sends
+        # them through LISTEN/NOTIFY to every worker, memory only reaches the
+        # worker that made the change; auto picks postgres on postgres. Set
+        # EVENTS_LISTEN_URI to a direct connection when DATABASE_URI goes
+        # through pgbouncer in transaction mode
+        self.EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND', 'auto')
+        self.EVENTS_LISTEN_URI = os.environ.get('EVENTS_LISTEN_URI', '')
+        self.EVENTS_KEEPALIVE = float(os.environ.get('EVENTS_KEEPALIVE', 15))
+        self.EVENTS_MAX_STREAMS = int(os.environ.get('EVENTS_MAX_STREAMS', 1000))
+        self.EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', 100))
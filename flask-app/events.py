@@ -0,0 +1,255 @@
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+
+from flask import Response, request
+from sqlalchemy import bindparam, create_engine, event, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from green import gevent_enabled
+from models import db
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'report_events'
+# postgres caps a NOTIFY payload at 8000 bytes
+MAX_PAYLOAD = 7900
+
+
+class EventStreamsFull(Exception):
+    pass
+
+
+class EventStreamsUnsupported(Exception):
+    pass
+
+
+# the change a report's owner is told about; admin_comments is left out of
+# events too big for one notification, and the client refetches instead
+def report_event(model, row, admin_comments=None):
+    change = {'type': model.__tablename__, 'id': row['id'], 'user_id': row['user_id'],
+              'status': row['status'], 'version': row['version']}
+    comments = row.get('admin_comments', admin_comments)
+    if comments is not None:
+        change['admin_comments'] = comments
+    if len(json.dumps(change)) > MAX_PAYLOAD:
+        change.pop('admin_comments')
+        change['truncated'] = True
+    return change
+
+
+# payloads of at most MAX_PAYLOAD bytes, each a JSON array of events
+def payloads(changes):
+    batch, size = [], 2
+    for change in changes:
+        encoded = json.dumps(change)
+        if batch and size + len(encoded) + 1 > MAX_PAYLOAD:
+            yield '[' + ','.join(batch) + ']'
+            batch, size = [], 2
+        batch.append(encoded)
+        size += len(encoded) + 1
+    if batch:
+        yield '[' + ','.join(batch) + ']'
+
+
+class Subscription:
+    def __init__(self, user_id, size):
+        self.user_id = user_id
+        self.queue = queue.Queue(size)
+        # set when an event didn't fit in the queue
+        self.lost = False
+        self.closed = False
+
+
+# pushes report status changes to their owners over server-sent events.
+# Changes are published inside the transaction that makes them and only
+# delivered once it commits. With the postgres backend they go out through
+# pg_notify, and one LISTEN connection per worker fans them out to that
+# worker's streams, so every worker sees every change. The memory backend
+# delivers to the streams of the publishing worker only, for local runs.
+# An idle stream holds no database connection, only its socket, which
+# costs a greenlet under the gevent workers
+class EventBroker:
+    def __init__(self, app=None):
+        self.subscriptions = {}
+        self.lock = threading.Lock()
+        self.listener = None
+        self.pid = None
+        self.streams = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config['EVENTS_BACKEND']
+        if backend == 'auto':
+            backend = 'postgres' if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgres') else 'memory'
+        self.backend = backend
+        self.listen_uri = app.config['EVENTS_LISTEN_URI'] or app.config['SQLALCHEMY_DATABASE_URI']
+        self.keepalive = app.config['EVENTS_KEEPALIVE']
+        self.max_streams = app.config['EVENTS_MAX_STREAMS']
+        self.queue_size = app.config['EVENTS_QUEUE_SIZE']
+        app.extensions['event_broker'] = self
+
+    def publish(self, changes):
+        changes = list(changes)
+        if not changes:
+            return
+        if self.backend == 'postgres':
+            statement = text(f"SELECT pg_notify('{CHANNEL}', payload) FROM unnest(:payloads) AS payload")
+            statement = statement.bindparams(bindparam('payloads', type_=ARRAY(db.Text)))
+            db.session.execute(statement, {'payloads': list(payloads(changes))})
+        else:
+            db.session.info.setdefault('pending_events', []).extend(changes)
+
+    def dispatch(self, changes):
+        with self.lock:
+            for change in changes:
+                for subscription in self.subscriptions.get(change.get('user_id'), ()):
+                    self.deliver(subscription, change)
+
+    def dispatch_all(self, change):
+        with self.lock:
+            for subscriptions in self.subscriptions.values():
+                for subscription in subscriptions:
+                    self.deliver(subscription, change)
+
+    def deliver(self, subscription, change):
+        try:
+            subscription.queue.put_nowait(change)
+        except queue.Full:
+            # a client that stopped reading; it resyncs once it catches up
+            subscription.lost = True
+
+    def subscribe(self, user_id):
+        with self.lock:
+            if self.streams >= self.max_streams:
+                raise EventStreamsFull()
+            self.streams += 1
+            subscription = Subscription(user_id, self.queue_size)
+            self.subscriptions.setdefault(user_id, set()).add(subscription)
+        if self.backend == 'postgres':
+            self.start_listener()
+        return subscription
+
+    # runs from the stream's generator and from the response's close, since
+    # a HEAD request never starts the generator; only the first call counts
+    def unsubscribe(self, subscription):
+        with self.lock:
+            if subscription.closed:
+                return
+            subscription.closed = True
+            self.streams -= 1
+            subscriptions = self.subscriptions.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscriptions.pop(subscription.user_id, None)
+
+    # started on the first subscription, and again in a forked worker since
+    # the thread doesn't survive a fork
+    def start_listener(self):
+        with self.lock:
+            if self.listener is not None and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.listener = threading.Thread(target=self.listen, name='events-listener', daemon=True)
+            self.listener.start()
+
+    def listen(self):
+        # its own connection outside the pool: it stays in LISTEN for good,
+        # and pgbouncer's transaction mode doesn't pass notifications on, so
+        # EVENTS_LISTEN_URI can point it straight at postgres
+        engine = create_engine(self.listen_uri, poolclass=NullPool)
+        delay, reconnecting = 1, False
+        while True:
+            connection = None
+            try:
+                connection = engine.raw_connection()
+                dbapi_connection = connection.driver_connection
+                dbapi_connection.autocommit = True
+                with dbapi_connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {CHANNEL}')
+                # anything sent while we weren't listening is lost; tell the
+                # clients to refetch
+                if reconnecting:
+                    self.dispatch_all({'type': 'resync'})
+                delay, reconnecting = 1, True
+                while True:
+                    if select.select([dbapi_connection], [], [], 60) == ([], [], []):
+                        # a quiet minute; make sure the connection is still there
+                        with dbapi_connection.cursor() as cursor:
+                            cursor.execute('SELECT 1')
+                    dbapi_connection.poll()
+                    while dbapi_connection.notifies:
+                        notify = dbapi_connection.notifies.pop(0)
+                        self.dispatch(json.loads(notify.payload))
+            except Exception as e:
+                logger.warning('event listener lost its connection, retrying in %ds: %s', delay, e)
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+
+    # a stream never ends, so it's only served where it costs a greenlet
+    # (gevent workers) or a thread (gthread workers, the dev server). A sync
+    # worker would spend itself on one stream and, sending no heartbeat
+    # meanwhile, be killed after WORKER_TIMEOUT
+    def stream(self, user_id):
+        if not gevent_enabled() and not request.environ.get('wsgi.multithread'):
+            raise EventStreamsUnsupported()
+        subscription = self.subscribe(user_id)
+        keepalive = self.keepalive
+
+        def generate():
+            try:
+                yield 'retry: 5000\n\n'
+                while True:
+                    if subscription.lost:
+                        subscription.lost = False
+                        yield format_event({'type': 'resync'})
+                    try:
+                        change = subscription.queue.get(timeout=keepalive)
+                    except queue.Empty:
+                        # also how a closed connection gets noticed
+                        yield ': keepalive\n\n'
+                        continue
+                    yield format_event(change)
+            finally:
+                self.unsubscribe(subscription)
+
+        response = Response(generate(), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        response.call_on_close(lambda: self.unsubscribe(subscription))
+        return response
+
+
+def format_event(change):
+    name = 'resync' if change['type'] == 'resync' else 'status'
+    return f'event: {name}\ndata: {json.dumps(change)}\n\n'
+
+
+event_broker = EventBroker()
+
+
+# the memory backend holds published events on the session until the
+# transaction commits, and drops them if it rolls back
+@event.listens_for(Session, 'after_commit')
+def deliver_pending_events(session):
+    changes = session.info.pop('pending_events', None)
+    if changes:
+        event_broker.dispatch(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def drop_pending_events(session):
+    session.info.pop('pending_events', None)
@@ -0,0 +1,80 @@
+import csv
+import io
+import json
+
+from flask import Response, current_app, request, stream_with_context, jsonify
+
+from pagination import PaginationError, apply_filters
+
+
+# rows fetched per round trip from the server-side cursor, and rows per
+# chunk written to the client
+YIELD_PER = 1000
+CHUNK_ROWS = 500
+
+
+def ndjson_lines(rows, fields):
+    dumps = current_app.json.dumps
+    for row in rows:
+        yield dumps(dict(zip(fields, row))) + '\n'
+
+
+def csv_lines(rows, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    writer.writerow(fields)
+    yield flush()
+    for row in rows:
+        # media is a list, so it goes out as a JSON array inside the cell
+        writer.writerow([json.dumps(value) if isinstance(value, list) else value for value in row])
+        yield flush()
+
+
+# groups the per-row lines into chunks; the first row goes out on its own
+# so the client gets a byte as soon as the cursor returns
+def chunked(lines):
+    chunk = []
+    for count, line in enumerate(lines):
+        chunk.append(line)
+        if count == 0 or len(chunk) >= CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+# streams every row matching the list route filters as NDJSON (default) or
+# CSV (?format=csv); only plain column tuples are fetched, through a
+# server-side cursor, so worker memory stays flat whatever the table size
+def export_response(query, model, name):
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'error': "'format' must be ndjson or csv"}), 400
+
+    try:
+        query = apply_filters(query, model)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
+    fields = model.serialize_only
+    rows = (query.with_entities(*[getattr(model, field) for field in fields])
+                 .order_by(model.id)
+                 .execution_options(yield_per=YIELD_PER))
+
+    if export_format == 'csv':
+        lines, mimetype = csv_lines(rows, fields), 'text/csv'
+    else:
+        lines, mimetype = ndjson_lines(rows, fields), 'application/x-ndjson'
+
+    response = Response(stream_with_context(chunked(lines)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={name}.{export_format}'
+    # stop nginx from buffering the whole export before passing it on
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,142 @@
+import math
+
+from flask import request
+from sqlalchemy import and_, func, or_
+
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# precision stored in the geohash column: cells of roughly 38m x 19m
+GEOHASH_PRECISION = 8
+# bbox and radius queries probe at most this many geohash prefixes
+MAX_COVER_CELLS = 32
+KM_PER_DEGREE = 111.32
+
+# geohash precision used for each map zoom level when clustering
+ZOOM_PRECISION = [1, 1, 1, 2, 2, 3, 3, 3, 4, 4, 5, 5, 5, 6, 6, 7, 7, 8]
+
+
+class GeoQueryError(ValueError):
+    pass
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash, bits, char, even = [], 0, 0, True
+    while len(geohash) < precision:
+        value, interval = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        char <<= 1
+        if value >= middle:
+            char |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            geohash.append(BASE32[char])
+            bits, char = 0, 0
+    return ''.join(geohash)
+
+
+def cell_size(precision):
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 - lon_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def frange(start, stop, step):
+    value = start
+    while value < stop:
+        yield value
+        value += step
+    yield stop
+
+
+# the geohash prefixes of every cell the box touches, at the finest
+# precision that needs no more than MAX_COVER_CELLS of them
+def cover_bbox(min_lat, min_lon, max_lat, max_lon):
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = math.floor(max_lat / height) - math.floor(min_lat / height) + 1
+        columns = math.floor(max_lon / width) - math.floor(min_lon / width) + 1
+        if rows * columns <= MAX_COVER_CELLS:
+            return sorted({encode_geohash(lat, lon, precision)
+                           for lat in frange(min_lat, max_lat, height)
+                           for lon in frange(min_lon, max_lon, width)})
+    return None
+
+
+# ?bbox=min_lon,min_lat,max_lon,max_lat (GeoJSON order)
+def parse_bbox(value):
+    try:
+        min_lon, min_lat, max_lon, max_lat = [float(part) for part in value.split(',')]
+    except ValueError:
+        raise GeoQueryError("'bbox' must be min_lon,min_lat,max_lon,max_lat")
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= max_lon <= 180):
+        raise GeoQueryError("'bbox' must be a valid box with min values before max values")
+    return min_lat, min_lon, max_lat, max_lon
+
+
+# ?near=lat,lon&radius_km=N
+def parse_near(value, radius):
+    try:
+        latitude, longitude = [float(part) for part in value.split(',')]
+        radius = float(radius if radius not in (None, '') else 5)
+    except ValueError:
+        raise GeoQueryError("'near' must be lat,lon and 'radius_km' a number")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180) or radius <= 0:
+        raise GeoQueryError("'near' must be a valid position and 'radius_km' positive")
+    return latitude, longitude, radius
+
+
+def bbox_condition(model, min_lat, min_lon, max_lat, max_lon):
+    conditions = [model.latitude.between(min_lat, max_lat), model.longitude.between(min_lon, max_lon)]
+    # prefix scans on the indexed geohash narrow the rows before the exact check
+    prefixes = cover_bbox(min_lat, min_lon, max_lat, max_lon)
+    if prefixes:
+        conditions.append(or_(*[model.geohash.like(prefix + '%') for prefix in prefixes]))
+    return and_(*conditions)
+
+
+def apply_geo_filters(query, model):
+    if request.args.get('bbox'):
+        query = query.filter(bbox_condition(model, *parse_bbox(request.args['bbox'])))
+
+    if request.args.get('near'):
+        latitude, longitude, radius = parse_near(request.args['near'], request.args.get('radius_km'))
+        lat_delta = radius / KM_PER_DEGREE
+        lon_scale = max(math.cos(math.radians(latitude)), 1e-6)
+        lon_delta = min(lat_delta / lon_scale, 180)
+        query = query.filter(bbox_condition(model, max(latitude - lat_delta, -90), max(longitude - lon_delta, -180),
+                                            min(latitude + lat_delta, 90), min(longitude + lon_delta, 180)))
+        # equirectangular distance, exact enough at city scale and needs
+        # no trigonometry in the database
+        dlat = model.latitude - latitude
+        dlon = (model.longitude - longitude) * lon_scale
+        query = query.filter(dlat * dlat + dlon * dlon <= lat_delta * lat_delta)
+
+    return query
+
+
+def zoom_precision(zoom):
+    return ZOOM_PRECISION[max(0, min(zoom, len(ZOOM_PRECISION) - 1))]
+
+
+# point counts per geohash cell at the precision for the zoom level
+def cluster_query(query, model, zoom):
+    precision = zoom_precision(zoom)
+    cell = func.substr(model.geohash, 1, precision).label('cell')
+    rows = (query.filter(model.geohash.isnot(None))
+                 .with_entities(cell, func.count(model.id), func.avg(model.latitude), func.avg(model.longitude))
+                 .group_by(cell)
+                 .all())
+    return precision, [{'cell': cell, 'count': count, 'latitude': latitude, 'longitude': longitude}
+                       for cell, count, latitude, longitude in rows]
@@ -0,0 +1,49 @@
+import os
+
+
+def gevent_enabled():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+
+# psycopg2 talks to postgres from C, out of reach of gevent's monkey
+# patching, so every query would block the whole worker. With this wait
+# callback psycopg2 hands control back to the gevent hub while it waits on
+# the socket, and other requests run in the meantime
+def gevent_wait_callback(conn, timeout=None):
+    from gevent.socket import wait_read, wait_write
+    from psycopg2 import OperationalError, extensions
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise OperationalError(f'Bad result from poll: {state!r}')
+
+
+# called in each gevent worker before it serves requests; a no-op in sync
+# and gthread workers. Note that psycopg2 can't run COPY in this mode
+def make_psycopg_green():
+    if not gevent_enabled():
+        return False
+    try:
+        from psycopg2 import extensions
+    except ImportError:
+        return False
+    extensions.set_wait_callback(gevent_wait_callback)
+    return True
+
+
+def cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
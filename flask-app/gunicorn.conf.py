@@ -0,0 +1,51 @@
+# gunicorn settings, read from the environment; gunicorn picks this file up
+# when started from this directory (plain `gunicorn` serves create_app()),
+# and command line flags still win over it.
+#
+# WORKER_CLASS=sync (the default) runs one request per worker thread.
+# WORKER_CLASS=gevent runs each request in a greenlet, so a worker keeps
+# serving while requests wait on postgres or Cloudinary, and a core can hold
+# hundreds of requests in flight instead of a handful. In that mode keep
+# WEB_CONCURRENCY near the core count and size DB_POOL_SIZE/DB_MAX_OVERFLOW
+# for the concurrent queries you expect per worker: requests beyond that
+# wait up to DB_POOL_TIMEOUT for a connection. The cooperative mode needs
+# postgres; sqlite calls still block the worker
+import glob
+import os
+
+from green import cpu_count, make_psycopg_green
+
+wsgi_app = 'app:create_app()'
+worker_class = os.environ.get('WORKER_CLASS', 'sync')
+gevent_mode = worker_class == 'gevent'
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', 8000)}")
+workers = int(os.environ.get('WEB_CONCURRENCY', cpu_count() if gevent_mode else 2 * cpu_count() + 1))
+threads = int(os.environ.get('WORKER_THREADS', 1))
+# greenlets per gevent worker
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+timeout = int(os.environ.get('WORKER_TIMEOUT', 30))
+keepalive = int(os.environ.get('WORKER_KEEPALIVE', 5))
+# restart workers now and then so a slow leak can't grow forever
+max_requests = int(os.environ.get('WORKER_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+# PRELOAD_APP=true builds the app once in the master and forks the workers
+# from it, so they start at once and share its memory copy-on-write; each
+# child drops the inherited connection pool (see pool.dispose_pool_after_fork).
+# Leave it off with gevent, which has to patch the standard library before
+# the app is imported
+preload_app = os.environ.get('PRELOAD_APP', 'false').lower() in ('1', 'true', 'yes')
+
+
+def on_starting(server):
+    # the metrics files of an earlier run would be added to this one's
+    directory = os.environ.get('METRICS_DIR')
+    if directory:
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            os.remove(path)
+
+
+def post_worker_init(worker):
+    # the gevent worker has monkey patched the standard library by now
+    if make_psycopg_green():
+        worker.log.info('psycopg2 running in gevent mode')
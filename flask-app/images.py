@@ -0,0 +1,48 @@
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+# formats that get re-encoded, with the extension of the result; anything
+# else is uploaded as it came
+FORMATS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+
+
+# downscales the image at `path` to fit in max_dimension x max_dimension and
+# re-encodes it next to the original. Returns the new file's path, or None
+# to upload the original: Pillow isn't installed (it's optional, see the
+# README), the file isn't an image we re-encode, or the result isn't smaller
+def compress_image(path, max_dimension, quality):
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+
+    output = None
+    try:
+        with Image.open(path) as original:
+            image_format = original.format
+            if image_format not in FORMATS or getattr(original, 'is_animated', False):
+                return None
+            # applies the EXIF rotation, since the metadata isn't copied over
+            image = ImageOps.exif_transpose(original)
+            image.thumbnail((max_dimension, max_dimension))
+            options = {'optimize': True}
+            if image_format in ('JPEG', 'WEBP'):
+                options['quality'] = quality
+            if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            output = os.path.splitext(path)[0] + '.min' + FORMATS[image_format]
+            image.save(output, image_format, **options)
+    except Exception as e:
+        # not an image after all, or one Pillow can't read; send it as is
+        logger.info('not compressing %s: %s', os.path.basename(path), e)
+        if output is not None and os.path.exists(output):
+            os.remove(output)
+        return None
+
+    if os.path.getsize(output) >= os.path.getsize(path):
+        os.remove(output)
+        return None
+    return output
@@ -0,0 +1,193 @@
+import glob
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from pool import pool_stats
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+METRIC_TYPES = {
+    'http_requests_total': ('counter', 'Requests by endpoint, method and status.'),
+    'http_request_errors_total': ('counter', 'Requests answered with a 5xx status.'),
+    'http_request_duration_seconds': ('histogram', 'Time until the response headers were ready.'),
+    'http_response_size_bytes_total': ('counter', 'Response bytes sent, streamed responses excluded.'),
+    'db_statements_per_request': ('histogram', 'SQL statements issued per request.'),
+    'db_statements_total': ('counter', 'SQL statements issued by requests.'),
+    'db_statement_duration_seconds_total': ('counter', 'Time spent in SQL statements by requests.'),
+    'db_pool_checkouts_total': ('counter', 'Connections checked out of the pool.'),
+    'db_pool_checkout_timeouts_total': ('counter', 'Checkouts that gave up waiting for a connection.'),
+    'db_pool_wait_seconds_total': ('counter', 'Time spent waiting for a pool connection.'),
+    'db_pool_connections_opened_total': ('counter', 'New database connections opened.'),
+    'db_pool_invalidations_total': ('counter', 'Connections dropped as broken.'),
+    'db_pool_checked_out': ('gauge', 'Connections currently checked out.'),
+}
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = [(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for key, value in labels]
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+# request and SQL metrics in Prometheus text format. Each process keeps its
+# own series; with METRICS_DIR set, every worker also writes them to
+# METRICS_DIR/<pid>.json at most every METRICS_FLUSH_INTERVAL seconds and
+# /metrics adds up the files of all workers, so whichever worker answers
+# the scrape reports the whole server. gunicorn.conf.py clears the directory
+# at startup so counters from an earlier run aren't added in
+class Metrics:
+    def __init__(self, app=None):
+        self.series = defaultdict(float)
+        self.lock = threading.Lock()
+        self.directory = ''
+        self.flushed_at = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config['METRICS_ENABLED']:
+            return
+        self.directory = app.config['METRICS_DIR']
+        self.flush_interval = app.config['METRICS_FLUSH_INTERVAL']
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.extensions['metrics'] = self
+
+    def add(self, name, labels, value=1.0):
+        self.series[(name, tuple(labels))] += value
+
+    def observe(self, name, labels, value, buckets):
+        # every bucket is written, even at zero, so none go missing
+        for bound in buckets:
+            self.add(name + '_bucket', labels + [('le', str(bound))], 1.0 if value <= bound else 0.0)
+        self.add(name + '_bucket', labels + [('le', '+Inf')])
+        self.add(name + '_sum', labels, value)
+        self.add(name + '_count', labels)
+
+    def start_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_statements = 0
+        g.metrics_statement_time = 0.0
+
+    def finish_request(self, response):
+        if 'metrics_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_start
+        endpoint = [('endpoint', request.endpoint or 'unmatched')]
+        with self.lock:
+            self.add('http_requests_total', endpoint + [('method', request.method),
+                                                         ('status', str(response.status_code))])
+            if response.status_code >= 500:
+                self.add('http_request_errors_total', endpoint + [('status', str(response.status_code))])
+            self.observe('http_request_duration_seconds', endpoint, elapsed, LATENCY_BUCKETS)
+            if not response.is_streamed:
+                self.add('http_response_size_bytes_total', endpoint, response.calculate_content_length() or 0)
+            self.observe('db_statements_per_request', endpoint, g.metrics_statements, STATEMENT_BUCKETS)
+            self.add('db_statements_total', endpoint, g.metrics_statements)
+            self.add('db_statement_duration_seconds_total', endpoint, g.metrics_statement_time)
+        if self.directory and time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+        return response
+
+    def record_statement(self, seconds):
+        if has_request_context() and 'metrics_start' in g:
+            g.metrics_statements += 1
+            g.metrics_statement_time += seconds
+
+    def local_series(self):
+        with self.lock:
+            series = dict(self.series)
+        db = current_app.extensions.get('sqlalchemy') if has_app_context() else None
+        stats = pool_stats.snapshot(db.engine.pool if db is not None else None)
+        for name, key, scale in (('db_pool_checkouts_total', 'checkouts', 1),
+                                 ('db_pool_checkout_timeouts_total', 'timeouts', 1),
+                                 ('db_pool_wait_seconds_total', 'wait_total_ms', 0.001),
+                                 ('db_pool_connections_opened_total', 'connects', 1),
+                                 ('db_pool_invalidations_total', 'invalidations', 1),
+                                 ('db_pool_checked_out', 'checked_out', 1)):
+            if key in stats:
+                series[(name, ())] = stats[key] * scale
+        return series
+
+    def flush(self):
+        self.flushed_at = time.monotonic()
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        # write-then-rename so a scrape never reads a half written file
+        with open(path + '.tmp', 'w') as f:
+            json.dump([[name, labels, value] for (name, labels), value in self.local_series().items()], f)
+        os.replace(path + '.tmp', path)
+
+    def collect(self):
+        if not self.directory:
+            return self.local_series()
+        self.flush()
+        series = defaultdict(float)
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path) as f:
+                    rows = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, labels, value in rows:
+                series[(name, tuple(tuple(label) for label in labels))] += value
+        return series
+
+    def render(self):
+        by_metric = defaultdict(list)
+        for (name, labels), value in self.collect().items():
+            base = name
+            for suffix in ('_bucket', '_sum', '_count'):
+                if name.endswith(suffix) and name[:-len(suffix)] in METRIC_TYPES:
+                    base = name[:-len(suffix)]
+            by_metric[base].append((name, labels, value))
+
+        lines = []
+        for base in sorted(by_metric):
+            kind, help_text = METRIC_TYPES.get(base, ('untyped', ''))
+            lines.append(f'# HELP {base} {help_text}')
+            lines.append(f'# TYPE {base} {kind}')
+            for name, labels, value in sorted(by_metric[base], key=series_order):
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def series_order(row):
+    name, labels, value = row
+    # buckets in numeric order of their upper bound
+    bounds = [float(value) for key, value in labels if key == 'le']
+    return name, [label for label in labels if label[0] != 'le'], bounds
+
+
+metrics = Metrics()
+
+
+# SQL statement count and time for the request the statement runs in;
+# listening on Engine covers every engine the app creates. A connection runs
+# one statement at a time, so a single start time per connection is enough
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['metrics_started'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('metrics_started', None)
+    if started is not None:
+        metrics.record_statement(time.perf_counter() - started)
@@ -0,0 +1,62 @@
+"""added full text search to report tables
+
+Revision ID: 0b8d4f2e6a15
+Revises: 9c1f5e3a7b28
+Create Date: 2026-10-18 17:41:09.218334
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b8d4f2e6a15'
+down_revision = '9c1f5e3a7b28'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ('corruption_reports', 'public_petitions')
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        # adding a stored generated column rewrites the table once; the GIN
+        # index is then built without blocking writes
+        for table in TABLES:
+            op.execute(f"ALTER TABLE {table} ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+                       f"(to_tsvector('english', coalesce(title, '') || ' ' || coalesce(description, ''))) STORED")
+        with op.get_context().autocommit_block():
+            for table in TABLES:
+                op.create_index(f'ix_{table}_search_vector', table, ['search_vector'], unique=False,
+                                postgresql_using='gin', postgresql_concurrently=True)
+    elif dialect == 'sqlite':
+        for table in TABLES:
+            fts = f'{table}_fts'
+            op.execute(f"CREATE VIRTUAL TABLE {fts} USING fts5(title, description, content='{table}', content_rowid='id')")
+            op.execute(f"CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN "
+                       f"INSERT INTO {fts}(rowid, title, description) VALUES (new.id, new.title, new.description); END")
+            op.execute(f"CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN "
+                       f"INSERT INTO {fts}({fts}, rowid, title, description) "
+                       f"VALUES ('delete', old.id, old.title, old.description); END")
+            op.execute(f"CREATE TRIGGER {fts}_update AFTER UPDATE ON {table} BEGIN "
+                       f"INSERT INTO {fts}({fts}, rowid, title, description) "
+                       f"VALUES ('delete', old.id, old.title, old.description); "
+                       f"INSERT INTO {fts}(rowid, title, description) VALUES (new.id, new.title, new.description); END")
+            op.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        with op.get_context().autocommit_block():
+            for table in reversed(TABLES):
+                op.drop_index(f'ix_{table}_search_vector', table_name=table, postgresql_concurrently=True)
+        for table in reversed(TABLES):
+            op.drop_column(table, 'search_vector')
+    elif dialect == 'sqlite':
+        for table in reversed(TABLES):
+            for trigger in ('update', 'delete', 'insert'):
+                op.execute(f'DROP TRIGGER {table}_fts_{trigger}')
+            op.execute(f'DROP TABLE {table}_fts')
@@ -0,0 +1,30 @@
+"""added version to report tables
+
+Revision ID: 2d6a9e4b8f31
+Revises: 0b8d4f2e6a15
+Create Date: 2026-10-18 19:12:44.803517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2d6a9e4b8f31'
+down_revision = '0b8d4f2e6a15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # a constant default makes this a catalog-only change on postgres 11+,
+    # existing rows start at version 1 without a table rewrite
+    for table in ('corruption_reports', 'public_petitions'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    for table in ('public_petitions', 'corruption_reports'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('version')
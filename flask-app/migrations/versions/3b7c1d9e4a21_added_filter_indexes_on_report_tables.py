@@ -0,0 +1,41 @@
+"""added filter indexes on report tables
+
+Revision ID: 3b7c1d9e4a21
+Revises: 8e99acd57506
+Create Date: 2026-10-18 09:12:44.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b7c1d9e4a21'
+down_revision = '8e99acd57506'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('user_id', 'id'),
+    ('status', 'id'),
+    ('county', 'id'),
+    ('govt_agency', 'id'),
+]
+
+
+def upgrade():
+    # built concurrently so existing report tables stay writable during the migration
+    with op.get_context().autocommit_block():
+        for table in ('corruption_reports', 'public_petitions'):
+            for columns in INDEXES:
+                op.create_index(f"ix_{table}_{'_'.join(columns)}", table, list(columns),
+                                unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for table in ('public_petitions', 'corruption_reports'):
+            for columns in reversed(INDEXES):
+                op.drop_index(f"ix_{table}_{'_'.join(columns)}", table_name=table,
+                              postgresql_concurrently=True)
@@ -0,0 +1,34 @@
+"""added media assets table
+
+Revision ID: 4e1a7c3f9b52
+Revises: 2d6a9e4b8f31
+Create Date: 2026-10-18 21:04:16.228391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e1a7c3f9b52'
+down_revision = '2d6a9e4b8f31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('media_assets',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('url', sa.String(), nullable=False),
+    sa.Column('content_type', sa.String(length=200), nullable=True),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('stored_size', sa.BigInteger(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('sha256')
+    )
+
+
+def downgrade():
+    op.drop_table('media_assets')
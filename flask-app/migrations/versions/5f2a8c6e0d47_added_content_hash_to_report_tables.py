@@ -0,0 +1,75 @@
+"""added content hash to report tables
+
+Revision ID: 5f2a8c6e0d47
+Revises: 3b7c1d9e4a21
+Create Date: 2026-10-18 11:40:02.913377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import hashlib
+import json
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2a8c6e0d47'
+down_revision = '3b7c1d9e4a21'
+branch_labels = None
+depends_on = None
+
+
+BATCH_SIZE = 5000
+
+# frozen copy of models.compute_content_hash as of this revision
+def content_hash(row):
+    key = [row.user_id, row.govt_agency, row.county, row.title, row.description, row.latitude, row.longitude]
+    for position, cast in ((0, int), (5, float), (6, float)):
+        try:
+            key[position] = cast(key[position])
+        except (TypeError, ValueError):
+            pass
+    return hashlib.sha256(json.dumps(key, default=str).encode('utf-8')).hexdigest()
+
+
+def backfill(table_name):
+    table = sa.table(table_name, sa.column('id', sa.Integer), sa.column('content_hash', sa.String),
+                     *[sa.column(name) for name in ('user_id', 'govt_agency', 'county', 'title',
+                                                     'description', 'latitude', 'longitude')])
+    connection = op.get_bind()
+    update = (sa.update(table).where(table.c.id == sa.bindparam('row_id'))
+              .values(content_hash=sa.bindparam('hash')))
+
+    # rows that were already duplicates keep a NULL hash (the unique index
+    # allows any number of NULLs); only the oldest copy claims the hash
+    seen = set()
+    last_id = 0
+    while True:
+        rows = connection.execute(sa.select(table).where(table.c.id > last_id)
+                                  .order_by(table.c.id).limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        params = []
+        for row in rows:
+            digest = content_hash(row)
+            if digest not in seen:
+                seen.add(digest)
+                params.append({'row_id': row.id, 'hash': digest})
+        if params:
+            connection.execute(update, params)
+        last_id = rows[-1].id
+
+
+def upgrade():
+    for table in ('corruption_reports', 'public_petitions'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+        backfill(table)
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_index(f'ux_{table}_content_hash', ['content_hash'], unique=True)
+
+
+def downgrade():
+    for table in ('public_petitions', 'corruption_reports'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(f'ux_{table}_content_hash')
+            batch_op.drop_column('content_hash')
@@ -0,0 +1,56 @@
+"""added timestamps to report tables and deleted records table
+
+Revision ID: 6c3d8a1f2e94
+Revises: 4e1a7c3f9b52
+Create Date: 2026-10-18 22:37:09.614420
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c3d8a1f2e94'
+down_revision = '4e1a7c3f9b52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # now() is stable, so postgres 11+ adds these without rewriting the
+    # table: existing rows read the time of the migration, which is when
+    # the first delta sync after it starts from
+    for table in ('corruption_reports', 'public_petitions'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'),
+                                          nullable=False))
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'),
+                                          nullable=False))
+            batch_op.create_index(f'ix_{table}_updated_at_id', ['updated_at', 'id'], unique=False)
+            batch_op.create_index(f'ix_{table}_user_id_updated_at_id', ['user_id', 'updated_at', 'id'], unique=False)
+            batch_op.create_index(f'ix_{table}_created_at', ['created_at'], unique=False)
+
+    op.create_table('deleted_records',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=50), nullable=False),
+    sa.Column('record_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('deleted_records', schema=None) as batch_op:
+        batch_op.create_index('ix_deleted_records_kind_deleted_at', ['kind', 'deleted_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('deleted_records', schema=None) as batch_op:
+        batch_op.drop_index('ix_deleted_records_kind_deleted_at')
+    op.drop_table('deleted_records')
+
+    for table in ('public_petitions', 'corruption_reports'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(f'ix_{table}_created_at')
+            batch_op.drop_index(f'ix_{table}_user_id_updated_at_id')
+            batch_op.drop_index(f'ix_{table}_updated_at_id')
+            batch_op.drop_column('updated_at')
+            batch_op.drop_column('created_at')
@@ -0,0 +1,78 @@
+"""added geohash to report tables
+
+Revision ID: 7a4e2b9d1c63
+Revises: 5f2a8c6e0d47
+Create Date: 2026-10-18 14:05:51.602419
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a4e2b9d1c63'
+down_revision = '5f2a8c6e0d47'
+branch_labels = None
+depends_on = None
+
+
+BATCH_SIZE = 5000
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+# frozen copy of geo.encode_geohash as of this revision
+def encode_geohash(latitude, longitude, precision=8):
+    if latitude is None or longitude is None or not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash, bits, char, even = [], 0, 0, True
+    while len(geohash) < precision:
+        value, interval = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        char <<= 1
+        if value >= middle:
+            char |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            geohash.append(BASE32[char])
+            bits, char = 0, 0
+    return ''.join(geohash)
+
+
+def backfill(table_name):
+    table = sa.table(table_name, sa.column('id', sa.Integer), sa.column('geohash', sa.String),
+                     sa.column('latitude', sa.Float), sa.column('longitude', sa.Float))
+    connection = op.get_bind()
+    update = (sa.update(table).where(table.c.id == sa.bindparam('row_id'))
+              .values(geohash=sa.bindparam('geohash')))
+
+    last_id = 0
+    while True:
+        rows = connection.execute(sa.select(table.c.id, table.c.latitude, table.c.longitude)
+                                  .where(table.c.id > last_id).order_by(table.c.id).limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        connection.execute(update, [{'row_id': row.id, 'geohash': encode_geohash(row.latitude, row.longitude)}
+                                    for row in rows])
+        last_id = rows[-1].id
+
+
+def upgrade():
+    for table in ('corruption_reports', 'public_petitions'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('geohash', sa.String(length=12), nullable=True))
+        backfill(table)
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_index(f'ix_{table}_geohash', ['geohash'], unique=False,
+                                  postgresql_ops={'geohash': 'varchar_pattern_ops'})
+
+
+def downgrade():
+    for table in ('public_petitions', 'corruption_reports'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(f'ix_{table}_geohash')
+            batch_op.drop_column('geohash')
@@ -0,0 +1,37 @@
+"""added report stats summary table
+
+Revision ID: 9c1f5e3a7b28
+Revises: 7a4e2b9d1c63
+Create Date: 2026-10-18 16:22:37.540981
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c1f5e3a7b28'
+down_revision = '7a4e2b9d1c63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('report_stats',
+    sa.Column('kind', sa.String(length=50), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('county', sa.String(length=200), nullable=False),
+    sa.Column('govt_agency', sa.String(length=200), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'status', 'county', 'govt_agency')
+    )
+    # seed the summary from the existing rows; afterwards the write routes
+    # keep it up to date (flask stats check / flask stats rebuild)
+    for table in ('corruption_reports', 'public_petitions'):
+        op.execute(f"INSERT INTO report_stats (kind, status, county, govt_agency, count) "
+                   f"SELECT '{table}', COALESCE(status, ''), COALESCE(county, ''), COALESCE(govt_agency, ''), COUNT(*) "
+                   f"FROM {table} GROUP BY 2, 3, 4")
+
+
+def downgrade():
+    op.drop_table('report_stats')
@@ -1,10 +1,73 @@
+import hashlib
+import json
+
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from sqlalchemy_serializer import SerializerMixin
 from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.sqlite import DATETIME as SQLITE_DATETIME
+from serializers import SerializerMixin
+from geo import encode_geohash
+from replicas import RoutingSession
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# media URLs are a postgres array; stored as a JSON list on sqlite so the
+# app and the benchmarks can run without postgres
+MEDIA_TYPE = ARRAY(db.String).with_variant(db.JSON, 'sqlite')
+
+# timestamptz on postgres. sqlite stores CURRENT_TIMESTAMP as UTC text in
+# whole seconds, so parameters are written the same way to compare correctly
+TIMESTAMP_TYPE = db.DateTime(timezone=True).with_variant(
+    SQLITE_DATETIME(storage_format='%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d'), 'sqlite')
+
+
+# the fields the create routes used to compare in their duplicate check
+CONTENT_HASH_FIELDS = ('user_id', 'govt_agency', 'county', 'title', 'description', 'latitude', 'longitude')
+
+
+def _coerce(value, cast):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return value
 
 
-db = SQLAlchemy()
+# sha256 over the content fields, normalised so that e.g. user_id "3" and 3
+# hash the same; stored in a unique column so duplicate detection on create
+# is a single index probe
+def compute_content_hash(values):
+    key = [values.get(field) for field in CONTENT_HASH_FIELDS]
+    key[0] = _coerce(key[0], int)
+    key[5] = _coerce(key[5], float)
+    key[6] = _coerce(key[6], float)
+    return hashlib.sha256(json.dumps(key, default=str).encode('utf-8')).hexdigest()
+
+
+# INSERT ... ON CONFLICT needs the dialect specific insert construct
+def insert_statement(model):
+    if db.engine.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert(model)
+
+
+class ContentHashMixin:
+    content_hash = db.Column(db.String(64), nullable=True)
+
+    def refresh_content_hash(self):
+        self.content_hash = compute_content_hash({field: getattr(self, field) for field in CONTENT_HASH_FIELDS})
+
+    # inserts one row unless a row with the same content already exists;
+    # returns the new id, or None for a duplicate
+    @classmethod
+    def insert_unique(cls, values):
+        values = dict(values, content_hash=compute_content_hash(values))
+        statement = (insert_statement(cls).values(**values)
+                     .on_conflict_do_nothing(index_elements=['content_hash'])
+                     .returning(cls.id))
+        return db.session.execute(statement).scalar()
 
 class User(db.Model, UserMixin):
     __tablename__ = 'users'
@@ -29,15 +92,56 @@ class User(db.Model, UserMixin):
         else:
             return False
 
-class CorruptionReport(db.Model):
+# geohash of latitude/longitude; its B-tree index turns bbox and radius
+# queries into a few prefix range scans
+class LocationMixin:
+    geohash = db.Column(db.String(12), nullable=True)
+
+    def refresh_geohash(self):
+        self.geohash = encode_geohash(self.latitude, self.longitude)
+
+
+# bumped by every write; clients send it back in If-Match so an edit based
+# on a stale copy fails with a 409 instead of overwriting someone else's
+class VersionMixin:
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+
+# set by the database on every INSERT and UPDATE statement, the Core ones in
+# versioning.py, batch.py and moderation.py included, so /changes compares
+# them against one clock
+class TimestampMixin:
+    created_at = db.Column(TIMESTAMP_TYPE, nullable=False, server_default=db.func.now())
+    updated_at = db.Column(TIMESTAMP_TYPE, nullable=False, server_default=db.func.now(),
+                           onupdate=db.func.now())
+
+
+class CorruptionReport(db.Model, ContentHashMixin, LocationMixin, VersionMixin, TimestampMixin, SerializerMixin):
     __tablename__ = 'corruption_reports'
+    # (column, id) indexes back the list route filters and keyset pagination
+    __table_args__ = (
+        db.Index('ix_corruption_reports_user_id_id', 'user_id', 'id'),
+        db.Index('ix_corruption_reports_status_id', 'status', 'id'),
+        db.Index('ix_corruption_reports_county_id', 'county', 'id'),
+        db.Index('ix_corruption_reports_govt_agency_id', 'govt_agency', 'id'),
+        db.Index('ux_corruption_reports_content_hash', 'content_hash', unique=True),
+        db.Index('ix_corruption_reports_geohash', 'geohash', postgresql_ops={'geohash': 'varchar_pattern_ops'}),
+        # /changes reads (updated_at, id) in order, for everyone or one user
+        db.Index('ix_corruption_reports_updated_at_id', 'updated_at', 'id'),
+        db.Index('ix_corruption_reports_user_id_updated_at_id', 'user_id', 'updated_at', 'id'),
+        db.Index('ix_corruption_reports_created_at', 'created_at'),
+    )
+
+    serialize_only = ('id', 'govt_agency', 'county',
+                      'title', 'description', 'media', 'status', 'latitude', 'longitude', 'user_id', 'admin_comments', 'version',
+                      'created_at', 'updated_at')
 
     id = db.Column(db.Integer, primary_key=True)
     govt_agency = db.Column(db.String(200), nullable=False)
     county = db.Column(db.String(200), nullable=False)    
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.String(600), nullable=False)
-    media = db.Column(ARRAY(db.String), nullable=True)    
+    media = db.Column(MEDIA_TYPE, nullable=True)
     status = db.Column(db.String, default='Pending')
     longitude = db.Column(db.Float, default=0.0)
     latitude = db.Column(db.Float, default=0.0)
@@ -47,19 +151,31 @@ class CorruptionReport(db.Model):
 
 
 
-class PublicPetition(db.Model, SerializerMixin):
+class PublicPetition(db.Model, ContentHashMixin, LocationMixin, VersionMixin, TimestampMixin, SerializerMixin):
     __tablename__ = 'public_petitions'
+    __table_args__ = (
+        db.Index('ix_public_petitions_user_id_id', 'user_id', 'id'),
+        db.Index('ix_public_petitions_status_id', 'status', 'id'),
+        db.Index('ix_public_petitions_county_id', 'county', 'id'),
+        db.Index('ix_public_petitions_govt_agency_id', 'govt_agency', 'id'),
+        db.Index('ux_public_petitions_content_hash', 'content_hash', unique=True),
+        db.Index('ix_public_petitions_geohash', 'geohash', postgresql_ops={'geohash': 'varchar_pattern_ops'}),
+        # /changes reads (updated_at, id) in order, for everyone or one user
+        db.Index('ix_public_petitions_updated_at_id', 'updated_at', 'id'),
+        db.Index('ix_public_petitions_user_id_updated_at_id', 'user_id', 'updated_at', 'id'),
+        db.Index('ix_public_petitions_created_at', 'created_at'),
+    )
 
     serialize_only = ('id', 'govt_agency', 'county', 
-                      'title', 'description', 'media', 'status', 'latitude', 'longitude', 'user_id', 'admin_comments')
-    serialize_rules = ()
+                      'title', 'description', 'media', 'status', 'latitude', 'longitude', 'user_id', 'admin_comments', 'version',
+                      'created_at', 'updated_at')
 
     id = db.Column(db.Integer, primary_key=True)
     govt_agency = db.Column(db.String(200), nullable=False)
     county = db.Column(db.String(200), nullable=False)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.String(600), nullable=False)
-    media = db.Column(ARRAY(db.String), nullable=True)    
+    media = db.Column(MEDIA_TYPE, nullable=True)
     status = db.Column(db.String, default='Pending')
     latitude = db.Column(db.Float, default=0.0)
     longitude = db.Column(db.Float, default=0.0)
@@ -69,3 +185,46 @@ class PublicPetition(db.Model, SerializerMixin):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
 
 
+
+
+# running counts per (status, county, govt_agency) for each report table;
+# kept up to date by the write routes, see stats.py
+class ReportStat(db.Model):
+    __tablename__ = 'report_stats'
+
+    kind = db.Column(db.String(50), primary_key=True)
+    status = db.Column(db.String, primary_key=True)
+    county = db.Column(db.String(200), primary_key=True)
+    govt_agency = db.Column(db.String(200), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+# one row per deleted report or petition, so /changes can tell clients to
+# drop their copy; `flask sync prune` removes them after SYNC_TOMBSTONE_DAYS
+class DeletedRecord(db.Model):
+    __tablename__ = 'deleted_records'
+    __table_args__ = (
+        db.Index('ix_deleted_records_kind_deleted_at', 'kind', 'deleted_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # the table the record was deleted from
+    kind = db.Column(db.String(50), nullable=False)
+    record_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(TIMESTAMP_TYPE, nullable=False, server_default=db.func.now())
+
+
+# one row per distinct uploaded file, keyed by the sha256 of the bytes the
+# client sent (before any compression), so a repeat upload reuses the url
+class MediaAsset(db.Model):
+    __tablename__ = 'media_assets'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    url = db.Column(db.String, nullable=False)
+    content_type = db.Column(db.String(200), nullable=True)
+    # bytes received, and bytes stored after compression
+    size = db.Column(db.BigInteger, nullable=False)
+    stored_size = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
@@ -0,0 +1,100 @@
+from sqlalchemy import and_, select, update
+
+from models import db
+from pagination import FILTER_FIELDS
+from stats import stat_key
+
+
+# the statuses an admin may move a report or petition to from each status
+STATUS_TRANSITIONS = {
+    'Pending': ('Under Investigation', 'Rejected'),
+    'Under Investigation': ('Resolved', 'Rejected'),
+    'Rejected': ('Pending',),
+    'Resolved': (),
+}
+
+
+class ModerationError(ValueError):
+    pass
+
+
+def source_statuses(target):
+    return [status for status, targets in STATUS_TRANSITIONS.items() if target in targets]
+
+
+# {"ids": [...]} or {"filter": {"status": ..., "county": ...}}, plus the
+# new "status" and an optional "admin_comments"
+def parse_moderation(data, max_ids):
+    if not isinstance(data, dict):
+        raise ModerationError('Expected a JSON object')
+    if data.get('status') not in STATUS_TRANSITIONS:
+        raise ModerationError(f"'status' must be one of {', '.join(STATUS_TRANSITIONS)}")
+    comments = data.get('admin_comments')
+    if comments is not None and not isinstance(comments, str):
+        raise ModerationError("'admin_comments' must be a string")
+
+    ids, filters = data.get('ids'), data.get('filter')
+    if (ids is None) == (filters is None):
+        raise ModerationError("Pass either 'ids' or 'filter'")
+    if ids is not None:
+        if not isinstance(ids, list) or not ids or not all(isinstance(id, int) for id in ids):
+            raise ModerationError("'ids' must be a non-empty array of integers")
+        if len(ids) > max_ids:
+            raise ModerationError(f"'ids' can hold at most {max_ids} ids")
+    else:
+        if not isinstance(filters, dict) or not filters:
+            raise ModerationError(f"'filter' must be an object with any of {', '.join(FILTER_FIELDS)}")
+        unknown = sorted(set(filters) - set(FILTER_FIELDS))
+        if unknown:
+            raise ModerationError(f"Unknown filter fields: {', '.join(unknown)}")
+        for field, value in filters.items():
+            if field == 'user_id':
+                if not isinstance(value, int) or isinstance(value, bool):
+                    raise ModerationError("'filter.user_id' must be an integer")
+            elif not isinstance(value, str):
+                raise ModerationError(f"'filter.{field}' must be a string")
+    return data['status'], comments, ids, filters
+
+
+def selection(model, ids, filters):
+    if ids is not None:
+        return model.id.in_(ids)
+    return and_(*[getattr(model, field) == value for field, value in filters.items()])
+
+
+# moves every selected row that may make the transition with one
+# UPDATE ... RETURNING per allowed source status, so the old status of each
+# updated row is known for the dashboard statistics. Returns the updated
+# rows, plus for an id list the ids that were rejected or not found
+def moderate(model, target, comments, ids, filters, stats):
+    values = {'status': target, 'version': model.version + 1}
+    if comments is not None:
+        values['admin_comments'] = comments
+
+    updated = []
+    for status in source_statuses(target):
+        if filters and filters.get('status', status) != status:
+            continue
+        statement = (update(model)
+                     .where(selection(model, ids, filters), model.status == status)
+                     .values(**values)
+                     .returning(model.id, model.user_id, model.county, model.govt_agency, model.version)
+                     .execution_options(synchronize_session=False))
+        for row in db.session.execute(statement):
+            row = dict(row._mapping, status=target)
+            stats.move(stat_key(dict(row, status=status)), row)
+            updated.append(row)
+
+    rejected, not_found = [], []
+    if ids is not None:
+        done = {row['id'] for row in updated}
+        current = dict(db.session.execute(select(model.id, model.status).where(
+            model.id.in_([id for id in ids if id not in done]))).all())
+        for id in dict.fromkeys(ids):
+            if id in done:
+                continue
+            if id in current:
+                rejected.append({'id': id, 'status': current[id]})
+            else:
+                not_found.append(id)
+    return updated, rejected, not_found
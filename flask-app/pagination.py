@@ -0,0 +1,143 @@
+import base64
+import json
+
+from flask import request, current_app, jsonify
+from sqlalchemy import tuple_
+
+from geo import GeoQueryError, apply_geo_filters
+
+
+class PaginationError(ValueError):
+    pass
+
+
+# query parameters the list routes can filter on, each backed by a
+# (column, id) index on both report tables; ?bbox= and ?near= are handled
+# by geo.apply_geo_filters
+FILTER_FIELDS = ('status', 'county', 'govt_agency', 'user_id')
+SORT_FIELDS = ('id', 'status', 'county', 'govt_agency')
+
+
+# read ?after=<cursor>&limit=N from the query string
+def get_page_args():
+    after = request.args.get('after')
+    limit = request.args.get('limit')
+
+    try:
+        limit = int(limit) if limit not in (None, '') else current_app.config['DEFAULT_PAGE_SIZE']
+    except ValueError:
+        raise PaginationError("'limit' must be an integer")
+
+    if limit < 1:
+        raise PaginationError("'limit' must be a positive integer")
+
+    return after or None, min(limit, current_app.config['MAX_PAGE_SIZE'])
+
+
+# ?sort=county or ?sort=-county; defaults to ascending id
+def get_sort_args():
+    sort = request.args.get('sort', 'id')
+    descending = sort.startswith('-')
+    field = sort.lstrip('-')
+
+    if field not in SORT_FIELDS:
+        raise PaginationError(f"'sort' must be one of {', '.join(SORT_FIELDS)} (prefix with - for descending)")
+
+    return field, descending
+
+
+# id-sorted pages keep the plain ?after=<id> cursor; other sort orders need
+# the sort value as well, so their cursor is an opaque token
+def encode_cursor(field, row):
+    if field == 'id':
+        return row.id
+    value = json.dumps([getattr(row, field), row.id]).encode('utf-8')
+    return base64.urlsafe_b64encode(value).decode('ascii')
+
+
+def decode_cursor(field, cursor):
+    try:
+        if field == 'id':
+            return int(cursor)
+        value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return value, int(last_id)
+    except (ValueError, TypeError):
+        raise PaginationError("'after' is not a valid cursor for this sort order")
+
+
+def apply_filters(query, model, exclude=()):
+    for field in FILTER_FIELDS:
+        if field in exclude:
+            continue
+        value = request.args.get(field)
+        if value in (None, ''):
+            continue
+        if field == 'user_id':
+            try:
+                value = int(value)
+            except ValueError:
+                raise PaginationError("'user_id' must be an integer")
+        query = query.filter(getattr(model, field) == value)
+
+    try:
+        return apply_geo_filters(query, model)
+    except GeoQueryError as e:
+        raise PaginationError(str(e))
+
+
+# legacy clients get the old bare-array response, but only when they opt in
+# (server-wide through LEGACY_LIST_RESPONSES or per request with ?legacy=true)
+# and are not already asking for a page
+def wants_legacy_response():
+    if 'after' in request.args or 'limit' in request.args:
+        return False
+    if request.args.get('legacy', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return current_app.config['LEGACY_LIST_RESPONSES']
+
+
+def sort_columns(model, field, descending):
+    id_column = model.id.desc() if descending else model.id
+    if field == 'id':
+        return [id_column]
+    column = getattr(model, field)
+    return [column.desc() if descending else column, id_column]
+
+
+# returns one page of rows in the requested order plus the cursor for the
+# next page; fetches one extra row so we know whether another page exists
+def keyset_paginate(query, model):
+    after, limit = get_page_args()
+    field, descending = get_sort_args()
+
+    if after is not None:
+        position = decode_cursor(field, after)
+        if field == 'id':
+            key = model.id
+        else:
+            key = tuple_(getattr(model, field), model.id)
+        query = query.filter(key < position if descending else key > position)
+
+    rows = query.order_by(*sort_columns(model, field, descending)).limit(limit + 1).all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(field, rows[-1])
+    return rows, None
+
+
+def paginated_response(query, model, serialize, exclude_filters=()):
+    try:
+        query = apply_filters(query, model, exclude_filters)
+
+        if wants_legacy_response():
+            field, descending = get_sort_args()
+            rows = query.order_by(*sort_columns(model, field, descending)).all()
+            return jsonify([serialize(row) for row in rows]), 200
+
+        rows, next_cursor = keyset_paginate(query, model)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'items': [serialize(row) for row in rows],
+                    'next_cursor': next_cursor}), 200
@@ -0,0 +1,69 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from green import gevent_enabled
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+# runs bcrypt on a small, bounded thread pool (bcrypt releases the GIL) so
+# a burst of logins can only hold PASSWORD_HASH_WORKERS threads busy instead
+# of every request thread; once PASSWORD_HASH_QUEUE_DEPTH more are waiting,
+# further calls fail fast with PasswordHasherBusy (a 503) instead of queueing
+class PasswordHasher:
+    def __init__(self, app=None, bcrypt=None):
+        self.bcrypt = bcrypt
+        self.executor = None
+        self.pid = None
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, bcrypt)
+
+    def init_app(self, app, bcrypt):
+        self.bcrypt = bcrypt
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.slots = threading.BoundedSemaphore(self.workers + app.config['PASSWORD_HASH_QUEUE_DEPTH'])
+        app.extensions['password_hasher'] = self
+
+    # created on first use, and again in a forked worker since the pool's
+    # threads don't survive a fork. Under gevent the patched threads are
+    # greenlets, which would run bcrypt on the hub and stall every request,
+    # so use gevent's pool of real threads instead
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None or self.pid != os.getpid():
+                if gevent_enabled():
+                    from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+                    self.executor = GeventThreadPoolExecutor(max_workers=self.workers)
+                else:
+                    self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+                self.pid = os.getpid()
+            return self.executor
+
+    def run(self, func, *args):
+        # PASSWORD_HASH_WORKERS=0 hashes inline on the request thread
+        if not self.workers:
+            return func(*args)
+        if not self.slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        try:
+            return self.get_executor().submit(func, *args).result()
+        finally:
+            self.slots.release()
+
+    def generate_password_hash(self, password):
+        return self.run(self.bcrypt.generate_password_hash, password, self.rounds).decode('utf-8')
+
+    def check_password_hash(self, pw_hash, password):
+        return self.run(self.bcrypt.check_password_hash, pw_hash, password)
+
+    # bcrypt hashes look like $2b$12$..., where 12 is the cost they were made with
+    def needs_rehash(self, pw_hash):
+        try:
+            return int(pw_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
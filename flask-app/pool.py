@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+import weakref
+from functools import wraps
+
+from flask import current_app
+from sqlalchemy import event, exc, text
+from sqlalchemy.pool import NullPool, QueuePool
+
+
+# per-process connection pool counters; every gunicorn worker has its own
+# pool, so each reports its own numbers
+class PoolStats:
+    def __init__(self):
+        self.reset()
+
+    # also run in a forked child; a fresh lock, since the parent's may be
+    # held by a thread that doesn't exist in the child
+    def reset(self):
+        self.lock = threading.Lock()
+        with self.lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.connects = 0
+            self.invalidations = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+
+    def record_wait(self, seconds, timed_out=False):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self, pool=None):
+        with self.lock:
+            stats = {'pid': os.getpid(), 'checkouts': self.checkouts, 'timeouts': self.timeouts,
+                     'connects': self.connects, 'invalidations': self.invalidations,
+                     'wait_total_ms': round(self.wait_total * 1000, 3),
+                     'wait_avg_ms': round(self.wait_total * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                     'wait_max_ms': round(self.wait_max * 1000, 3)}
+        if isinstance(pool, QueuePool):
+            stats.update({'size': pool.size(), 'checked_in': pool.checkedin(),
+                          'checked_out': pool.checkedout(), 'overflow': pool.overflow()})
+        return stats
+
+
+pool_stats = PoolStats()
+
+
+# times how long each checkout waits for a connection, including opening a
+# new one when the pool is empty
+class TimedPoolMixin:
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_stats.record_wait(time.perf_counter() - start)
+        return connection
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedNullPool(TimedPoolMixin, NullPool):
+    pass
+
+
+for _pool_class in (TimedQueuePool, TimedNullPool):
+    event.listen(_pool_class, 'connect', lambda *args: pool_stats.count('connects'))
+    event.listen(_pool_class, 'invalidate', lambda *args: pool_stats.count('invalidations'))
+
+
+# gunicorn --preload (or multiprocessing) forks workers from a process that
+# may already hold pooled connections, and two processes talking over one
+# socket corrupt each other's sessions. The child drops the inherited pool
+# without closing the parent's connections, and opens its own on demand
+def dispose_pool_after_fork(app):
+    app_ref = weakref.ref(app)
+
+    def after_fork():
+        app = app_ref()
+        if app is None or 'sqlalchemy' not in app.extensions:
+            return
+        with app.app_context():
+            for engine in app.extensions['sqlalchemy'].engines.values():
+                engine.dispose(close=False)
+        pool_stats.reset()
+
+    os.register_at_fork(after_in_child=after_fork)
+
+
+# caps how long the route's queries may run, e.g.
+# @statement_timeout('STATEMENT_TIMEOUT_READ_MS'). SET LOCAL only lasts until
+# the transaction ends, so it suits pgbouncer's transaction mode; statements
+# after a commit fall back to the connection's default. A value of 0 lifts
+# the limit; non-postgres databases are left alone
+def statement_timeout(setting):
+    def decorator(func):
+        @wraps(func)
+        def decorated_view(*args, **kwargs):
+            db = current_app.extensions['sqlalchemy']
+            if db.engine.dialect.name == 'postgresql':
+                milliseconds = int(current_app.config[setting])
+                db.session.execute(text(f'SET LOCAL statement_timeout = {milliseconds}'))
+            return func(*args, **kwargs)
+        return decorated_view
+    return decorator
+
+
+def is_statement_timeout(error):
+    # 57014 is postgres' query_canceled
+    return getattr(getattr(error, 'orig', None), 'pgcode', None) == '57014'
@@ -0,0 +1,168 @@
+import itertools
+import logging
+import threading
+import time
+from functools import wraps
+
+import click
+from flask import current_app, g, has_request_context, request, session
+from flask.cli import AppGroup
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.sql.dml import UpdateBase
+
+
+logger = logging.getLogger(__name__)
+
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+# lag of a postgres standby in seconds; 0 once it has replayed everything it
+# received, NULL on a server that isn't a standby
+LAG_QUERY = text('SELECT CASE WHEN NOT pg_is_in_recovery() THEN NULL '
+                 'WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+                 'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END')
+
+
+def replica_binds(uris):
+    return {f'replica_{index}': uri for index, uri in enumerate(uris)}
+
+
+class Replica:
+    def __init__(self, key):
+        self.key = key
+        self.healthy = True
+        self.lag = None
+        self.error = None
+        self.checked_at = 0.0
+
+
+# sends the statements of read-only routes (@read_replica) to the replicas in
+# DATABASE_REPLICA_URIS, round robin, and everything else to the primary.
+# Replicas are checked at most every REPLICA_CHECK_INTERVAL seconds, on the
+# request that finds the last check too old; one that can't be reached or
+# lags more than REPLICA_MAX_LAG_SECONDS is skipped until a later check
+# passes. For REPLICA_READ_YOUR_WRITES_SECONDS after a client writes, its
+# reads go to the primary, so it sees its own change; the deadline rides in
+# the flask session cookie
+class ReplicaRouter:
+    def __init__(self, app=None):
+        self.replicas = []
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.replicas = [Replica(key) for key in replica_binds(app.config['DATABASE_REPLICA_URIS'])]
+        self.cycle = itertools.cycle(self.replicas)
+        self.check_interval = app.config['REPLICA_CHECK_INTERVAL']
+        self.max_lag = app.config['REPLICA_MAX_LAG_SECONDS']
+        self.read_your_writes = app.config['REPLICA_READ_YOUR_WRITES_SECONDS']
+        app.extensions['replica_router'] = self
+        if self.replicas:
+            app.after_request(self.remember_write)
+            with app.app_context():
+                for replica in self.replicas:
+                    event.listen(self.engine(replica), 'handle_error', self.connection_error(replica))
+
+    def engine(self, replica):
+        return current_app.extensions['sqlalchemy'].engines[replica.key]
+
+    def check(self, replica):
+        replica.checked_at = time.monotonic()
+        try:
+            engine = self.engine(replica)
+            with engine.connect() as connection:
+                lag = connection.execute(LAG_QUERY).scalar() if engine.dialect.name == 'postgresql' else None
+        except Exception as e:
+            replica.healthy, replica.error = False, str(getattr(e, 'orig', e))
+            logger.warning('replica %s failed its health check: %s', replica.key, replica.error)
+            return
+        replica.lag = float(lag) if lag is not None else None
+        replica.healthy = replica.lag is None or replica.lag <= self.max_lag
+        replica.error = None if replica.healthy else f'{replica.lag:.1f}s behind'
+
+    def connection_error(self, replica):
+        def handle_error(context):
+            if context.is_disconnect:
+                replica.healthy, replica.error = False, str(context.original_exception)
+        return handle_error
+
+    # the next healthy replica's engine, or None for the primary
+    def choose(self):
+        now = time.monotonic()
+        due = []
+        with self.lock:
+            for replica in self.replicas:
+                if now - replica.checked_at >= self.check_interval:
+                    replica.checked_at = now
+                    due.append(replica)
+        for replica in due:
+            self.check(replica)
+        with self.lock:
+            for _ in range(len(self.replicas)):
+                replica = next(self.cycle)
+                if replica.healthy:
+                    return self.engine(replica)
+        return None
+
+    def current(self):
+        if not has_request_context():
+            return None
+        return g.get('db_replica')
+
+    def use_primary(self):
+        if has_request_context():
+            g.db_replica = None
+
+    def remember_write(self, response):
+        if request.method in WRITE_METHODS and response.status_code < 400:
+            session['primary_until'] = time.time() + self.read_your_writes
+        return response
+
+    def status(self):
+        return [{'bind': replica.key, 'healthy': replica.healthy, 'lag_seconds': replica.lag,
+                 'error': replica.error} for replica in self.replicas]
+
+
+replica_router = ReplicaRouter()
+
+
+# marks a route as read-only, so its queries may go to a replica
+def read_replica(func):
+    @wraps(func)
+    def decorated_view(*args, **kwargs):
+        if replica_router.replicas and session.get('primary_until', 0) <= time.time():
+            g.db_replica = replica_router.choose()
+        return func(*args, **kwargs)
+    return decorated_view
+
+
+# db.session's class; routes statements to the replica picked for the
+# request. Flushes and INSERT/UPDATE/DELETE statements always go to the
+# primary, whatever the route
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not isinstance(clause, UpdateBase):
+            replica = replica_router.current()
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+replicas_cli = AppGroup('replicas', help='Read replica health.')
+
+
+@replicas_cli.command('check')
+def check_replicas():
+    """Check every replica now and print its health and lag."""
+    if not replica_router.replicas:
+        click.echo('No replicas configured (DATABASE_REPLICA_URIS).')
+        return
+    for replica in replica_router.replicas:
+        replica_router.check(replica)
+    for row in replica_router.status():
+        lag = '-' if row['lag_seconds'] is None else f"{row['lag_seconds']:.1f}s"
+        click.echo(f"{row['bind']}: {'healthy' if row['healthy'] else 'unhealthy'}, lag {lag}"
+                   + (f", {row['error']}" if row['error'] else ''))
+    if not all(row['healthy'] for row in replica_router.status()):
+        raise SystemExit(1)
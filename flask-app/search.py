@@ -0,0 +1,118 @@
+import re
+
+from flask import current_app, request, jsonify
+from sqlalchemy import DDL, event, select, text, union_all
+
+from models import db, CorruptionReport, PublicPetition
+
+
+SEARCH_MODELS = {model.__tablename__: model for model in (CorruptionReport, PublicPetition)}
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+# postgres: a generated tsvector column with a GIN index. Kept out of the
+# models so they stay usable on sqlite; attached whenever the tables are
+# created, and added to existing databases by migration 0b8d4f2e6a15
+def postgres_ddl(table):
+    return DDL(
+        f"ALTER TABLE {table} ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+        f"(to_tsvector('english', coalesce(title, '') || ' ' || coalesce(description, ''))) STORED; "
+        f"CREATE INDEX ix_{table}_search_vector ON {table} USING gin (search_vector)")
+
+
+# sqlite: an external content FTS5 table kept in sync by triggers
+def sqlite_ddl(table):
+    fts = f'{table}_fts'
+    return [
+        DDL(f"CREATE VIRTUAL TABLE {fts} USING fts5(title, description, content='{table}', content_rowid='id')"),
+        DDL(f"CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, title, description) VALUES (new.id, new.title, new.description); END"),
+        DDL(f"CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); END"),
+        DDL(f"CREATE TRIGGER {fts}_update AFTER UPDATE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); "
+            f"INSERT INTO {fts}(rowid, title, description) VALUES (new.id, new.title, new.description); END"),
+    ]
+
+
+for _table in SEARCH_MODELS:
+    event.listen(SEARCH_MODELS[_table].__table__, 'after_create',
+                 postgres_ddl(_table).execute_if(dialect='postgresql'))
+    for _ddl in sqlite_ddl(_table):
+        event.listen(SEARCH_MODELS[_table].__table__, 'after_create', _ddl.execute_if(dialect='sqlite'))
+    # the triggers go with the table, the FTS5 table has to be dropped too
+    event.listen(SEARCH_MODELS[_table].__table__, 'after_drop',
+                 DDL(f'DROP TABLE IF EXISTS {_table}_fts').execute_if(dialect='sqlite'))
+
+
+def postgres_matches(table, terms):
+    # parameters are named per table so they stay distinct inside the UNION
+    query = text(f"SELECT :{table}_kind AS kind, id, "
+                 f"ts_rank(search_vector, websearch_to_tsquery('english', :{table}_q)) AS rank "
+                 f"FROM {table} WHERE search_vector @@ websearch_to_tsquery('english', :{table}_q)")
+    return query.bindparams(**{f'{table}_kind': table, f'{table}_q': ' '.join(terms)}) \
+                .columns(kind=db.String, id=db.Integer, rank=db.Float)
+
+
+def sqlite_matches(table, terms):
+    # every term quoted, so user input can't trip the FTS5 query syntax
+    match = ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+    query = text(f"SELECT :{table}_kind AS kind, rowid AS id, -bm25({table}_fts) AS rank "
+                 f"FROM {table}_fts WHERE {table}_fts MATCH :{table}_match")
+    return query.bindparams(**{f'{table}_kind': table, f'{table}_match': match}) \
+                .columns(kind=db.String, id=db.Integer, rank=db.Float)
+
+
+# ranked ids across the requested tables, best match first; a page is
+# limit + 1 rows so we know whether there is another one
+def ranked_query(dialect, tables, terms, offset, limit):
+    matches = postgres_matches if dialect == 'postgresql' else sqlite_matches
+    combined = union_all(*[matches(table, terms) for table in tables]).subquery()
+    return (select(combined)
+            .order_by(combined.c.rank.desc(), combined.c.kind, combined.c.id)
+            .offset(offset).limit(limit + 1))
+
+
+def ranked_matches(tables, terms, offset, limit):
+    return db.session.execute(ranked_query(db.engine.dialect.name, tables, terms, offset, limit)).all()
+
+
+# /search?q=...&type=corruption_reports|public_petitions&limit=N&after=<cursor>
+def search_response():
+    terms = WORD.findall(request.args.get('q', ''))
+    if not terms:
+        return jsonify({'error': "'q' must contain at least one word"}), 400
+
+    kind = request.args.get('type')
+    if kind and kind not in SEARCH_MODELS:
+        return jsonify({'error': "'type' must be corruption_reports or public_petitions"}), 400
+    tables = [kind] if kind else list(SEARCH_MODELS)
+
+    try:
+        limit = min(int(request.args.get('limit', current_app.config['DEFAULT_PAGE_SIZE'])),
+                    current_app.config['MAX_PAGE_SIZE'])
+        offset = int(request.args.get('after', 0))
+    except ValueError:
+        return jsonify({'error': "'limit' and 'after' must be integers"}), 400
+    if limit < 1 or offset < 0:
+        return jsonify({'error': "'limit' must be positive and 'after' not negative"}), 400
+
+    matches = ranked_matches(tables, terms, offset, limit)
+    next_cursor = offset + limit if len(matches) > limit else None
+    matches = matches[:limit]
+
+    # one query per table for the page's rows
+    rows = {}
+    for table in tables:
+        ids = [match.id for match in matches if match.kind == table]
+        if ids:
+            model = SEARCH_MODELS[table]
+            rows.update({(table, row.id): row for row in model.query.filter(model.id.in_(ids))})
+
+    items = []
+    for match in matches:
+        row = rows.get((match.kind, match.id))
+        if row is not None:
+            items.append(dict(row.to_dict(), type=match.kind, rank=match.rank))
+
+    return jsonify({'items': items, 'next_cursor': next_cursor}), 200
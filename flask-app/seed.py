@@ -1,13 +1,49 @@
+import argparse
+import csv
+import io
+import random
+import time
+from multiprocessing import Pool
+
 from faker import Faker
-from models import db, CorruptionReport, User, PublicPetition
-from app import app
-from flask_bcrypt import Bcrypt
-bcrypt = Bcrypt(app)
+from sqlalchemy import insert, text
+from models import db, CorruptionReport, DeletedRecord, MediaAsset, User, PublicPetition, compute_content_hash
+from geo import encode_geohash
+from stats import rebuild_summary
+from app import create_app, bcrypt
+app = create_app()
 fake = Faker()
 
+# bulk mode generates and writes rows in chunks of this size; chunks are
+# seeded on their own, so the output doesn't depend on the number of workers
+CHUNK_SIZE = 10000
+BULK_PASSWORD = 'Password.123'
+STATUSES = ['Pending', 'Under Investigation', 'Rejected', 'Resolved']
+STATUS_WEIGHTS = [50, 20, 10, 20]
+AGENCY_POOL_SIZE = 200
+COUNTIES = [
+    'Mombasa', 'Kwale', 'Kilifi', 'Tana River', 'Lamu', 'Taita Taveta', 'Garissa', 'Wajir', 'Mandera', 'Marsabit',
+    'Isiolo', 'Meru', 'Tharaka Nithi', 'Embu', 'Kitui', 'Machakos', 'Makueni', 'Nyandarua', 'Nyeri', 'Kirinyaga',
+    "Murang'a", 'Kiambu', 'Turkana', 'West Pokot', 'Samburu', 'Trans Nzoia', 'Uasin Gishu', 'Elgeyo Marakwet',
+    'Nandi', 'Baringo', 'Laikipia', 'Nakuru', 'Narok', 'Kajiado', 'Kericho', 'Bomet', 'Kakamega', 'Vihiga',
+    'Bungoma', 'Busia', 'Siaya', 'Kisumu', 'Homa Bay', 'Migori', 'Kisii', 'Nyamira', 'Nairobi',
+]
+USER_COLUMNS = ('fullname', 'email', 'password', 'id_passport_no', 'role')
+REPORT_COLUMNS = ('govt_agency', 'county', 'title', 'description', 'media', 'status',
+                  'latitude', 'longitude', 'user_id', 'content_hash', 'geohash')
+
+
+def random_location(rng):
+    # roughly Kenya's bounding box
+    return round(rng.uniform(-4.7, 4.6), 6), round(rng.uniform(33.9, 41.9), 6)
+
+
 def seed_database():
     with app.app_context():
-        # Delete existing data
+        # Delete existing data. The tombstones go too: the new rows may get
+        # the old ids, and a sync would report them deleted
+        db.session.query(DeletedRecord).delete()
+        db.session.query(MediaAsset).delete()
         db.session.query(CorruptionReport).delete()
         db.session.query(PublicPetition).delete()
         db.session.query(User).delete()
@@ -21,20 +57,27 @@ def seed_database():
             User(fullname="Victor Njoroge", email="victorn@example.com", password=bcrypt.generate_password_hash("VictorN.123").decode('utf-8'), id_passport_no=56789012, role="admin"),
             User(fullname="Ann Irungu", email="ann@example.com", password=bcrypt.generate_password_hash("Ann.123").decode('utf-8'), id_passport_no=67890123, role="user")
         ]
-        
+
         db.session.add_all(users)
-        db.session.commit()    
+        db.session.commit()
+
+        user_ids = [user.id for user in users]
+        rng = random.Random()
 
-       
         # Create sample corruption reports
         for _ in range(10):  # Generate 10 corruption reports
+            latitude, longitude = random_location(rng)
             report = CorruptionReport(
                 govt_agency=fake.company(),
                 county=fake.city(),
                 title=fake.sentence(),
                 description=fake.paragraph(),
-                user_id=fake.random_element(elements=User.query.all()).id
+                latitude=latitude,
+                longitude=longitude,
+                user_id=fake.random_element(elements=user_ids)
             )
+            report.refresh_content_hash()
+            report.refresh_geohash()
             db.session.add(report)
 
         db.session.commit()
@@ -42,19 +85,138 @@ def seed_database():
 
         # Create sample public petitions
         for _ in range(5):  # Generate 5 public petitions
+            latitude, longitude = random_location(rng)
             petition = PublicPetition(
                 govt_agency=fake.company(),
                 county=fake.city(),
                 title=fake.sentence(),
                 description=fake.paragraph(),
-                user_id=fake.random_element(elements=User.query.all()).id
+                latitude=latitude,
+                longitude=longitude,
+                user_id=fake.random_element(elements=user_ids)
             )
+            petition.refresh_content_hash()
+            petition.refresh_geohash()
             db.session.add(petition)
 
         db.session.commit()
 
+        rebuild_summary()
+        db.session.commit()
+
         print("Done seeding!")
 
+
+# one chunk of rows as tuples in USER_COLUMNS or REPORT_COLUMNS order; runs
+# in the worker processes
+def generate_chunk(task):
+    kind, start, count, seed, users, password = task
+    chunk_seed = f'{seed}:{kind}:{start}'
+    rng = random.Random(chunk_seed)
+    faker = Faker()
+    faker.seed_instance(chunk_seed)
+    # drawn from fixed pools, like real data, so the filters have something
+    # to group on; it's also much cheaper than a faker call per row
+    agency_faker = Faker()
+    agency_faker.seed_instance(f'{seed}:agencies')
+    agencies = [agency_faker.company()[:200] for _ in range(AGENCY_POOL_SIZE)]
+
+    rows = []
+    for n in range(start, start + count):
+        if kind == 'users':
+            rows.append((faker.name(), f'user{n}@example.com', password, 10000000 + n,
+                         'admin' if n % 50 == 0 else 'user'))
+            continue
+
+        latitude, longitude = random_location(rng)
+        values = {'govt_agency': rng.choice(agencies), 'county': rng.choice(COUNTIES),
+                  'title': faker.sentence(nb_words=8)[:200], 'description': faker.paragraph(nb_sentences=4)[:600],
+                  'media': [f'https://res.cloudinary.com/demo/image/upload/{kind}/{n}.jpg'] if rng.random() < 0.6 else None,
+                  'status': rng.choices(STATUSES, STATUS_WEIGHTS)[0], 'latitude': latitude, 'longitude': longitude,
+                  'user_id': rng.randint(1, users)}
+        values['content_hash'] = compute_content_hash(values)
+        values['geohash'] = encode_geohash(latitude, longitude)
+        rows.append(tuple(values[column] for column in REPORT_COLUMNS))
+    return rows
+
+
+def generated_chunks(kind, total, seed, users, password, workers):
+    tasks = [(kind, start, min(CHUNK_SIZE, total + 1 - start), seed, users, password)
+             for start in range(1, total + 1, CHUNK_SIZE)]
+    if workers <= 1:
+        for task in tasks:
+            yield generate_chunk(task)
+        return
+    with Pool(workers) as pool:
+        # imap keeps the chunks in order
+        for rows in pool.imap(generate_chunk, tasks):
+            yield rows
+
+
+def copy_value(value):
+    if isinstance(value, list):
+        # postgres array literal
+        return '{' + ','.join('"' + item.replace('\\', '\\\\').replace('"', '\\"') + '"' for item in value) + '}'
+    return value
+
+
+# COPY on postgres; multi-row inserts anywhere else
+def write_rows(table, columns, rows):
+    if db.engine.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows([copy_value(value) for value in row] for row in rows)
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.close()
+    else:
+        db.session.execute(insert(db.metadata.tables[table]), [dict(zip(columns, row)) for row in rows])
+
+
+def reset_tables():
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text('TRUNCATE report_stats, deleted_records, media_assets, corruption_reports, '
+                                'public_petitions, users RESTART IDENTITY'))
+    else:
+        for model in (DeletedRecord, MediaAsset, CorruptionReport, PublicPetition, User):
+            db.session.query(model).delete()
+
+
+def bulk_seed(users, reports, petitions, seed, workers):
+    # every user gets the same password, hashed once
+    password = bcrypt.generate_password_hash(BULK_PASSWORD).decode('utf-8')
+    with app.app_context():
+        reset_tables()
+        db.session.commit()
+        for table, total, columns in (('users', users, USER_COLUMNS),
+                                      ('corruption_reports', reports, REPORT_COLUMNS),
+                                      ('public_petitions', petitions, REPORT_COLUMNS)):
+            start = time.perf_counter()
+            for rows in generated_chunks(table, total, seed, users, password, workers):
+                write_rows(table, columns, rows)
+                # a commit per chunk keeps the transaction small
+                db.session.commit()
+            print(f'{table}: {total} rows in {time.perf_counter() - start:.1f}s')
+
+        rebuild_summary()
+        db.session.commit()
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(text('ANALYZE users, corruption_reports, public_petitions, report_stats'))
+            db.session.commit()
+        print(f'Done seeding! Every user logs in with {BULK_PASSWORD}')
+
+
 if __name__ == '__main__':
-    seed_database()
+    parser = argparse.ArgumentParser(description='Seed the database. Without --bulk, adds a few sample rows.')
+    parser.add_argument('--bulk', action='store_true', help='generate a large, deterministic data set')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--reports', type=int, default=100000)
+    parser.add_argument('--petitions', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=4, help='processes generating rows')
+    args = parser.parse_args()
 
+    if args.bulk:
+        bulk_seed(args.users, args.reports, args.petitions, args.seed, args.workers)
+    else:
+        seed_database()
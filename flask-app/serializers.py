@@ -0,0 +1,65 @@
+from datetime import date
+from operator import attrgetter
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib json provider is used without it
+    orjson = None
+
+
+# turns a model instance into a dict of its serialize_only columns; the
+# attribute getter is built once per model instead of inspecting the mapper
+# on every row like sqlalchemy_serializer does
+class ModelSerializer:
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self.getter = attrgetter(*self.fields)
+
+    def __call__(self, obj):
+        return dict(zip(self.fields, self.getter(obj)))
+
+
+class SerializerMixin:
+    serialize_only = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.serialize_only:
+            cls.serializer = ModelSerializer(cls.serialize_only)
+
+    def to_dict(self):
+        return self.serializer(self)
+
+
+# flask writes datetimes as HTTP dates; the timestamps go out as ISO 8601,
+# the same as orjson writes them, so clients can send them back in ?since=
+class JSONProvider(DefaultJSONProvider):
+    @staticmethod
+    def default(obj):
+        if isinstance(obj, date):
+            return obj.isoformat()
+        return DefaultJSONProvider.default(obj)
+
+
+class OrjsonProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return self.dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def dumps_bytes(self, obj):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
+
+
+def init_json_provider(app):
+    app.json = OrjsonProvider(app) if orjson is not None else JSONProvider(app)
@@ -0,0 +1,118 @@
+import sys
+from collections import Counter, defaultdict
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import delete, func, insert, literal, select
+
+from models import db, ReportStat, CorruptionReport, PublicPetition, insert_statement
+
+
+REPORT_MODELS = {model.__tablename__: model for model in (CorruptionReport, PublicPetition)}
+
+
+def stat_key(row):
+    if not isinstance(row, dict):
+        row = {field: getattr(row, field) for field in ('status', 'county', 'govt_agency')}
+    # the summary table's key columns can't be NULL
+    return (row.get('status') or '', row.get('county') or '', row.get('govt_agency') or '')
+
+
+# collects count changes for one report table during a request and writes
+# them with a single upsert in the request's transaction, so the summary
+# moves together with the rows it counts
+class StatsChanges:
+    def __init__(self, model):
+        self.kind = model.__tablename__
+        self.deltas = Counter()
+
+    def add(self, row):
+        self.deltas[stat_key(row)] += 1
+        return self
+
+    def remove(self, row):
+        self.deltas[stat_key(row)] -= 1
+        return self
+
+    def move(self, old_key, row):
+        new_key = stat_key(row)
+        if old_key != new_key:
+            self.deltas[old_key] -= 1
+            self.deltas[new_key] += 1
+        return self
+
+    def apply(self):
+        # sorted so concurrent requests lock the summary rows in the same order
+        rows = [{'kind': self.kind, 'status': status, 'county': county, 'govt_agency': govt_agency, 'count': delta}
+                for (status, county, govt_agency), delta in sorted(self.deltas.items()) if delta]
+        self.deltas.clear()
+        if not rows:
+            return
+        statement = insert_statement(ReportStat).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=['kind', 'status', 'county', 'govt_agency'],
+            set_={'count': ReportStat.count + statement.excluded['count']})
+        db.session.execute(statement)
+
+
+def current_stats():
+    stats = {}
+    for kind in REPORT_MODELS:
+        stats[kind] = {'total': 0, 'by_status': defaultdict(int), 'by_county': defaultdict(int),
+                       'by_govt_agency': defaultdict(int)}
+    for row in db.session.execute(select(ReportStat).where(ReportStat.count != 0)).scalars():
+        summary = stats[row.kind]
+        summary['total'] += row.count
+        summary['by_status'][row.status] += row.count
+        summary['by_county'][row.county] += row.count
+        summary['by_govt_agency'][row.govt_agency] += row.count
+    return stats
+
+
+def grouped_select(model):
+    key = [func.coalesce(model.status, ''), func.coalesce(model.county, ''), func.coalesce(model.govt_agency, '')]
+    return select(*key, func.count()).group_by(*key)
+
+
+def grouped_counts(model):
+    return {tuple(row[:3]): row[3] for row in db.session.execute(grouped_select(model))}
+
+
+def summary_counts(kind):
+    rows = db.session.execute(select(ReportStat.status, ReportStat.county, ReportStat.govt_agency, ReportStat.count)
+                              .where(ReportStat.kind == kind, ReportStat.count != 0))
+    return {tuple(row[:3]): row[3] for row in rows}
+
+
+# recounts the summary in the current transaction; the caller commits
+def rebuild_summary():
+    for kind, model in REPORT_MODELS.items():
+        db.session.execute(delete(ReportStat).where(ReportStat.kind == kind))
+        grouped = grouped_select(model).add_columns(literal(kind))
+        db.session.execute(insert(ReportStat).from_select(
+            ['status', 'county', 'govt_agency', 'count', 'kind'], grouped))
+
+
+stats_cli = AppGroup('stats', help='Check or rebuild the admin dashboard statistics.')
+
+
+@stats_cli.command('check')
+def check_stats():
+    """Compare the summary table against a full GROUP BY of the report tables."""
+    mismatches = 0
+    for kind, model in REPORT_MODELS.items():
+        expected, actual = grouped_counts(model), summary_counts(kind)
+        for key in sorted(set(expected) | set(actual)):
+            if expected.get(key, 0) != actual.get(key, 0):
+                mismatches += 1
+                click.echo(f'{kind} {key}: summary has {actual.get(key, 0)}, table has {expected.get(key, 0)}')
+    click.echo(f'{mismatches} mismatched rows')
+    sys.exit(1 if mismatches else 0)
+
+
+@stats_cli.command('rebuild')
+def rebuild_stats():
+    """Recompute the summary table from the report tables."""
+    rebuild_summary()
+    db.session.commit()
+    click.echo('Statistics rebuilt')
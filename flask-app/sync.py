@@ -0,0 +1,125 @@
+import base64
+import json
+import re
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask import current_app, jsonify, request
+from flask.cli import AppGroup
+from sqlalchemy import delete, func, select, tuple_
+
+from models import db, DeletedRecord
+from pagination import PaginationError, get_page_args
+
+
+# a time followed by ' hh:mm'
+UNENCODED_OFFSET = re.compile(r'(\d\d:\d\d(?::\d\d(?:\.\d+)?)?) (\d\d:\d\d)$')
+
+
+class SyncError(ValueError):
+    pass
+
+
+def as_utc(value):
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def database_now():
+    return as_utc(db.session.execute(select(func.now())).scalar())
+
+
+# written with a Z rather than +00:00, whose '+' reads as a space when the
+# value is put in a query string unencoded
+def format_since(value):
+    return value.isoformat().replace('+00:00', 'Z')
+
+
+# ?since= takes the `since` of the previous sync, or any ISO 8601 time; one
+# without an offset is read as UTC. A space before the offset is taken for
+# the '+' an unencoded query string turned into one
+def parse_since(value):
+    value = UNENCODED_OFFSET.sub(r'\1+\2', value.strip().replace('Z', '+00:00'))
+    try:
+        return as_utc(datetime.fromisoformat(value))
+    except ValueError:
+        raise SyncError("'since' must be an ISO 8601 timestamp, e.g. 2024-05-01T12:00:00Z")
+
+
+def parse_user_id(value):
+    try:
+        return int(value)
+    except ValueError:
+        raise SyncError("'user_id' must be an integer")
+
+
+# the cursor of a multi-page sync holds the last (updated_at, id) sent and
+# the time the sync started, so every page hands back the same `since`
+def encode_cursor(row, started):
+    value = json.dumps([row.updated_at.isoformat(), row.id, started.isoformat()]).encode('utf-8')
+    return base64.urlsafe_b64encode(value).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        updated_at, last_id, started = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return (as_utc(datetime.fromisoformat(updated_at)), int(last_id)), as_utc(datetime.fromisoformat(started))
+    except (ValueError, TypeError):
+        raise SyncError("'after' is not a valid cursor")
+
+
+# rows created or changed after ?since= (every row without it), oldest
+# change first and paged like the list routes, plus on the first page the
+# ids deleted since then. Apply `deleted` before `items`. The `since` to send
+# next time lies SYNC_OVERLAP_SECONDS before the sync started, so rows from
+# transactions still open when it ran are picked up next time; clients may
+# see a row twice and keep the higher version
+def changes_response(model):
+    try:
+        since = request.args.get('since')
+        since = parse_since(since) if since else None
+        user_id = request.args.get('user_id')
+        user_id = parse_user_id(user_id) if user_id else None
+        after, limit = get_page_args()
+        position, started = decode_cursor(after) if after is not None else (None, database_now())
+    except (SyncError, PaginationError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    if since is not None and since < started - timedelta(days=current_app.config['SYNC_TOMBSTONE_DAYS']):
+        return jsonify({'error': "Deletions that old are no longer kept; sync again without 'since'"}), 410
+
+    query = model.query
+    if user_id is not None:
+        query = query.filter(model.user_id == user_id)
+    if since is not None:
+        query = query.filter(model.updated_at > since)
+    if position is not None:
+        query = query.filter(tuple_(model.updated_at, model.id) > position)
+    rows = query.order_by(model.updated_at, model.id).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1], started)
+
+    deleted = []
+    if since is not None and position is None:
+        conditions = [DeletedRecord.kind == model.__tablename__, DeletedRecord.deleted_at > since]
+        if user_id is not None:
+            conditions.append(DeletedRecord.user_id == user_id)
+        deleted = list(db.session.execute(select(DeletedRecord.record_id).where(*conditions)
+                                          .order_by(DeletedRecord.id)).scalars())
+
+    next_since = started - timedelta(seconds=current_app.config['SYNC_OVERLAP_SECONDS'])
+    return jsonify({'items': [row.to_dict() for row in rows], 'deleted': deleted,
+                    'next_cursor': next_cursor, 'since': format_since(next_since)}), 200
+
+
+sync_cli = AppGroup('sync', help='Delta sync tombstones.')
+
+
+@sync_cli.command('prune')
+def prune_tombstones():
+    """Delete tombstones older than SYNC_TOMBSTONE_DAYS."""
+    cutoff = database_now() - timedelta(days=current_app.config['SYNC_TOMBSTONE_DAYS'])
+    result = db.session.execute(delete(DeletedRecord).where(DeletedRecord.deleted_at < cutoff))
+    db.session.commit()
+    click.echo(f'Removed {result.rowcount} tombstones older than {cutoff.isoformat()}.')
@@ -0,0 +1,224 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, send_from_directory
+from sqlalchemy import select
+from werkzeug.utils import secure_filename
+
+from green import gevent_enabled
+from images import compress_image
+from models import db, MediaAsset, insert_statement
+
+
+logger = logging.getLogger(__name__)
+
+JOB_ID = re.compile(r'[0-9a-f]{32}')
+CHUNK_SIZE = 64 * 1024
+
+
+class CloudinaryStorage:
+    def upload(self, path):
+        # imported on first upload so workers don't pay for it at boot
+        import cloudinary.uploader
+        from utils import cloudinary_config  # configures the cloudinary account
+
+        return cloudinary.uploader.upload(path)['secure_url']
+
+
+# stand-in for Cloudinary in tests and local runs: copies the file into a
+# directory and hands back a URL under MEDIA_LOCAL_URL, which the app serves
+# itself when it's a path. Not meant for production: the files stay on the
+# one node and every worker streams them
+class LocalStorage:
+    def __init__(self, root, base_url):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip('/')
+        os.makedirs(self.root, exist_ok=True)
+
+    def init_app(self, app):
+        if self.base_url.startswith('/'):
+            app.add_url_rule(f'{self.base_url}/<path:filename>', 'media', self.serve)
+
+    def serve(self, filename):
+        return send_from_directory(self.root, filename)
+
+    def upload(self, path):
+        name = os.path.basename(path)
+        shutil.copyfile(path, os.path.join(self.root, name))
+        return f'{self.base_url}/{name}'
+
+
+STORAGE_BACKENDS = {
+    'cloudinary': lambda config: CloudinaryStorage(),
+    'local': lambda config: LocalStorage(config['MEDIA_LOCAL_ROOT'], config['MEDIA_LOCAL_URL']),
+}
+
+
+# accepts uploads into a local spool directory and pushes them to the
+# storage backend from a background pool, retrying with backoff. Job state
+# lives in a JSON file next to the spooled upload, so any worker on the same
+# node can answer /uploads/<job_id>, until it's swept UPLOAD_JOB_TTL seconds
+# after its last change. Uploads are content addressed: a file
+# whose sha256 is already in media_assets is answered with its url at once,
+# and new images are downscaled to MEDIA_MAX_DIMENSION before they go out
+class UploadQueue:
+    def __init__(self, app=None):
+        self.executor = None
+        self.pid = None
+        self.swept_at = 0.0
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.spool_dir = app.config['UPLOAD_SPOOL_DIR'] or os.path.join(tempfile.gettempdir(), 'ireporter-uploads')
+        self.workers = app.config['UPLOAD_WORKERS']
+        self.max_retries = app.config['UPLOAD_MAX_RETRIES']
+        self.job_ttl = app.config['UPLOAD_JOB_TTL']
+        self.max_dimension = app.config['MEDIA_MAX_DIMENSION']
+        self.quality = app.config['MEDIA_IMAGE_QUALITY']
+        self.storage = STORAGE_BACKENDS[app.config['MEDIA_STORAGE']](app.config)
+        if hasattr(self.storage, 'init_app'):
+            self.storage.init_app(app)
+        os.makedirs(self.spool_dir, exist_ok=True)
+        app.extensions['upload_queue'] = self
+
+    # created on first use, and again in a forked worker. Under gevent the
+    # patched threads are greenlets, and image compression would stall every
+    # request on the hub, so use gevent's pool of real threads instead
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None or self.pid != os.getpid():
+                if gevent_enabled():
+                    from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+                    self.executor = GeventThreadPoolExecutor(max_workers=self.workers)
+                else:
+                    self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='upload')
+                self.pid = os.getpid()
+            return self.executor
+
+    def job_path(self, job_id):
+        return os.path.join(self.spool_dir, f'{job_id}.json')
+
+    def save_job(self, job):
+        # write-then-rename so readers never see a half written file
+        path = self.job_path(job['id'])
+        with open(path + '.tmp', 'w') as f:
+            json.dump(job, f)
+        os.replace(path + '.tmp', path)
+
+    def get_job(self, job_id):
+        if not JOB_ID.fullmatch(job_id):
+            return None
+        try:
+            with open(self.job_path(job_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    # removes job files, and uploads left behind by a worker that died, once
+    # they're UPLOAD_JOB_TTL seconds old. Runs on a submit at most once a
+    # minute per process; a job still retrying rewrites its file every attempt
+    def sweep(self):
+        now = time.time()
+        with self.lock:
+            if now - self.swept_at < min(self.job_ttl, 60):
+                return
+            self.swept_at = now
+        for entry in os.scandir(self.spool_dir):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < now - self.job_ttl:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                # another worker swept it first
+                pass
+
+    # spools the werkzeug FileStorage to disk and queues it; returns the job,
+    # already done when the same bytes were uploaded before
+    def submit(self, file):
+        self.sweep()
+        job_id = uuid.uuid4().hex
+        extension = os.path.splitext(secure_filename(file.filename))[1]
+        path = os.path.join(self.spool_dir, job_id + extension)
+        # hashed as it's spooled, so the upload is only read once
+        digest, size = hashlib.sha256(), 0
+        with open(path, 'wb') as f:
+            for chunk in iter(lambda: file.stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+
+        job = {'id': job_id, 'status': 'queued', 'filename': file.filename,
+               'url': None, 'error': None, 'attempts': 0,
+               'sha256': digest.hexdigest(), 'size': size, 'content_type': file.mimetype}
+        url = db.session.execute(select(MediaAsset.url).where(MediaAsset.sha256 == job['sha256'])).scalar()
+        if url is not None:
+            os.remove(path)
+            job.update(status='done', url=url, deduplicated=True)
+            self.save_job(job)
+            return job
+
+        self.save_job(job)
+        self.get_executor().submit(self.process, current_app._get_current_object(), dict(job), path)
+        return job
+
+    def process(self, app, job, path):
+        compressed = None
+        try:
+            if self.max_dimension:
+                compressed = compress_image(path, self.max_dimension, self.quality)
+            upload_path = compressed or path
+            job['stored_size'] = os.path.getsize(upload_path)
+            job['status'] = 'uploading'
+            while True:
+                job['attempts'] += 1
+                self.save_job(job)
+                try:
+                    job['url'] = self.storage.upload(upload_path)
+                    job['status'] = 'done'
+                    break
+                except Exception as e:
+                    logger.warning('upload %s failed (attempt %d): %s', job['id'], job['attempts'], e)
+                    if job['attempts'] > self.max_retries:
+                        job['status'] = 'failed'
+                        job['error'] = str(e)
+                        break
+                    time.sleep(2 ** (job['attempts'] - 1))
+            if job['status'] == 'done':
+                with app.app_context():
+                    self.record(job)
+            self.save_job(job)
+        finally:
+            for spooled in (path, compressed):
+                if spooled is not None and os.path.exists(spooled):
+                    os.remove(spooled)
+
+    # remembers the upload's url under its hash. When the same file was
+    # being uploaded at the same time and got in first, the job takes that
+    # url so every copy of the file points at one stored asset
+    def record(self, job):
+        try:
+            statement = (insert_statement(MediaAsset)
+                         .values(sha256=job['sha256'], url=job['url'], content_type=job['content_type'],
+                                 size=job['size'], stored_size=job['stored_size'])
+                         .on_conflict_do_nothing(index_elements=['sha256']))
+            db.session.execute(statement)
+            job['url'] = db.session.execute(
+                select(MediaAsset.url).where(MediaAsset.sha256 == job['sha256'])).scalar()
+            db.session.commit()
+        except Exception as e:
+            # the upload itself went through; only later duplicates miss out
+            db.session.rollback()
+            logger.warning('could not record media asset for upload %s: %s', job['id'], e)
+
+
+upload_queue = UploadQueue()
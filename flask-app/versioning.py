@@ -0,0 +1,98 @@
+import re
+
+from flask import request
+from sqlalchemy import delete, insert, select, update
+
+from models import db, DeletedRecord
+
+
+ETAG = re.compile(r'(?:W/)?"?(\d+)"?')
+# the columns the dashboard statistics are keyed on
+STAT_FIELDS = ('status', 'county', 'govt_agency')
+
+
+class PreconditionError(ValueError):
+    pass
+
+
+# the row version a client expects, from If-Match: "3"; None (no header, or
+# If-Match: *) means write whatever the current version is
+def if_match_version():
+    value = request.headers.get('If-Match', '').strip()
+    if not value or value == '*':
+        return None
+    match = ETAG.fullmatch(value)
+    if match is None:
+        raise PreconditionError("'If-Match' must be the version of the record, e.g. \"3\"")
+    return int(match.group(1))
+
+
+def version_etag(version):
+    return f'"{version}"'
+
+
+def row_conditions(model, id, version):
+    conditions = [model.id == id]
+    if version is not None:
+        conditions.append(model.version == version)
+    return conditions
+
+
+# updates one row and bumps its version in a single statement. Returns the
+# row's old status/county/govt_agency (and `old_fields`) and the `returning`
+# columns after the update as two dicts, or None when the row is missing or
+# not at `version`
+def update_row(model, id, values, version, returning=(), old_fields=()):
+    values = dict(values, version=model.version + 1)
+    returning = [model.user_id, model.version, *returning]
+    old_fields = STAT_FIELDS + tuple(field for field in old_fields if field not in STAT_FIELDS)
+
+    if db.engine.dialect.name != 'postgresql':
+        # sqlite can't return columns of an UPDATE's FROM clause, so read
+        # the old key first; sqlite runs one writer at a time anyway
+        old = db.session.execute(select(*[getattr(model, field) for field in old_fields])
+                                 .where(*row_conditions(model, id, version))).first()
+        if old is None:
+            return None
+        row = db.session.execute(update(model).where(*row_conditions(model, id, version)).values(**values)
+                                 .returning(*returning).execution_options(synchronize_session=False)).first()
+        if row is None:
+            return None
+        return dict(old._mapping), dict(row._mapping)
+
+    # the locked self-join hands back the row as it was before the update,
+    # without a separate SELECT round trip
+    old = (select(model.id, *[getattr(model, field) for field in old_fields])
+           .where(model.id == id).with_for_update().subquery('old'))
+    statement = (update(model)
+                 .where(model.id == old.c.id, *row_conditions(model, id, version))
+                 .values(**values)
+                 .returning(*[old.c[field].label('old_' + field) for field in old_fields], *returning)
+                 .execution_options(synchronize_session=False))
+    row = db.session.execute(statement).first()
+    if row is None:
+        return None
+    row = dict(row._mapping)
+    return {field: row.pop('old_' + field) for field in old_fields}, row
+
+
+# deletes one row in a single statement and leaves a tombstone for
+# /changes; returns its user_id and statistics key, or None when the row is
+# missing or not at `version`
+def delete_row(model, id, version):
+    statement = (delete(model)
+                 .where(*row_conditions(model, id, version))
+                 .returning(model.user_id, *[getattr(model, field) for field in STAT_FIELDS])
+                 .execution_options(synchronize_session=False))
+    row = db.session.execute(statement).first()
+    if row is None:
+        return None
+    db.session.execute(insert(DeletedRecord).values(kind=model.__tablename__, record_id=id, user_id=row.user_id))
+    return dict(row._mapping)
+
+
+# after a write matched no row: was it missing (404) or edited since the
+# client read it (409)?
+def missing_or_conflict(model, id):
+    current = db.session.execute(select(model.version).where(model.id == id)).scalar()
+    return (404, None) if current is None else (409, current)